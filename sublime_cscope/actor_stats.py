@@ -0,0 +1,94 @@
+import threading
+from collections import deque
+
+# The number of recent samples kept by each histogram
+DEFAULT_WINDOW = 256
+
+
+class RollingHistogram:
+    """
+    Keeps the most recent samples of a value, so that percentiles reflect
+    what the actor is doing now rather than since it was started. The total
+    number of samples ever added is kept as well, in count.
+    """
+
+    __slots__ = ('_samples', 'count')
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, value):
+        self._samples.append(value)
+        self.count += 1
+
+    def percentile(self, p):
+        """ Returns the p:th percentile (0-100) of the recent samples, or 0 """
+        if not self._samples:
+            return 0
+
+        samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    @property
+    def max(self):
+        return max(self._samples) if self._samples else 0
+
+    @property
+    def sum(self):
+        return sum(self._samples)
+
+
+class ActorStats:
+    """
+    Runtime metrics of an actor: the depth of its mailbox when a message is
+    received and, per message name, the time messages waited in the mailbox
+    and the time their handler ran. Recorded by the actor thread and read by
+    any thread.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self._window = window
+        self._lock = threading.Lock()
+        self._mailbox_depth = RollingHistogram(window)
+        # {message name: (wait time histogram, handler time histogram)}
+        self._messages = {}
+
+    def record(self, name, depth, wait_time, handler_time):
+        with self._lock:
+            self._mailbox_depth.add(depth)
+
+            histograms = self._messages.get(name, None)
+            if not histograms:
+                histograms = (RollingHistogram(self._window), RollingHistogram(self._window))
+                self._messages[name] = histograms
+
+            if wait_time is not None:
+                histograms[0].add(wait_time)
+            histograms[1].add(handler_time)
+
+    def summary(self):
+        """ Returns a list of lines describing the recent activity """
+        with self._lock:
+            depth = self._mailbox_depth
+            lines = ["%d messages, mailbox depth p50 %d, p90 %d, max %d" %
+                        (depth.count, depth.percentile(50), depth.percentile(90), depth.max)]
+
+            # Where the time goes first
+            for name, (wait, handler) in sorted(self._messages.items(),
+                                                key=lambda i: -i[1][1].sum):
+                lines.append("  %-24s %6d calls, wait p50 %s p90 %s max %s, "
+                             "run p50 %s p90 %s max %s" %
+                                (name, handler.count,
+                                 _ms(wait.percentile(50)), _ms(wait.percentile(90)), _ms(wait.max),
+                                 _ms(handler.percentile(50)), _ms(handler.percentile(90)),
+                                 _ms(handler.max)))
+
+        return lines
+
+
+def _ms(seconds):
+    return '%.1fms' % (seconds * 1000)
@@ -0,0 +1,91 @@
+import os
+import time
+
+
+class BenchWindow:
+    """
+    Minimal stand-in for sublime.Window that is good enough
+    for creating an IndexerConfig outside of a real project.
+    """
+    def __init__(self, proj_file, folders, view_settings=None):
+        self._proj_file = proj_file
+        self._proj_data = {'folders': folders}
+        self._view = BenchView(view_settings or {})
+
+    def id(self):
+        return 0
+
+    def window(self):
+        return self
+
+    def folders(self):
+        return [f['path'] for f in self._proj_data['folders']]
+
+    def project_file_name(self):
+        return self._proj_file
+
+    def project_data(self):
+        return self._proj_data
+
+    def active_view(self):
+        return self._view
+
+
+class BenchView:
+    def __init__(self, settings):
+        self._settings = BenchSettings(settings)
+
+    def settings(self):
+        return self._settings
+
+
+class BenchSettings:
+    def __init__(self, settings):
+        self._settings = settings
+
+    def get(self, key, default=None):
+        return self._settings.get(key, default)
+
+
+def gen_file_tree(root, levels=3, subdirs=8, files=20,
+                  exts=('.c', '.h', '.o', '.d')):
+    """ Generates a tree with subdirs**levels folders and files*len(exts) files in each """
+    count = 0
+
+    for i in range(files):
+        for ext in exts:
+            with open(os.path.join(root, 'file%d%s' % (i, ext)), 'w') as f:
+                f.write('x' * i)
+            count += 1
+
+    if levels > 0:
+        for i in range(subdirs):
+            sub = os.path.join(root, 'dir%d' % i)
+            os.mkdir(sub)
+            count += gen_file_tree(sub, levels - 1, subdirs, files, exts)
+
+    return count
+
+
+def measure(func, repeat=3):
+    """ Returns the best wall clock time out of 'repeat' runs of func """
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def run_all():
+    from . import bench_crawler
+    from . import bench_pattern_matcher
+    from . import bench_file_index
+    from . import bench_actor
+
+    for bench in (bench_crawler, bench_pattern_matcher, bench_file_index, bench_actor):
+        bench.run()
@@ -0,0 +1,77 @@
+import tracemalloc
+from queue import Queue
+
+from . import measure
+from .. import indexer
+
+
+class _QueueMsg:
+    """ The design used before futures, with a Queue per synchronous message """
+
+    def __init__(self, action, wait_for_result=False):
+        self._action = action
+        self._result = Queue() if wait_for_result else None
+
+    def run(self):
+        try:
+            res = self._action()
+        except Exception as e:
+            res = e
+        self._result.put(res)
+
+    def result(self):
+        res = self._result.get()
+        if isinstance(res, Exception):
+            raise res
+        return res
+
+
+class _EchoActor(indexer.ActorBase):
+    def handle_message(self, msg):
+        msg.run()
+
+
+def _round_trips(actor, msg_class, count):
+    for i in range(count):
+        msg = msg_class(lambda: i, wait_for_result=True)
+        actor.send(msg)
+        msg.result()
+
+
+def _allocations(msg_class, count):
+    # Returns the memory blocks and bytes held per message
+    tracemalloc.start()
+    try:
+        msgs = [msg_class(None, wait_for_result=True) for _ in range(count)]
+        stats = tracemalloc.take_snapshot().statistics('filename')
+    finally:
+        tracemalloc.stop()
+
+    del msgs
+    return (sum(s.count for s in stats) / count, sum(s.size for s in stats) / count)
+
+
+def run(count=5000, repeat=3):
+    """
+    Compares the round trip latency of synchronous actor messages, and the
+    memory allocated for each, between a Queue and a Future per message.
+    """
+    results = []
+
+    for name, msg_class in (('queue', _QueueMsg), ('future', indexer.ActorCommandMsg)):
+        actor = _EchoActor()
+        actor.start()
+        try:
+            elapsed = measure(lambda: _round_trips(actor, msg_class, count), repeat)
+        finally:
+            actor.quit()
+
+        blocks, size = _allocations(msg_class, count)
+        results.append((name, elapsed, blocks, size))
+
+    print("Actor message benchmark: %d synchronous round trips" % count)
+
+    base_time = results[0][1]
+    for name, elapsed, blocks, size in results:
+        print("  %-8s %8.1f us per round trip  (x%.2f)  %5.1f blocks, %6.0f bytes per message" %
+                (name, elapsed / count * 10**6, base_time / elapsed, blocks, size))
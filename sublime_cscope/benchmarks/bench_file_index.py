@@ -0,0 +1,67 @@
+import tracemalloc
+
+from ..file_index import DirRecord, InodeSet
+
+
+def _gen_folders(num_folders, files_per_folder):
+    for i in range(num_folders):
+        path = '/work/monorepo/src/component%d/module%d/sub%d' % (i % 50, i % 700, i)
+        files = ['source_file_%d_%d.c' % (i, j) for j in range(files_per_folder)]
+        yield (i, path, files)
+
+
+def _build_dict_index(folders):
+    # The layout used before DirRecord was introduced
+    index = {}
+    visited = set()
+
+    for i, path, files in folders:
+        index[i] = {'path': path, 'magic': 1500000000.5 * len(files), 'files': files}
+        for j in range(len(files)):
+            visited.add(i * 1000 + j)
+
+    return index, visited
+
+
+def _build_compact_index(folders):
+    index = {}
+    visited = InodeSet()
+
+    for i, path, files in folders:
+        index[(2049, i)] = DirRecord(path, files, [0x123456789abcdef0] * len(files))
+        for j in range(len(files)):
+            visited.add((2049, i * 1000 + j))
+
+    return index, visited
+
+
+def _traced_size(build, *args):
+    tracemalloc.start()
+    try:
+        res = build(*args)
+        size, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    del res
+    return size, peak
+
+
+def run(num_folders=10000, files_per_folder=25):
+    """
+    Measures the memory held by the file index, and the inode set used by
+    the crawler to find duplicates, for a project with 250000 files.
+    """
+    results = []
+
+    for name, build in (('dict', _build_dict_index), ('compact', _build_compact_index)):
+        size, peak = _traced_size(build, _gen_folders(num_folders, files_per_folder))
+        results.append((name, size, peak))
+
+    print("File index memory: %d files in %d folders" %
+                (num_folders * files_per_folder, num_folders))
+
+    base_size = results[0][1]
+    for name, size, peak in results:
+        print("  %-8s %8.1f MB  (peak %.1f MB, x%.2f)" %
+                (name, size / 2**20, peak / 2**20, base_size / size))
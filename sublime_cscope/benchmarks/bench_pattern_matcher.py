@@ -0,0 +1,60 @@
+import os
+import fnmatch
+
+from . import measure
+from .. import pattern_matcher
+
+# A mix of extension, name, prefix and path patterns similar to what large
+# projects put in their folder_exclude_patterns and file_exclude_patterns.
+PATTERNS = (['*.%s' % ext for ext in ('o', 'a', 'so', 'obj', 'lib', 'dll', 'exe', 'pyc',
+                                      'pyo', 'class', 'jar', 'log', 'tmp', 'swp', 'bak',
+                                      'orig', 'rej', 'd', 'dep', 'map', 'min.js', 'tar.gz')] +
+            ['.git', '.svn', '.hg', 'CVS', 'node_modules', 'out', 'build', 'dist',
+             '__pycache__', '.tox', '.idea', '.vscode', 'bazel-*', 'cmake-build-*',
+             'third_party', 'vendor', 'Debug', 'Release', 'x64', 'ipch'] +
+            ['*_test.c', '*_unittest.cc', '*BACKUP*', '*.generated.*', '*/gen/*',
+             '*/obj/*', 'prefix_[0-9]*', '?tmp*', '#*#', '*~'])
+
+
+def _fnmatch_any(patterns, dirpath, name):
+    full_path = os.path.join(dirpath, name)
+    for pattern in patterns:
+        if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(full_path, pattern):
+            return True
+    return False
+
+
+def _gen_names(count):
+    exts = ('.c', '.h', '.o', '.cc', '.log', '.py', '.d', '.txt')
+    names = []
+
+    for i in range(count):
+        dirpath = '/work/monorepo/src/module%d/sub%d' % (i % 97, i % 13)
+        names.append((dirpath, 'file%d%s' % (i, exts[i % len(exts)])))
+
+    return names
+
+
+def run(count=20000, repeat=3):
+    """
+    Compares the compiled pattern matcher against calling fnmatch for
+    every pattern, on both the name and the full path of each entry.
+    """
+    names = _gen_names(count)
+    patterns = list(PATTERNS)
+    matcher = pattern_matcher.PatternMatcher(patterns)
+
+    def run_fnmatch():
+        return [_fnmatch_any(patterns, d, n) for d, n in names]
+
+    def run_matcher():
+        return [matcher.matches(d, n) for d, n in names]
+
+    fnmatch_time = measure(run_fnmatch, repeat)
+    matcher_time = measure(run_matcher, repeat)
+
+    print("Pattern matcher benchmark: %d names, %d patterns" % (count, len(patterns)))
+    print("  %-8s %8.3f s" % ('fnmatch', fnmatch_time))
+    print("  %-8s %8.3f s  (x%.2f)  same result: %s" %
+            ('compiled', matcher_time, fnmatch_time / matcher_time,
+             run_fnmatch() == run_matcher()))
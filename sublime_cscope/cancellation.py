@@ -0,0 +1,53 @@
+import threading
+
+
+class Cancelled(Exception):
+    """ Raised by CancelToken.check() once the work has been cancelled """
+
+
+class CancelToken:
+    """
+    Lets one thread ask the work running in another one to stop. The work
+    checks the token at convenient points, see check(), and work blocked in
+    something like a subprocess registers a callback that unblocks it.
+    A token can not be reset, every new piece of work gets a new one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        with self._lock:
+            if self._cancelled:
+                return
+
+            self._cancelled = True
+            callbacks = self._callbacks
+            self._callbacks = []
+
+        for callback in callbacks:
+            callback()
+
+    def check(self):
+        if self._cancelled:
+            raise Cancelled()
+
+    def add_callback(self, callback):
+        """ Calls callback on cancel, or right away if already cancelled """
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return
+
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
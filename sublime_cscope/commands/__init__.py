@@ -1,4 +1,4 @@
-from .index import ScRefreshAllCommand
+from .index import ScRefreshAllCommand, ScShowSkippedFilesCommand, ScShowIndexerStatsCommand
 from .query import ScQueryCommand, ScFindSymbolCommand, \
                    ScFindDefinitionCommand, ScFindCalleesCommand, \
                    ScFindCallersCommand, ScFindStringCommand, \
@@ -6,6 +6,8 @@ from .query import ScQueryCommand, ScFindSymbolCommand, \
                    ScWriteQueryResultsCommand
 __all__ = [
     'ScRefreshAllCommand',
+    'ScShowSkippedFilesCommand',
+    'ScShowIndexerStatsCommand',
     'ScQueryCommand',
     'ScFindSymbolCommand',
     'ScFindDefinitionCommand',
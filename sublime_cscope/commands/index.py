@@ -1,8 +1,51 @@
 import sublime
 import sublime_plugin
 
+from ...SublimeCscope import PACKAGE_NAME
 from .. import indexer
 
 class ScRefreshAllCommand(sublime_plugin.WindowCommand):
     def run(self):
         indexer.refresh()
+
+
+class ScShowSkippedFilesCommand(sublime_plugin.WindowCommand):
+    """
+    Lists the files of the current project that were left out of the
+    index because of their size or content, and why.
+    """
+    def run(self):
+        skipped = indexer.get_skipped_files(self.window)
+        if skipped is None:
+            sublime.status_message("%s: The indexer is busy, try again later" % PACKAGE_NAME)
+            return
+
+        if not skipped:
+            sublime.status_message("%s: No files were skipped" % PACKAGE_NAME)
+            return
+
+        lines = ["%d files are not part of the index:" % len(skipped), '']
+        lines.extend("%s: %s" % (path, reason) for path, reason in sorted(skipped.items()))
+
+        view = self.window.new_file()
+        view.set_scratch(True)
+        view.set_name("%s Skipped Files" % PACKAGE_NAME)
+        view.run_command('append', {'characters': '\n'.join(lines) + '\n'})
+
+
+class ScShowIndexerStatsCommand(sublime_plugin.WindowCommand):
+    """
+    Shows how many messages the indexer of the current project and its
+    crawler handled, how long they waited in the mailbox and how long they
+    took to handle.
+    """
+    def run(self):
+        lines = indexer.get_stats(self.window)
+        if not lines:
+            sublime.status_message("%s: No indexer for this window" % PACKAGE_NAME)
+            return
+
+        view = self.window.new_file()
+        view.set_scratch(True)
+        view.set_name("%s Indexer Stats" % PACKAGE_NAME)
+        view.run_command('append', {'characters': '\n'.join(lines) + '\n'})
@@ -0,0 +1,53 @@
+class CrawlStats:
+    """
+    Counts the file system calls issued by one crawl. Entries rejected by
+    name before they were stat:ed are counted too, since those are the stat
+    calls that were saved. Crawlers running jobs in several threads give each
+    job its own instance and merge them when the job is done.
+
+    skipped_files holds the files that passed the name filters but were
+    rejected by the size or content checks, as {path: reason}.
+    """
+
+    __slots__ = ('listdir_calls', 'stat_calls', 'file_reads',
+                 'rejected_by_name', 'skipped_files')
+
+    def __init__(self):
+        self.listdir_calls = 0
+        self.stat_calls = 0
+        self.file_reads = 0
+        self.rejected_by_name = 0
+        self.skipped_files = {}
+
+    @property
+    def syscalls(self):
+        return self.listdir_calls + self.stat_calls + self.file_reads
+
+    def merge(self, other):
+        self.listdir_calls += other.listdir_calls
+        self.stat_calls += other.stat_calls
+        self.file_reads += other.file_reads
+        self.rejected_by_name += other.rejected_by_name
+        self.skipped_files.update(other.skipped_files)
+
+    def __eq__(self, r):
+        if not isinstance(r, self.__class__):
+            return NotImplemented
+
+        return (self.listdir_calls == r.listdir_calls and
+                self.stat_calls == r.stat_calls and
+                self.file_reads == r.file_reads and
+                self.rejected_by_name == r.rejected_by_name and
+                self.skipped_files == r.skipped_files)
+
+    def __repr__(self):
+        return ('%s(listdir_calls=%d, stat_calls=%d, file_reads=%d, '
+                'rejected_by_name=%d, skipped_files=%d)') % (
+                    self.__class__.__name__, self.listdir_calls, self.stat_calls,
+                    self.file_reads, self.rejected_by_name, len(self.skipped_files))
+
+    def summary(self):
+        return ("%d syscalls (%d directory listings, %d stat calls, %d file reads), "
+                "%d entries rejected by name, %d files skipped") % (
+                    self.syscalls, self.listdir_calls, self.stat_calls, self.file_reads,
+                    self.rejected_by_name, len(self.skipped_files))
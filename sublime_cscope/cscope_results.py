@@ -1,5 +1,6 @@
 import re
 import os.path
+import threading
 
 import sublime
 
@@ -156,16 +157,19 @@ class CscopeResultsToQuickPanel:
 class CscopeResult:
     def __init__(self, regexp):
         self._re = regexp
+        # Several cscope processes can feed the same results
+        self._lock = threading.Lock()
 
     def parse(self, line):
-        if not line:
-            self._post_process_results()
-        else:
-            m = self._re.match(line)
-            if m:
-                self._parse_matched_line(m)
-            elif DEBUG:
-                print("CscopeResult: Got unmatched line: %s" % line)
+        with self._lock:
+            if not line:
+                self._post_process_results()
+            else:
+                m = self._re.match(line)
+                if m:
+                    self._parse_matched_line(m)
+                elif DEBUG:
+                    print("CscopeResult: Got unmatched line: %s" % line)
 
 
     def _parse_matched_line(self, m):
@@ -1,10 +1,14 @@
 import os
 import subprocess
+import threading
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
 
 import sublime
 
 from ..SublimeCscope import DEBUG, PACKAGE_NAME
 from . import settings
+from .process_loop import HAS_ASYNCIO, ProcessLoop
 from .indexer import PRIMARY_DB, SECONDARY_DB
 from .cscope_results import CscopeBuildDbResult, CscopeQueryResult, CscopeResultLimitException
 
@@ -31,12 +35,23 @@ CSCOPE_OPTIONS = {
     'find_files_including': '-8'
 }
 
+# Without the process loop, sharded databases are built and queried with up
+# to one cscope process per core
+MAX_PARALLEL_PROCESSES = os.cpu_count() or 1
+
+# Runs cscope for all projects, builds as well as queries
+_process_loop = ProcessLoop('Cscope') if HAS_ASYNCIO else None
+
+
 class CscopeRunner:
-    def __init__(self, cwd, win, results, arg_list):
+    def __init__(self, cwd, win, results, arg_list, cancel_token=None, timeout=None):
         self._win = win
         self._cwd = cwd
         self._results = results
         self._arg_list = arg_list
+        self._cancel_token = cancel_token
+        self._timeout = timeout
+        self._cmd = None
 
 
     @property
@@ -74,13 +89,35 @@ class CscopeRunner:
         raise FileNotFoundError("cscope executable not found in PATH")
 
     def run(self):
-        cmd = [self._cscope]
-        env = {}
-
+        """
+        Runs cscope and feeds its output to the results. If the cancel token
+        is cancelled cscope is killed and Cancelled is raised. If cscope runs
+        for longer than the timeout it is killed and the results are the ones
+        parsed so far.
+        """
         if not self._cwd:
             print("%s-CscopeRunner: No working directory given. Aborting")
             return
 
+        try:
+            self._run_cscope()
+        except CscopeResultLimitException as le:
+            sublime.error_message(str(le))
+        finally:
+            self._results.parse(None)
+
+    def _run_cscope(self):
+        # Like run() but the result limit is left to the caller, and so is
+        # telling the results that they are complete
+        if _process_loop:
+            self._wait_on_loop(self._start_on_loop())
+        else:
+            self._run_blocking(self._command())
+
+    def _command(self):
+        cmd = [self._cscope]
+        env = {}
+
         tmp_folder = settings.get('tmp_folder', self._win)
         kernel_mode = not bool(settings.get('search_std_include_folders', self._win))
         extra_inc_folders = settings.get('extra_include_folders', self._win)
@@ -97,29 +134,68 @@ class CscopeRunner:
         cmd.extend(self._arg_list)
 
         if DEBUG: print("%s-CscopeRunner: About to run %s" % (PACKAGE_NAME, cmd))
+        return cmd
+
+    def _start_on_loop(self):
+        # Starts cscope without waiting for it. The output is parsed by the
+        # loop thread. Returns the future to hand to _wait_on_loop.
+        self._cmd = self._command()
+        future = _process_loop.run_process(self._cmd, self._results.parse,
+                                           cwd=self._cwd, timeout=self._timeout)
+        if self._cancel_token:
+            self._cancel_token.add_callback(future.cancel)
+            future.add_done_callback(
+                    lambda future: self._cancel_token.remove_callback(future.cancel))
+
+        return future
+
+    def _wait_on_loop(self, future):
+        try:
+            future.result()
+        except futures.CancelledError:
+            if self._cancel_token:
+                self._cancel_token.check()
+            raise
+        except futures.TimeoutError:
+            print("%s: cscope timed out after %ss. cmd_line: %s, cwd: %s"
+                               % (PACKAGE_NAME, self._timeout, self._cmd, self._cwd))
+            sublime.status_message("%s: cscope timed out" % PACKAGE_NAME)
+
+        if self._cancel_token:
+            self._cancel_token.check()
+
+    def _run_blocking(self, cmd):
+        # Older plugin hosts, one thread per cscope process and no timeout
         try:
             with subprocess.Popen(cmd, cwd=self._cwd,
                                   universal_newlines=True,
                                   stdout=subprocess.PIPE,
                                   stderr=subprocess.STDOUT) as p:
-                for line in p.stdout:
-                    if not line:
-                        continue
-                    self._results.parse(line)
+                if self._cancel_token:
+                    self._cancel_token.add_callback(p.kill)
+
+                try:
+                    for line in p.stdout:
+                        if not line:
+                            continue
+                        self._results.parse(line)
+                finally:
+                    if self._cancel_token:
+                        self._cancel_token.remove_callback(p.kill)
+
+            if self._cancel_token:
+                self._cancel_token.check()
 
         except subprocess.CalledProcessError as e:
             print("%s: Running cscope returned an error. cmd_line: %s, cwd: %s, error_code: %d"
                                % (PACKAGE_NAME,  e.cmd, self._cwd, e.returncode))
-        except CscopeResultLimitException as le:
-            sublime.error_message(str(le))
-        finally:
-            self._results.parse(None)
 
 
 
 class CscopeBuildDbCommand:
 
-    def __init__(self, cwd, win=None, force_rebuild=False, name=SECONDARY_DB):
+    def __init__(self, cwd, win=None, force_rebuild=False, name=SECONDARY_DB,
+                 cancel_token=None):
         if not win:
             win = sublime.active_window()
 
@@ -139,7 +215,7 @@ class CscopeBuildDbCommand:
 
         self._results = CscopeBuildDbResult()
 
-        self._runner = CscopeRunner(cwd, win, self._results, args)
+        self._runner = CscopeRunner(cwd, win, self._results, args, cancel_token)
 
 
     @property
@@ -162,11 +238,12 @@ class CscopeQueryCommand:
 
         self._cwd = get_db_location(win)
         self._results = CscopeQueryResult(settings.get('maximum_results', self._win))
+        self._timeout = settings.get('query_timeout', self._win) or None
         self._action = action
         self._search_term = search_term
 
 
-    def _run_once(self, db_name, file_list=None, filter=None):
+    def _query_args(self, db_name, file_list=None):
         args = []
 
         if file_list:
@@ -177,14 +254,31 @@ class CscopeQueryCommand:
         args.append(CSCOPE_OPTIONS['line_mode_search'])
         args.append("%s%s" % (CSCOPE_OPTIONS[self._action], self._search_term))
         args.append("%s%s" % (CSCOPE_OPTIONS['db_name'], db_name))
+        return args
+
 
+    def _run_once(self, db_name, file_list=None, filter=None):
         if filter:
             self._results.filter = filter
 
-        runner = self._runner = CscopeRunner(self._cwd, self._win, self._results, args)
+        runner = self._runner = CscopeRunner(self._cwd, self._win, self._results,
+                                             self._query_args(db_name, file_list),
+                                             timeout=self._timeout)
         runner.run()
 
 
+    def _run_shards(self, shard_names, filter=None):
+        # One cscope process per shard, all feeding the same results
+        if filter:
+            self._results.filter = filter
+
+        runners = [CscopeRunner(self._cwd, self._win, self._results,
+                                self._query_args(os.extsep.join([name, CSCOPE_DB_EXT])),
+                                timeout=self._timeout)
+                   for name in shard_names]
+        run_concurrently(runners, self._results)
+
+
     @property
     def results(self):
         return self._results
@@ -215,10 +309,163 @@ class CscopeQueryCommand:
                 print("CscopeQueryCommand: querying secondary DB")
 
             self._run_once(db_name, filter=file_filter)
+            return
+
+        from .indexer import secondary_db_shards
+
+        shard_names = secondary_db_shards(self._cwd)
+        if shard_names:
+            if DEBUG:
+                print("CscopeQueryCommand: querying %d secondary DB shards" % len(shard_names))
+
+            self._run_shards(shard_names, filter=file_filter)
+
+
+
+def _run_all(runners):
+    """
+    Runs cscope for all runners at once. On the process loop all of them are
+    started right away and waited for together, so no thread is blocked on
+    each process. If one of them fails or is cancelled the others are killed.
+    Older plugin hosts run them on a pool of at most one thread per core.
+    """
+    if _process_loop:
+        _start_all(runners).result()
+        return
+
+    with ThreadPoolExecutor(max_workers=min(len(runners), MAX_PARALLEL_PROCESSES)) as ex:
+        pending = [ex.submit(runner._run_cscope) for runner in runners]
+        for future in pending:
+            future.result()
+
+
+def _start_all(runners):
+    """
+    Like _run_all, but returns a concurrent.futures.Future right away, which
+    is done once all of the processes are. Without the process loop cscope
+    is run before returning, and the Future is done already.
+    """
+    done = futures.Future()
 
+    if not _process_loop:
+        try:
+            _run_all(runners)
+        except Exception as e:
+            done.set_exception(e)
+        else:
+            done.set_result(None)
+        return done
+
+    started = []
+    try:
+        for runner in runners:
+            started.append((runner, runner._start_on_loop()))
+    except Exception:
+        for _, future in started:
+            future.cancel()
+        raise
+
+    lock = threading.Lock()
+    remaining = [len(started)]
+
+    def process_done(future):
+        # Called on the loop thread
+        failed = future.cancelled() or not isinstance(future.exception(),
+                                                      (type(None), futures.TimeoutError))
+        if failed:
+            # No-op for the processes that are done already
+            for _, other in started:
+                other.cancel()
+
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+
+        errors = []
+        for runner, future in started:
+            # Doesn't wait, all of the processes are done
+            try:
+                runner._wait_on_loop(future)
+            except Exception as e:
+                errors.append(e)
+
+        # Rather the error that killed the others than their cancellation
+        errors.sort(key=lambda e: isinstance(e, futures.CancelledError))
+        if errors:
+            done.set_exception(errors[0])
+        else:
+            done.set_result(None)
+
+    for _, future in started:
+        future.add_done_callback(process_done)
+
+    return done
+
+
+def run_concurrently(runners, results):
+    """
+    Runs cscope for all runners at once, which feed the same results. The
+    results are told that they are complete once all of them are done.
+    """
+    try:
+        _run_all(runners)
+    except CscopeResultLimitException as le:
+        sublime.error_message(str(le))
+    finally:
+        results.parse(None)
 
 
-def generate_index(cwd, win, force_rebuild=False):
-    build_db_command = CscopeBuildDbCommand(cwd, win=win, force_rebuild=force_rebuild)
+def generate_index(cwd, win, force_rebuild=False, cancel_token=None, name=SECONDARY_DB):
+    build_db_command = CscopeBuildDbCommand(cwd, win=win, force_rebuild=force_rebuild,
+                                            name=name, cancel_token=cancel_token)
     build_db_command.run()
     return build_db_command.results
+
+
+def generate_indexes(cwd, win, names, force_rebuild=False, cancel_token=None):
+    """
+    Builds the databases called names in parallel, see _run_all. Returns
+    their results in the same order.
+    """
+    commands = [CscopeBuildDbCommand(cwd, win=win, force_rebuild=force_rebuild,
+                                     name=name, cancel_token=cancel_token)
+                for name in names]
+    return start_generate_indexes(cwd, win, names, force_rebuild=force_rebuild,
+                                  cancel_token=cancel_token).result()
+
+
+def start_generate_indexes(cwd, win, names, force_rebuild=False, cancel_token=None):
+    """
+    Like generate_indexes, but does not wait for the builds. Returns a
+    concurrent.futures.Future of the results, see _start_all.
+    """
+    commands = [CscopeBuildDbCommand(cwd, win=win, force_rebuild=force_rebuild,
+                                     name=name, cancel_token=cancel_token)
+                for name in names]
+    done = futures.Future()
+
+    def builds_done(future):
+        for command in commands:
+            command.results.parse(None)
+
+        if future.exception():
+            done.set_exception(future.exception())
+        else:
+            done.set_result([command.results for command in commands])
+
+    try:
+        started = _start_all([command._runner for command in commands])
+    except Exception:
+        for command in commands:
+            command.results.parse(None)
+        raise
+
+    started.add_done_callback(builds_done)
+    return done
+
+
+def quit():
+    """ Kills the cscope processes that are still running. """
+    if _process_loop:
+        _process_loop.shutdown()
@@ -1,7 +1,9 @@
 
 
 from .run_tests_command import ScTestsCommand
+from .run_benchmarks_command import ScBenchmarksCommand
 
 __all__ = [
-    'ScTestsCommand'
+    'ScTestsCommand',
+    'ScBenchmarksCommand'
 ]
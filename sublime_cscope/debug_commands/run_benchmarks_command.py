@@ -0,0 +1,13 @@
+
+import sublime
+import sublime_plugin
+
+import SublimeCscope.sublime_cscope.benchmarks
+
+
+class ScBenchmarksCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        sublime.set_timeout_async(self.run_benchmarks, 0)
+
+    def run_benchmarks(self):
+        SublimeCscope.sublime_cscope.benchmarks.run_all()
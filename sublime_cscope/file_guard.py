@@ -0,0 +1,87 @@
+from ..SublimeCscope import PACKAGE_NAME
+
+# The amount of data read from the start of a file to decide if it is
+# binary or generated. Same block size git uses to detect binary files.
+SNIFF_SIZE = 8000
+
+SKIPPED_TOO_LARGE = 'larger than %d bytes'
+SKIPPED_BINARY = 'binary'
+SKIPPED_GENERATED = "generated (contains '%s')"
+
+
+class FileGuard:
+    """
+    Size and content checks for files that passed the name filters of a
+    project. Large files are rejected by their size alone. Binary files
+    (containing a NUL byte) and generated files (containing one of the
+    markers, e.g. '@generated') are detected by reading the first
+    SNIFF_SIZE bytes. The outcome of that is cached per path and file hash,
+    so unchanged files are only read once. Safe to use from several threads.
+    """
+
+    def __init__(self, max_size=0, skip_binary=False, generated_markers=()):
+        self._max_size = max_size or 0
+        self._skip_binary = bool(skip_binary)
+        self._markers = tuple(sorted(set(generated_markers or ())))
+        self._encoded_markers = [(m, m.encode('utf-8')) for m in self._markers]
+        # {path: (file hash, reason or None)}
+        self._sniff_cache = {}
+
+    def __bool__(self):
+        return bool(self._max_size or self._skip_binary or self._markers)
+
+    def __eq__(self, r):
+        if not isinstance(r, self.__class__):
+            return NotImplemented
+
+        return ((self._max_size, self._skip_binary, self._markers) ==
+                (r._max_size, r._skip_binary, r._markers))
+
+    def __repr__(self):
+        return '%s(max_size=%d, skip_binary=%r, generated_markers=%r)' % (
+                    self.__class__.__name__, self._max_size,
+                    self._skip_binary, list(self._markers))
+
+    @property
+    def sniffs_content(self):
+        return self._skip_binary or bool(self._markers)
+
+    def check(self, path, size, file_hash, stats=None):
+        """
+        Returns the reason for skipping the file at path, or None if it
+        should be indexed. File reads are counted in stats, if given.
+        """
+        if self._max_size and size > self._max_size:
+            return SKIPPED_TOO_LARGE % self._max_size
+
+        if not self.sniffs_content:
+            return None
+
+        cached = self._sniff_cache.get(path, None)
+        if cached and cached[0] == file_hash:
+            return cached[1]
+
+        if stats is not None:
+            stats.file_reads += 1
+
+        try:
+            with open(path, 'rb') as f:
+                block = f.read(SNIFF_SIZE)
+        except OSError as e:
+            # Let cscope deal with it, like before the guard existed
+            print("%s: %s" % (PACKAGE_NAME, e))
+            return None
+
+        reason = self._sniff(block)
+        self._sniff_cache[path] = (file_hash, reason)
+        return reason
+
+    def _sniff(self, block):
+        if self._skip_binary and b'\0' in block:
+            return SKIPPED_BINARY
+
+        for marker, encoded in self._encoded_markers:
+            if encoded in block:
+                return SKIPPED_GENERATED % marker
+
+        return None
@@ -0,0 +1,408 @@
+import os
+import sys
+import struct
+import hashlib
+from array import array
+from bisect import bisect_left
+from itertools import chain
+
+# File names can't contain NUL so it's safe to use as separator
+NAME_SEPARATOR = '\0'
+
+# Inodes are buffered in a regular set until there are this many, or a
+# quarter of the number already stored, before they are merged into the
+# sorted arrays.
+MIN_PENDING_INODES = 4096
+
+_MAX_INODE = 2 ** 64 - 1
+
+HASH_TYPECODE = 'Q'
+_HASH_MASK = 2 ** 64 - 1
+
+# mtime_ns, size, ino
+_STAT_DATA = struct.Struct('<qqQ')
+_HASH = struct.Struct('<Q')
+# Older plugin hosts don't have it
+_blake2b = getattr(hashlib, 'blake2b', None)
+
+
+def file_hash(mtime_ns, size, ino):
+    """
+    Returns a 64 bit hash of the stat data of a file. It only depends on
+    the stat data, so the hashes can be persisted between sessions.
+    """
+    data = _STAT_DATA.pack(mtime_ns, size, ino & _HASH_MASK)
+    if _blake2b:
+        return _HASH.unpack(_blake2b(data, digest_size=_HASH.size).digest())[0]
+    return _digest(data)
+
+
+def _digest(*parts):
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(part)
+    return struct.unpack_from('<Q', h.digest())[0]
+
+
+def folder_key(st):
+    """ Returns the key used for a folder in the file index """
+    return (st.st_dev, st.st_ino)
+
+
+class DirRecord:
+    """
+    The indexed files of one folder. The file index is a dict of these keyed
+    by folder_key(), i.e. (st_dev, st_ino) of the folder.
+
+    To keep the file index small for large projects the folder path is
+    interned and the file names are packed into a single string instead
+    of being kept as a list of strings. Every file has a 64 bit hash of its
+    (mtime_ns, size, ino), see file_hash(), kept in an array so that the
+    files that were modified between two crawls can be told apart.
+    """
+
+    __slots__ = ('path', 'num_files', '_names', '_hashes', '_digest')
+
+    def __init__(self, path, files=(), hashes=()):
+        self.path = sys.intern(path)
+        self.num_files = len(files)
+        self._names = NAME_SEPARATOR.join(files)
+        self._hashes = array(HASH_TYPECODE, hashes)
+        self._digest = None
+
+    @classmethod
+    def from_packed(cls, path, num_files, packed_files, hashes):
+        record = cls(path)
+        record.num_files = num_files
+        record._names = packed_files
+        record._hashes = hashes
+        return record
+
+    @property
+    def files(self):
+        return self._names.split(NAME_SEPARATOR) if self.num_files else []
+
+    @property
+    def packed_files(self):
+        return self._names
+
+    @property
+    def hashes(self):
+        return self._hashes
+
+    @property
+    def digest(self):
+        """ A 64 bit hash of the names and file hashes of the folder """
+        if self._digest is None:
+            self._digest = _digest(self._names.encode('utf-8', 'surrogateescape'),
+                                   self._hashes.tobytes())
+        return self._digest
+
+    def items(self):
+        """ Returns a dict of {file name: file hash} """
+        return dict(zip(self.files, self._hashes))
+
+    def __contains__(self, name):
+        return name in self.files
+
+    def __eq__(self, r):
+        if not isinstance(r, self.__class__):
+            return NotImplemented
+
+        return (self.path == r.path and self.num_files == r.num_files and
+                self._names == r._names and self._hashes == r._hashes)
+
+    def __repr__(self):
+        return '%s(%r, %r, %r)' % (self.__class__.__name__,
+                                   self.path, self.files, list(self._hashes))
+
+
+class MerkleTree:
+    """
+    Hierarchical hashes of a file index. The hash of a folder covers its
+    own DirRecord.digest and the hashes of all its sub folders, so two trees
+    can be compared top-down, only descending into sub trees whose hash
+    differs. Folders are identified by path.
+
+    A tree can be kept up to date with update(), which only hashes the
+    folders that changed and their parents again.
+    """
+
+    def __init__(self, file_index):
+        self._records = {}
+        # {parent path: set of paths}, also for parents that are not in the
+        # tree, so that a parent that is added later adopts its sub folders
+        self._children = {}
+        self._roots = set()
+        self._hashes = {}
+        self.update(file_index.values())
+
+    @property
+    def roots(self):
+        return sorted(self._roots)
+
+    def update(self, records, removed=()):
+        """
+        Adds records, replacing the ones with the same path, and removes
+        the folders with the paths in removed.
+        """
+        changed = set()
+
+        for path in removed:
+            if self._records.pop(path, None) is None:
+                continue
+
+            del self._hashes[path]
+            self._roots.discard(path)
+            parent = os.path.dirname(path)
+            if parent != path:
+                siblings = self._children[parent]
+                siblings.discard(path)
+                if not siblings:
+                    del self._children[parent]
+                if parent in self._records:
+                    changed.add(parent)
+
+            # Sub folders that are left are roots now
+            self._roots.update(self._children.get(path, ()))
+
+        for record in records:
+            path = record.path
+            old = self._records.get(path, None)
+            self._records[path] = record
+
+            if old is None:
+                parent = os.path.dirname(path)
+                if parent != path:
+                    self._children.setdefault(parent, set()).add(path)
+                if parent == path or parent not in self._records:
+                    self._roots.add(path)
+                self._roots.difference_update(self._children.get(path, ()))
+                changed.add(path)
+            elif old.digest != record.digest:
+                changed.add(path)
+
+        # The hashes of the parents change with the ones of their sub folders
+        pending = list(changed)
+        while pending:
+            parent = os.path.dirname(pending.pop())
+            if parent in self._records and parent not in changed:
+                changed.add(parent)
+                pending.append(parent)
+
+        # sub folders have longer paths than their parents, hash them first
+        for path in sorted(changed, key=len, reverse=True):
+            if path in self._records:
+                self._hashes[path] = self._hash(path)
+
+    def _hash(self, path):
+        parts = [struct.pack('<Q', self._records[path].digest)]
+        for child in sorted(self._children.get(path, ())):
+            parts.append(os.path.basename(child).encode('utf-8', 'surrogateescape'))
+            parts.append(struct.pack('<Q', self._hashes[child]))
+        return _digest(*parts)
+
+    def record(self, path):
+        return self._records.get(path, None)
+
+    def tree_hash(self, path):
+        return self._hashes.get(path, None)
+
+    def children(self, path):
+        return self._children.get(path, ()) if path in self._records else ()
+
+
+def changed_folders(old_tree, new_tree, old_roots=None):
+    """
+    Compares two MerkleTrees top-down and returns the paths of the folders
+    that were added, removed or whose files differ. Sub trees with equal
+    hashes are skipped. old_roots are the folders of old_tree to start
+    from, its roots by default.
+    """
+    if old_roots is None:
+        old_roots = old_tree.roots
+
+    changed = []
+    visited = set()
+    stack = sorted(set(old_roots) | set(new_tree.roots), reverse=True)
+
+    while stack:
+        path = stack.pop()
+        if path in visited:
+            continue
+        visited.add(path)
+
+        old_hash = old_tree.tree_hash(path)
+        if old_hash is not None and old_hash == new_tree.tree_hash(path):
+            continue
+
+        old = old_tree.record(path)
+        new = new_tree.record(path)
+        if old is None or new is None or old.digest != new.digest:
+            changed.append(path)
+
+        stack.extend(set(old_tree.children(path)) | set(new_tree.children(path)))
+
+    return sorted(changed)
+
+
+class FolderDelta:
+    """ The files that were added, removed or modified in one folder """
+
+    __slots__ = ('path', 'added', 'removed', 'modified')
+
+    def __init__(self, path, added=(), removed=(), modified=()):
+        self.path = path
+        self.added = sorted(added)
+        self.removed = sorted(removed)
+        self.modified = sorted(modified)
+
+    def __repr__(self):
+        return '%s(%r, added=%r, removed=%r, modified=%r)' % (self.__class__.__name__,
+                                self.path, self.added, self.removed, self.modified)
+
+
+class IndexDelta:
+    """
+    The difference between two file indexes, as produced by diff_index.
+    Folders that were added or removed without containing any indexed files
+    are part of the delta even though no files changed.
+    """
+
+    def __init__(self):
+        self.folders = []
+
+    def _paths(self, attr):
+        return [os.path.join(d.path, f) for d in self.folders for f in getattr(d, attr)]
+
+    @property
+    def added(self):
+        return self._paths('added')
+
+    @property
+    def removed(self):
+        return self._paths('removed')
+
+    @property
+    def modified(self):
+        return self._paths('modified')
+
+    @property
+    def files_changed(self):
+        return any(d.added or d.removed or d.modified for d in self.folders)
+
+    @property
+    def file_set_changed(self):
+        """ True if any files were added or removed """
+        return any(d.added or d.removed for d in self.folders)
+
+    def __bool__(self):
+        return bool(self.folders)
+
+    def summary(self):
+        return "%d added, %d removed and %d modified files in %d folders" % (
+                    sum(len(d.added) for d in self.folders),
+                    sum(len(d.removed) for d in self.folders),
+                    sum(len(d.modified) for d in self.folders),
+                    len(self.folders))
+
+
+def diff_index(old_index, new_index, old_tree=None, new_tree=None):
+    """
+    Returns an IndexDelta describing how to get from old_index to new_index.
+    The MerkleTrees of the indexes are built unless given. old_tree may
+    cover more than old_index, e.g. the whole file index when old_index is
+    the part of it that a partial crawl covered.
+    """
+    delta = IndexDelta()
+    old_roots = None
+
+    if old_tree is None:
+        old_tree = MerkleTree(old_index)
+    else:
+        paths = {record.path for record in old_index.values()}
+        old_roots = [path for path in paths
+                          if os.path.dirname(path) == path or os.path.dirname(path) not in paths]
+
+    if new_tree is None:
+        new_tree = MerkleTree(new_index)
+
+    for path in changed_folders(old_tree, new_tree, old_roots):
+        old = old_tree.record(path)
+        new = new_tree.record(path)
+
+        if old is None:
+            delta.folders.append(FolderDelta(path, added=new.files))
+        elif new is None:
+            delta.folders.append(FolderDelta(path, removed=old.files))
+        else:
+            old_files = old.items()
+            new_files = new.items()
+            delta.folders.append(FolderDelta(path,
+                    added=[f for f in new_files if f not in old_files],
+                    removed=[f for f in old_files if f not in new_files],
+                    modified=[f for f, file_hash in new_files.items()
+                                    if f in old_files and old_files[f] != file_hash]))
+
+    return delta
+
+
+class InodeSet:
+    """
+    A set of (st_dev, st_ino) pairs stored as one sorted array of 64 bit
+    inode numbers per device. Uses roughly 8 bytes per inode instead of the
+    ~100 bytes per entry of a set of tuples.
+    """
+
+    __slots__ = ('_sorted', '_pending', '_size')
+
+    def __init__(self):
+        self._sorted = {}
+        self._pending = set()
+        self._size = 0
+
+    def add(self, key):
+        if key in self:
+            return
+
+        self._pending.add(key)
+        self._size += 1
+
+        if len(self._pending) >= max(MIN_PENDING_INODES, self._size // 4):
+            self._merge()
+
+    def _merge(self):
+        by_dev = {}
+        large = set()
+
+        for key in self._pending:
+            dev, ino = key
+            if 0 <= ino <= _MAX_INODE:
+                by_dev.setdefault(dev, []).append(ino)
+            else:
+                # e.g. the 128 bit file ids of ReFS. Stay in the set.
+                large.add(key)
+
+        for dev, inos in by_dev.items():
+            self._sorted[dev] = array('Q', sorted(chain(self._sorted.get(dev, ()), inos)))
+
+        self._pending = large
+
+    def __contains__(self, key):
+        if key in self._pending:
+            return True
+
+        dev, ino = key
+        inos = self._sorted.get(dev, None)
+        if not inos:
+            return False
+
+        i = bisect_left(inos, ino)
+        return i < len(inos) and inos[i] == ino
+
+    def __len__(self):
+        return self._size
+
+
+def count_files(file_index):
+    return sum(record.num_files for record in file_index.values())
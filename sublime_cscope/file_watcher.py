@@ -0,0 +1,310 @@
+import os
+import sys
+import time
+import errno
+import struct
+import threading
+
+from ..SublimeCscope import DEBUG, PACKAGE_NAME
+from .watch_thread import Watcher
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+# wd, mask, cookie, len
+_EVENT = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+# Time to wait for more events before the changes are reported.
+DEFAULT_COALESCE_DELAY = 1.0
+# Changes are reported at least this often during a steady stream of events
+MAX_COALESCE_DELAY = 5.0
+DEFAULT_POLL_INTERVAL = 10.0
+
+# Passed to the change callback when the kernel dropped events and the exact
+# set of changed folders is unknown.
+ALL_FOLDERS = None
+
+
+def _load_libc():
+    if ctypes is None or not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        for func in ('inotify_init1', 'inotify_add_watch', 'inotify_rm_watch'):
+            getattr(libc, func)
+    except (OSError, AttributeError):
+        return None
+
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+_libc = _load_libc()
+
+
+def inotify_available():
+    return _libc is not None
+
+
+class FileWatcher(Watcher):
+    """
+    Watches a set of folders and reports which of them changed.
+
+    On Linux every folder gets an inotify watch. Folders that can't be
+    watched, because inotify is not available or the per user watch limit
+    (fs.inotify.max_user_watches) is exhausted, are polled for changes in
+    their mtime instead. Note that polling only notices files being added,
+    removed or renamed.
+
+    Changes are coalesced and handed to on_change as a set of folder paths,
+    or ALL_FOLDERS if the kernel event queue overflowed. If on_write is
+    given, files whose contents were written, in folders where nothing else
+    changed, are handed to it as a set of file paths instead. The callbacks
+    are called from the watch thread, see watch_thread.WatchThread.
+    """
+
+    def __init__(self, on_change, name_filter=None,
+                 coalesce_delay=DEFAULT_COALESCE_DELAY,
+                 poll_interval=DEFAULT_POLL_INTERVAL, on_write=None, watch_thread=None):
+        super().__init__(watch_thread)
+        self._on_change = on_change
+        self._on_write = on_write
+        self._name_filter = name_filter
+        self._coalesce_delay = coalesce_delay
+        self._poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._inotify_fd = -1
+        self._wd_to_path = {}
+        self._path_to_wd = {}
+        # {path: mtime_ns} of the folders that are polled
+        self._polled = {}
+        self._last_poll = 0
+
+        self._changed = set()
+        self._written = set()
+        self._first_change = 0
+        self._last_change = 0
+
+    @property
+    def num_watched(self):
+        return len(self._path_to_wd)
+
+    @property
+    def num_polled(self):
+        return len(self._polled)
+
+    @property
+    def tick_interval(self):
+        return self._coalesce_delay / 2
+
+    def start(self):
+        if self._running:
+            return
+
+        if _libc:
+            fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                print("%s: inotify_init1 failed: %s. Falling back on polling." %
+                        (PACKAGE_NAME, os.strerror(ctypes.get_errno())))
+            else:
+                self._inotify_fd = fd
+
+        super().start()
+
+    def fileno(self):
+        return self._inotify_fd
+
+    def close(self):
+        with self._lock:
+            if self._inotify_fd >= 0:
+                os.close(self._inotify_fd)
+                self._inotify_fd = -1
+            self._wd_to_path.clear()
+            self._path_to_wd.clear()
+            self._polled.clear()
+            self._changed.clear()
+            self._written.clear()
+
+    def set_folders(self, folders):
+        """ Replaces the set of watched folders. """
+        folders = set(folders)
+
+        with self._lock:
+            current = set(self._path_to_wd.keys()) | set(self._polled.keys())
+
+            for path in current - folders:
+                self._unwatch(path)
+
+            for path in folders - current:
+                self._watch(path)
+
+        if DEBUG:
+            print("%s: Watching %d folders, polling %d folders" %
+                        (PACKAGE_NAME, self.num_watched, self.num_polled))
+
+    def _watch(self, path):
+        if self._inotify_fd >= 0:
+            wd = _libc.inotify_add_watch(self._inotify_fd,
+                                         os.fsencode(path), WATCH_MASK)
+            if wd >= 0:
+                self._wd_to_path[wd] = path
+                self._path_to_wd[path] = wd
+                return
+
+            err = ctypes.get_errno()
+            if err == errno.ENOENT or err == errno.ENOTDIR:
+                return
+            if err == errno.ENOSPC and not self._polled:
+                print("%s: The inotify watch limit is exhausted. "
+                      "Polling the remaining folders instead." % PACKAGE_NAME)
+
+        try:
+            self._polled[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            pass
+
+    def _unwatch(self, path):
+        wd = self._path_to_wd.pop(path, None)
+        if wd is not None:
+            self._wd_to_path.pop(wd, None)
+            _libc.inotify_rm_watch(self._inotify_fd, wd)
+        self._polled.pop(path, None)
+
+    def tick(self, now):
+        if self._polled and now - self._last_poll >= self._poll_interval:
+            self._last_poll = now
+            self._poll()
+
+        self._flush(now)
+
+    def read_events(self):
+        try:
+            data = os.read(self._inotify_fd, _READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            print("%s: Reading inotify events failed: %s" % (PACKAGE_NAME, e))
+            return
+
+        changed = set()
+        written = set()
+        offset = 0
+
+        with self._lock:
+            while offset + _EVENT.size <= len(data):
+                wd, mask, _, name_len = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = os.fsdecode(data[offset:offset+name_len].rstrip(b'\0'))
+                offset += name_len
+
+                if mask & IN_Q_OVERFLOW:
+                    changed.add(ALL_FOLDERS)
+                    continue
+
+                path = self._wd_to_path.get(wd, None)
+                if path is None:
+                    continue
+
+                if mask & IN_IGNORED:
+                    # the watch was removed by the kernel (folder deleted)
+                    self._wd_to_path.pop(wd, None)
+                    self._path_to_wd.pop(path, None)
+                    continue
+
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    changed.add(os.path.dirname(path))
+                elif mask & IN_ISDIR:
+                    changed.add(path)
+                elif not self._name_filter or self._name_filter(name):
+                    if mask & IN_CLOSE_WRITE and self._on_write:
+                        written.add(os.path.join(path, name))
+                    else:
+                        changed.add(path)
+
+        self._add_changes(changed, written)
+
+    def _poll(self):
+        changed = set()
+
+        with self._lock:
+            for path, mtime_ns in list(self._polled.items()):
+                try:
+                    new_mtime_ns = os.stat(path).st_mtime_ns
+                except OSError:
+                    del self._polled[path]
+                    changed.add(os.path.dirname(path))
+                    continue
+
+                if new_mtime_ns != mtime_ns:
+                    self._polled[path] = new_mtime_ns
+                    changed.add(path)
+
+        self._add_changes(changed)
+
+    def _add_changes(self, changed, written=frozenset()):
+        if not changed and not written:
+            return
+
+        now = time.time()
+        if not self._changed and not self._written:
+            self._first_change = now
+        self._last_change = now
+        self._changed |= changed
+        self._written |= written
+
+    def _flush(self, now):
+        if not self._changed and not self._written:
+            return
+
+        quiet = now - self._last_change >= self._coalesce_delay
+        overdue = now - self._first_change >= MAX_COALESCE_DELAY
+
+        if quiet or overdue:
+            changed = self._changed
+            written = self._written
+            self._changed = set()
+            self._written = set()
+
+            if ALL_FOLDERS in changed:
+                changed = ALL_FOLDERS
+                written = set()
+            else:
+                # Folders that changed are crawled anyway
+                written = {p for p in written if os.path.dirname(p) not in changed}
+
+            if DEBUG:
+                print("%s: File watcher detected changes in: %s, files written: %s" %
+                        (PACKAGE_NAME, changed, written))
+
+            try:
+                if changed or changed is ALL_FOLDERS:
+                    self._on_change(changed)
+                if written:
+                    self._on_write(written)
+            except Exception as e:
+                print("%s: File watcher callback failed: %s" % (PACKAGE_NAME, e))
@@ -0,0 +1,213 @@
+import os
+import shutil
+import subprocess
+import threading
+
+from ..SublimeCscope import DEBUG, PACKAGE_NAME
+from . import git_index
+from .watch_thread import Watcher
+
+# HEAD is cheap to check, it's two small files per repository
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+def find_git(git_path=None):
+    """ Returns the git executable to use, or None if there is none. """
+    if git_path and os.path.isfile(git_path) and os.access(git_path, os.X_OK):
+        return git_path
+
+    return shutil.which('git')
+
+
+def _run_git(git, work_tree, args):
+    try:
+        return subprocess.check_output([git] + args, cwd=work_tree,
+                                       stdin=subprocess.DEVNULL,
+                                       stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print("%s: Running git in %s failed: %s" % (PACKAGE_NAME, work_tree, e))
+        return None
+
+
+def head_commit(git, work_tree):
+    """ Returns the commit HEAD points at, or None if there is none. """
+    out = _run_git(git, work_tree, ['rev-parse', '-q', '--verify', 'HEAD'])
+    return out.decode('ascii').strip() if out else None
+
+
+def changed_files(git, work_tree, old_commit, new_commit):
+    """
+    Returns the paths, relative to work_tree, that differ between two commits
+    or None if git failed. Renames are reported as a removal and an addition.
+    """
+    out = _run_git(git, work_tree, ['diff', '--name-only', '--no-renames', '-z',
+                                    old_commit, new_commit])
+    if out is None:
+        return None
+
+    return [os.fsdecode(p) for p in out.split(b'\0') if p]
+
+
+def _read_first_line(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def _common_dir(git_dir):
+    # Linked work trees keep their own HEAD but share the refs
+    common_dir = _read_first_line(os.path.join(git_dir, 'commondir'))
+    if not common_dir:
+        return git_dir
+
+    return os.path.normpath(os.path.join(git_dir, common_dir))
+
+
+class _Repo:
+    __slots__ = ('work_tree', 'git_dir', 'common_dir', 'folders', 'signature', 'commit')
+
+    def __init__(self, work_tree, git_dir):
+        self.work_tree = work_tree
+        self.git_dir = git_dir
+        self.common_dir = _common_dir(git_dir)
+        self.folders = []
+        self.signature = None
+        self.commit = None
+
+    def head_signature(self):
+        """
+        The contents of HEAD and the branch it is on, plus the mtime of
+        packed-refs. Any commit, checkout or reset changes at least one of
+        them, without having to run git.
+        """
+        head = _read_first_line(os.path.join(self.git_dir, 'HEAD'))
+        ref = None
+        packed_mtime = None
+
+        if head and head.startswith('ref:'):
+            ref_name = head[len('ref:'):].strip()
+            ref = _read_first_line(os.path.join(self.common_dir, ref_name))
+
+            try:
+                packed_mtime = os.stat(os.path.join(self.common_dir,
+                                                    'packed-refs')).st_mtime_ns
+            except OSError:
+                pass
+
+        return (head, ref, packed_mtime)
+
+
+class GitHeadWatcher(Watcher):
+    """
+    Watches HEAD of the git repositories containing a set of folders.
+    When HEAD moves, e.g. after a checkout, pull or rebase, the files that
+    differ between the old and the new commit are listed by the local git
+    binary and their folders are handed to on_change. Only folders below
+    the watched folders are reported. The callback is called from the
+    watch thread, see watch_thread.WatchThread.
+
+    Changes to the work tree that are not committed are left to the
+    FileWatcher.
+    """
+
+    def __init__(self, on_change, git, poll_interval=DEFAULT_POLL_INTERVAL,
+                 watch_thread=None):
+        super().__init__(watch_thread)
+        self._on_change = on_change
+        self._git = git
+        self._poll_interval = poll_interval
+        self._last_poll = 0
+
+        self._lock = threading.Lock()
+        # {git dir: _Repo}
+        self._repos = {}
+
+    @property
+    def num_repos(self):
+        return len(self._repos)
+
+    @property
+    def tick_interval(self):
+        return self._poll_interval
+
+    def set_folders(self, folders):
+        """
+        Replaces the set of watched folders. The HEAD of repositories that
+        are new to the watcher is recorded by the next poll.
+        """
+        repos = {}
+
+        for folder in folders:
+            work_tree, git_dir = git_index.find_git_dir(folder)
+            if not work_tree:
+                continue
+
+            repo = repos.get(git_dir, None)
+            if not repo:
+                repo = self._repos.get(git_dir, None) or _Repo(work_tree, git_dir)
+                repo.folders = []
+                repos[git_dir] = repo
+            repo.folders.append(os.path.normpath(folder))
+
+        with self._lock:
+            self._repos = repos
+
+        if DEBUG:
+            print("%s: Watching HEAD of %d git repositories" % (PACKAGE_NAME, len(repos)))
+
+    def poll(self):
+        """
+        Checks every repository for a moved HEAD and reports the changed
+        folders. Called periodically by the watch thread.
+        """
+        with self._lock:
+            repos = list(self._repos.values())
+
+        changed = set()
+        for repo in repos:
+            changed |= self._poll_repo(repo)
+
+        if not changed:
+            return
+
+        if DEBUG:
+            print("%s: HEAD moved, changed folders: %s" % (PACKAGE_NAME, changed))
+
+        try:
+            self._on_change(changed)
+        except Exception as e:
+            print("%s: Git HEAD watcher callback failed: %s" % (PACKAGE_NAME, e))
+
+    def tick(self, now):
+        if now - self._last_poll >= self._poll_interval:
+            self._last_poll = now
+            self.poll()
+
+    def _poll_repo(self, repo):
+        signature = repo.head_signature()
+        if signature == repo.signature:
+            return set()
+
+        repo.signature = signature
+        old_commit = repo.commit
+        repo.commit = head_commit(self._git, repo.work_tree)
+
+        if not old_commit or not repo.commit or old_commit == repo.commit:
+            return set()
+
+        files = changed_files(self._git, repo.work_tree, old_commit, repo.commit)
+        if files is None:
+            # Not knowing what changed, everything might have
+            return set(repo.folders)
+
+        changed = set()
+        prefixes = tuple(os.path.join(f, '') for f in repo.folders)
+
+        for path in files:
+            folder = os.path.dirname(os.path.join(repo.work_tree, os.path.normpath(path)))
+            if folder in repo.folders or folder.startswith(prefixes):
+                changed.add(folder)
+
+        return changed
@@ -0,0 +1,354 @@
+import os
+import stat
+import struct
+import time
+from collections import namedtuple
+
+from ..SublimeCscope import DEBUG, PACKAGE_NAME
+from .file_index import DirRecord, folder_key, file_hash
+from .crawl_stats import CrawlStats
+from .scandir_crawler import RACY_MTIME_NS, NSECS_PER_SEC
+
+GIT_FOLDER = '.git'
+GIT_INDEX_FILE = 'index'
+GIT_INDEX_SIGNATURE = b'DIRC'
+SUPPORTED_VERSIONS = (2, 3, 4)
+
+SHA1_SIZE = 20
+SHA256_SIZE = 32
+
+# ctime_s, ctime_ns, mtime_s, mtime_ns, dev, ino, mode, uid, gid, size
+_ENTRY_STAT = struct.Struct('>10I')
+_HEADER = struct.Struct('>4sII')
+_UINT16 = struct.Struct('>H')
+
+FLAG_EXTENDED = 0x4000
+FLAG_STAGE_MASK = 0x3000
+FLAG_NAME_MASK = 0x0fff
+EXT_FLAG_SKIP_WORKTREE = 0x4000
+EXT_FLAG_INTENT_TO_ADD = 0x2000
+
+GitIndexEntry = namedtuple('GitIndexEntry', ['path', 'mode', 'size', 'mtime_ns'])
+
+
+class GitIndexError(Exception):
+    pass
+
+
+def find_git_dir(path):
+    """
+    Looks for the git repository containing path.
+    Returns a tuple (work_tree, git_dir) or (None, None) if path is
+    not part of a git work tree.
+    """
+    path = os.path.abspath(path)
+
+    while True:
+        dot_git = os.path.join(path, GIT_FOLDER)
+
+        if os.path.isdir(dot_git):
+            return (path, dot_git)
+
+        if os.path.isfile(dot_git):
+            # worktrees and submodules use a file pointing at the real git dir
+            try:
+                with open(dot_git, encoding='utf-8') as f:
+                    line = f.readline().strip()
+            except OSError:
+                line = ''
+
+            if line.startswith('gitdir:'):
+                git_dir = line[len('gitdir:'):].strip()
+                return (path, os.path.normpath(os.path.join(path, git_dir)))
+
+        parent = os.path.dirname(path)
+        if parent == path:
+            return (None, None)
+        path = parent
+
+
+def _hash_size(git_dir):
+    # Repositories using SHA-256 announce it in their config
+    try:
+        with open(os.path.join(git_dir, 'config'), encoding='utf-8') as f:
+            for line in f:
+                key, _, value = line.partition('=')
+                if key.strip().lower() == 'objectformat' and value.strip() == 'sha256':
+                    return SHA256_SIZE
+    except OSError:
+        pass
+
+    return SHA1_SIZE
+
+
+def _read_varint(data, offset):
+    # The offset encoding used by index version 4 (see varint.c in git)
+    c = data[offset]
+    offset += 1
+    value = c & 0x7f
+
+    while c & 0x80:
+        c = data[offset]
+        offset += 1
+        value = ((value + 1) << 7) | (c & 0x7f)
+
+    return value, offset
+
+
+def read_git_index(git_dir):
+    """
+    Parses the index file of a git repository and returns a list of
+    GitIndexEntry, one for each file in the work tree. Entries that are in
+    conflict (stage > 0), marked as skip-worktree or intent-to-add are left out.
+    Paths are relative to the work tree and use '/' as separator.
+    """
+    index_file = os.path.join(git_dir, GIT_INDEX_FILE)
+
+    try:
+        with open(index_file, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        raise GitIndexError(str(e))
+
+    if len(data) < _HEADER.size:
+        raise GitIndexError("%s is truncated" % index_file)
+
+    signature, version, num_entries = _HEADER.unpack_from(data, 0)
+
+    if signature != GIT_INDEX_SIGNATURE:
+        raise GitIndexError("%s is not a git index" % index_file)
+
+    if version not in SUPPORTED_VERSIONS:
+        raise GitIndexError("%s has unsupported version %d" % (index_file, version))
+
+    hash_size = _hash_size(git_dir)
+    entries = []
+    offset = _HEADER.size
+    prev_name = b''
+
+    try:
+        for _ in range(num_entries):
+            entry_start = offset
+            (_, _, mtime_s, mtime_ns, _, _,
+             mode, _, _, size) = _ENTRY_STAT.unpack_from(data, offset)
+            offset += _ENTRY_STAT.size + hash_size
+
+            flags, = _UINT16.unpack_from(data, offset)
+            offset += _UINT16.size
+
+            ext_flags = 0
+            if flags & FLAG_EXTENDED:
+                ext_flags, = _UINT16.unpack_from(data, offset)
+                offset += _UINT16.size
+
+            if version == 4:
+                strip_len, offset = _read_varint(data, offset)
+                name_end = data.index(b'\0', offset)
+                name = prev_name[:len(prev_name) - strip_len] + data[offset:name_end]
+                offset = name_end + 1
+            else:
+                name_end = data.index(b'\0', offset)
+                name = data[offset:name_end]
+                # entries are padded with 1-8 NUL bytes to a multiple of 8
+                offset = entry_start + ((name_end - entry_start + 8) & ~7)
+
+            prev_name = name
+
+            if flags & FLAG_STAGE_MASK:
+                continue
+
+            if ext_flags & (EXT_FLAG_SKIP_WORKTREE | EXT_FLAG_INTENT_TO_ADD):
+                continue
+
+            entries.append(GitIndexEntry(os.fsdecode(name), mode, size,
+                                         mtime_s * 1000000000 + mtime_ns))
+    except (struct.error, ValueError, IndexError):
+        raise GitIndexError("%s is truncated" % index_file)
+
+    if DEBUG:
+        print("%s: Read %d entries from %s" % (PACKAGE_NAME, len(entries), index_file))
+
+    return entries
+
+
+def crawl_folder(start_path, base_path, follow_syms, config, result, stats=None,
+                 folder_cache=None, cancel_token=None):
+    """
+    Enumerates the files below start_path using the index of the git
+    repository it belongs to. The size and mtime of tracked files are taken
+    from the index, so only folders and untracked files are stat:ed. Since git
+    only refreshes the index on commands like 'git status' or 'git add', in
+    place modifications of tracked files may not show up until then.
+
+    Folders still have to be listed to find the untracked files. folder_cache
+    is a dict kept between crawls, if given. Folders whose mtime did not
+    change since the previous crawl are not listed again, their listing is
+    taken from the cache instead.
+
+    The result has the same layout as Crawler.crawl. The file system calls
+    made are added to stats, if given.
+    Returns False if start_path is not part of a git work tree. Raises
+    cancellation.Cancelled if cancel_token is cancelled while crawling.
+    """
+    work_tree, git_dir = find_git_dir(start_path)
+    if not work_tree:
+        return False
+
+    try:
+        index_entries = read_git_index(git_dir)
+    except GitIndexError as e:
+        print("%s: %s" % (PACKAGE_NAME, e))
+        return False
+
+    # {folder path: {file name: entry}}
+    tracked = {}
+    for entry in index_entries:
+        path = os.path.join(work_tree, os.path.normpath(entry.path))
+        folder, name = os.path.split(path)
+        tracked.setdefault(folder, {})[name] = entry
+
+    start_path = os.path.normpath(start_path)
+    if DEBUG: print("Starting to crawl folder: %s using git index" % start_path)
+
+    if stats is None:
+        stats = CrawlStats()
+
+    crawl_start_ns = int(time.time() * NSECS_PER_SEC)
+    listed = set()
+    # The stat result of a sub folder is handed down to its own listing
+    stack = [(start_path, None)]
+
+    while stack:
+        if cancel_token:
+            cancel_token.check()
+
+        path, st = stack.pop()
+
+        try:
+            if st is None:
+                stats.stat_calls += 1
+                st = os.stat(path, follow_symlinks=follow_syms)
+        except OSError:
+            continue
+
+        key = folder_key(st)
+        if key in result:
+            if DEBUG: print("Folder %s was already visited" % path)
+            continue
+
+        tracked_files = tracked.get(path, {})
+        entries = _list_folder(path, st, tracked_files, folder_cache, crawl_start_ns, stats)
+        if entries is None:
+            continue
+
+        listed.add(path)
+        matching_files = []
+        hashes = []
+        subdirs = []
+
+        for name, is_dir, inode in entries:
+            entry_path = os.path.join(path, name)
+
+            if is_dir:
+                if not config.folder_name_matches(path, name, base_path, stats):
+                    stats.rejected_by_name += 1
+                    continue
+
+                try:
+                    stats.stat_calls += 1
+                    entry_st = os.stat(entry_path, follow_symlinks=follow_syms)
+                except OSError:
+                    continue
+
+                if stat.S_ISDIR(entry_st.st_mode):
+                    subdirs.append((entry_path, entry_st))
+                continue
+
+            if not config.file_name_matches(path, name, base_path, stats):
+                stats.rejected_by_name += 1
+                continue
+
+            git_entry = tracked_files.get(name, None)
+
+            # Symlinks are tracked as links, so those have to be stat:ed.
+            # The index only stores the lower 32 bits of the inode number
+            # but the directory entry has all of it. Files tracked after
+            # their folder was cached have no inode yet.
+            if git_entry and stat.S_ISREG(git_entry.mode) and inode is not None:
+                st_mode = git_entry.mode
+                size = git_entry.size
+                hash_value = file_hash(git_entry.mtime_ns, git_entry.size, inode)
+            else:
+                try:
+                    stats.stat_calls += 1
+                    entry_st = os.stat(entry_path, follow_symlinks=follow_syms)
+                except OSError as e:
+                    print("%s: %s" % (PACKAGE_NAME, e))
+                    continue
+                st_mode = entry_st.st_mode
+                size = entry_st.st_size
+                hash_value = file_hash(entry_st.st_mtime_ns, entry_st.st_size,
+                                       entry_st.st_ino)
+
+            if stat.S_ISREG(st_mode) and config.file_content_matches(path, name, size,
+                                                                     hash_value, stats):
+                matching_files.append(name)
+                hashes.append(hash_value)
+
+        result[key] = DirRecord(path, matching_files, hashes)
+        stack.extend(reversed(subdirs))
+
+    if folder_cache is not None:
+        # Forget about folders below start_path that no longer exist
+        prefix = os.path.join(start_path, '')
+        for path in list(folder_cache.keys()):
+            if (path == start_path or path.startswith(prefix)) and path not in listed:
+                del folder_cache[path]
+
+    if DEBUG:
+        print("%s: Crawled %s using git index (%d tracked files)" %
+                    (PACKAGE_NAME, start_path, len(index_entries)))
+
+    return True
+
+
+def _list_folder(path, st, tracked_files, folder_cache, crawl_start_ns, stats):
+    """
+    Returns the entries of the folder path as (name, is_dir, inode) tuples,
+    taken from folder_cache if the folder did not change since it was cached.
+    The inode is only looked up for tracked files, since it costs a stat call
+    on Windows. Returns None if the folder can't be listed.
+    """
+    ident = (st.st_dev, st.st_ino, st.st_mtime_ns)
+
+    if folder_cache is not None:
+        cached = folder_cache.get(path, None)
+        if cached and cached[0] == ident:
+            return cached[1]
+
+    entries = []
+    try:
+        stats.listdir_calls += 1
+        for entry in os.scandir(path):
+            if entry.name == GIT_FOLDER:
+                continue
+
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            inode = entry.inode() if entry.name in tracked_files else None
+            entries.append((entry.name, is_dir, inode))
+    except OSError:
+        return None
+
+    if folder_cache is not None:
+        # Same as the scandir crawler, folders modified right before the
+        # crawl started may be modified again without a visible mtime change
+        if st.st_mtime_ns + RACY_MTIME_NS >= crawl_start_ns:
+            folder_cache.pop(path, None)
+        else:
+            folder_cache[path] = (ident, entries)
+
+    return entries
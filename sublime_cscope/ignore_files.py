@@ -0,0 +1,253 @@
+import os
+import re
+import time
+
+from ..SublimeCscope import PACKAGE_NAME
+from .pattern_matcher import translate_pattern
+from .scandir_crawler import RACY_MTIME_NS, NSECS_PER_SEC
+from .crawl_stats import CrawlStats
+
+IGNORE_FILE_NAMES = ('.gitignore', '.ignore')
+
+# git ignores case in ignore files on case insensitive file systems
+_CASE_FLAGS = re.I if os.path.normcase('A') != 'A' else 0
+
+_ESCAPED_CHAR = re.compile(r'\\(.)')
+
+
+def _unescape(match):
+    # A backslash escaped wildcard is put in brackets, which is the only
+    # way to match it literally with fnmatch style patterns
+    c = match.group(1)
+    return '[%s]' % c if c in '*?[\\' else c
+
+
+def _parse_line(line):
+    """
+    Parses one line of an ignore file into a tuple of
+    (regular expression, negated, dir_only) or None if the line does not
+    hold a pattern. The expression matches a path relative to the folder
+    of the ignore file, using '/' as separator.
+    """
+    line = line.rstrip('\r\n')
+    if not line or line.startswith('#'):
+        return None
+
+    # Trailing spaces are ignored unless escaped
+    stripped = line.rstrip(' ')
+    if stripped.endswith('\\') and stripped != line:
+        stripped += ' '
+    line = stripped
+
+    negated = line.startswith('!')
+    if negated:
+        line = line[1:]
+
+    dir_only = line.endswith('/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+
+    # A pattern with a separator anywhere but at the end is relative to the
+    # folder of the ignore file. Other patterns match at any level below it.
+    anchored = '/' in line
+    segments = line.lstrip('/').split('/')
+    parts = [] if anchored else ['(?:.*/)?']
+
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+
+        if segment == '**':
+            parts.append('.*' if last else '(?:.*/)?')
+            continue
+
+        parts.append(translate_pattern(_ESCAPED_CHAR.sub(_unescape, segment), True))
+        if not last:
+            parts.append('/')
+
+    return (''.join(parts), negated, dir_only)
+
+
+def parse_ignore_file(lines):
+    """
+    Compiles the lines of an ignore file into a list of
+    (regex, negated, dir_only) groups. Consecutive patterns with the same
+    kind share one expression, so a large ignore file is matched with a
+    handful of regular expressions. The last matching group wins.
+    """
+    groups = []
+    current = None
+
+    for line in lines:
+        rule = _parse_line(line)
+        if not rule:
+            continue
+
+        expr, negated, dir_only = rule
+        if current and current[1:] == (negated, dir_only):
+            current[0].append(expr)
+        else:
+            current = ([expr], negated, dir_only)
+            groups.append(current)
+
+    return [(re.compile('(?:%s)\\Z' % '|'.join(exprs), re.S | _CASE_FLAGS), negated, dir_only)
+                for exprs, negated, dir_only in groups]
+
+
+class IgnoreFiles:
+    """
+    Honours ignore files (.gitignore and .ignore) found in the project
+    folders while crawling. The rules of a folder apply to everything below
+    it and rules of deeper folders take precedence, like in git.
+
+    The compiled rules are cached per folder and recompiled only when the
+    modification time of one of its ignore files changes. Folders check
+    their ignore files once per crawl, see revalidate(). Ignore files can
+    not come or go without changing the mtime of their folder, so folders
+    whose mtime was reported unchanged by the crawler, see folder_visited(),
+    only stat the ignore files they already had. Safe to use from several
+    threads.
+    """
+
+    def __init__(self, file_names=IGNORE_FILE_NAMES):
+        self._file_names = tuple(file_names)
+        # {folder path: (folder mtime, ignore file mtimes, compiled groups)}
+        self._rules = {}
+        # {(folder path, base path): (folder is ignored, rule chain)},
+        # valid for one crawl
+        self._folders = {}
+        # {folder path: folder mtime}, valid for one crawl
+        self._folder_mtimes = {}
+
+    def __bool__(self):
+        return bool(self._file_names)
+
+    def __eq__(self, r):
+        if not isinstance(r, self.__class__):
+            return NotImplemented
+
+        return self._file_names == r._file_names
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self._file_names))
+
+    def revalidate(self):
+        """
+        Makes every folder check its ignore files again the next time it is
+        visited. Rules of unchanged ignore files are not recompiled.
+        """
+        self._folders = {}
+        self._folder_mtimes = {}
+
+    def folder_visited(self, dirpath, mtime_ns):
+        """ Records the mtime of dirpath, as stat:ed by the current crawl """
+        self._folder_mtimes[dirpath] = mtime_ns
+
+    def is_ignored(self, dirpath, name, is_dir, base_path, stats=None):
+        """
+        Returns True if name in dirpath, or any of the folders between it and
+        base_path, is ignored by the ignore files below base_path. The file
+        system calls made are added to stats, if given.
+        """
+        ignored, chain = self._folder_state(dirpath, base_path, stats)
+        return ignored or _chain_matches(chain, dirpath, name, is_dir)
+
+    def _folder_state(self, dirpath, base_path, stats):
+        key = (dirpath, base_path)
+        state = self._folders.get(key, None)
+        if state is not None:
+            return state
+
+        ignored = False
+        chain = ()
+        if dirpath != base_path and dirpath.startswith(os.path.join(base_path, '')):
+            parent, name = os.path.split(dirpath)
+            parent_ignored, chain = self._folder_state(parent, base_path, stats)
+            ignored = parent_ignored or _chain_matches(chain, parent, name, True)
+
+        # git does not read the ignore files of ignored folders either
+        if not ignored:
+            rules = self._load(dirpath, stats)
+            if rules:
+                chain = chain + ((len(os.path.join(dirpath, '')), rules),)
+
+        state = (ignored, chain)
+        self._folders[key] = state
+        return state
+
+    def _load(self, dirpath, stats):
+        if stats is None:
+            stats = CrawlStats()
+
+        folder_mtime = self._folder_mtimes.get(dirpath, None)
+        cached = self._rules.get(dirpath, None)
+        folder_unchanged = (cached is not None and folder_mtime is not None and
+                            cached[0] == folder_mtime)
+
+        mtimes = []
+        for idx, file_name in enumerate(self._file_names):
+            if folder_unchanged and cached[1][idx] is None:
+                mtimes.append(None)
+                continue
+
+            try:
+                stats.stat_calls += 1
+                mtimes.append(os.stat(os.path.join(dirpath, file_name)).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+
+        # A folder modified right before it was visited may be modified again
+        # without any visible change of its mtime, same as in the crawlers
+        if folder_mtime is not None and \
+                folder_mtime + RACY_MTIME_NS >= int(time.time() * NSECS_PER_SEC):
+            folder_mtime = None
+
+        mtimes = tuple(mtimes)
+        if not any(m is not None for m in mtimes):
+            # Remembered only if it saves stat calls next time
+            if folder_mtime is None:
+                self._rules.pop(dirpath, None)
+            else:
+                self._rules[dirpath] = (folder_mtime, mtimes, None)
+            return None
+
+        if cached and cached[1] == mtimes:
+            if cached[0] != folder_mtime:
+                self._rules[dirpath] = (folder_mtime, mtimes, cached[2])
+            return cached[2]
+
+        lines = []
+        for file_name, mtime in zip(self._file_names, mtimes):
+            if mtime is None:
+                continue
+
+            try:
+                stats.file_reads += 1
+                with open(os.path.join(dirpath, file_name), encoding='utf-8',
+                          errors='replace') as f:
+                    lines.extend(f)
+            except OSError as e:
+                print("%s: %s" % (PACKAGE_NAME, e))
+
+        rules = parse_ignore_file(lines)
+        self._rules[dirpath] = (folder_mtime, mtimes, rules)
+        return rules
+
+
+def _chain_matches(chain, dirpath, name, is_dir):
+    # The deepest ignore file and the last group in it decides
+    path = os.path.join(dirpath, name)
+
+    for prefix_len, rules in reversed(chain):
+        rel_path = path[prefix_len:]
+        if os.sep != '/':
+            rel_path = rel_path.replace(os.sep, '/')
+
+        for regex, negated, dir_only in reversed(rules):
+            if dir_only and not is_dir:
+                continue
+
+            if regex.match(rel_path):
+                return not negated
+
+    return False
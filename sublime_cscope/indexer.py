@@ -1,15 +1,17 @@
 
 import os
-import sys
+import re
 import stat
-import fnmatch
+import time
+import json
+import heapq
 import threading
 import traceback
-from queue import Queue
-from threading import Thread, Event
-from collections import defaultdict
-from functools import wraps, partial, reduce
-from itertools import filterfalse, chain
+from collections import deque
+from concurrent import futures
+from threading import Thread, Event, Condition
+from functools import wraps, partial
+from itertools import filterfalse, chain, count
 
 import sublime
 
@@ -26,10 +28,29 @@ PRIMARY_DB = 'primary'
 # most likely be out of date, for the files being modified. That is ok since
 # the primary DB will hold up to date information for those files.
 SECONDARY_DB = 'secondary'
+# The secondary DB can also be split into shards, named secondary-0,
+# secondary-1 and so on, which are built and queried in parallel. See the
+# 'secondary_db_shards' setting.
+SECONDARY_DB_SHARD = SECONDARY_DB + '-%d'
+# Which shard each top level folder of the project was packed into
+SHARD_MAP = SECONDARY_DB + '.shards'
 
 from ..SublimeCscope import DEBUG, PACKAGE_NAME
 from . import settings
 from . import cscope_runner
+from . import scandir_crawler
+from . import snapshot
+from . import file_watcher
+from . import git_head_watcher
+from . import git_index
+from . import pattern_matcher
+from . import file_guard
+from . import ignore_files
+from .cancellation import CancelToken, Cancelled
+from .actor_stats import ActorStats
+from .file_index import DirRecord, InodeSet, folder_key, file_hash, count_files, diff_index
+from .file_index import MerkleTree
+from .crawl_stats import CrawlStats
 
 DEBUG_DECORATORS = False
 DEBUG_INDEXERCONFIG = False
@@ -39,6 +60,40 @@ DB_FOLDER_POSTFIX = '-' + PACKAGE_NAME.lower()
 
 TWO_TIER_THRESHOLD = 50
 
+# Available crawler engines. See the 'crawler_engine' setting.
+CRAWLER_ENGINE_WALK = 'walk'
+CRAWLER_ENGINE_SCANDIR = 'scandir'
+
+FILE_ENUMERATION_FILESYSTEM = 'filesystem'
+FILE_ENUMERATION_GIT = 'git'
+
+# Per folder crawl modes. See 'sublimecscope_crawl_mode' in the settings.
+CRAWL_MODE_LOCAL = 'local'
+CRAWL_MODE_NETWORK = 'network'
+
+# Full crawls hand their results to the Indexer in batches of this many
+# folders while the crawl is still running. The Indexer streams them
+# into this file, which becomes the file list once the crawl is done.
+STREAM_BATCH_SIZE = 256
+STREAMED_FILE_LIST = 'crawl.files.tmp'
+
+# Message priorities. Lower values are received first.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+# Quitting lets the actor finish all messages sent before
+_PRIORITY_QUIT = PRIORITY_LOW + 1
+
+# All Indexers share this many worker threads
+INDEXER_WORKERS = 4
+# The maximum number of crawls running at once, over all projects. Every
+# Crawler runs on a pool of this size.
+MAX_CONCURRENT_CRAWLS = 2
+
+# The longest the UI thread waits for an answer from an indexer, in seconds.
+# A database build keeps an indexer busy for as long as it takes.
+UI_CALL_TIMEOUT = 2.0
+
 # The global dict of indexers
 # There should be one per project or workspace
 _indexers = {}
@@ -52,56 +107,186 @@ class UnhandledMessageException(Exception):
     pass
 
 class ActorCommandMsg():
-    def __init__(self, action, wait_for_result=False, result_callback=None):
+    """
+    A call to be run by an actor. The outcome is delivered through a
+    concurrent.futures.Future, which the sender can wait on with a timeout,
+    add callbacks to, or cancel while the message is still queued.
+
+    Exceptions raised by the call are re-raised on the actor thread as well,
+    unless the sender waits for the result.
+    """
+
+    def __init__(self, action, wait_for_result=False, result_callback=None, name=None):
         self._action = action
-        self._result = Queue() if wait_for_result else None
+        self.name = name
+        self.sent_at = time.perf_counter()
+        self._future = futures.Future()
+        self._wait_for_result = wait_for_result
         self._result_callback = result_callback
+        # Messages that were coalesced into this one
+        self._superseded = []
+
+    @property
+    def future(self):
+        return self._future
+
+    def supersede(self, msg):
+        """
+        Called by the mailbox when this message replaces msg, a queued
+        message with the same coalescing key. Only our action is run, but
+        the result is delivered to the sender of msg as well.
+        """
+        msg._action = None
+        self._superseded.extend(msg._superseded)
+        self._superseded.append(msg)
+        msg._superseded = []
 
     def _set_result(self, result):
-        if self._result:
-            self._result.put(result)
-        elif isinstance(result, Exception):
-            raise result
-        elif self._result_callback:
-            self._result_callback(result)
-
-    def result(self):
-        if self._result:
-            res = self._result.get()
-            if isinstance(res, Exception):
-                raise res
-            return res
+        if isinstance(result, Exception):
+            self._future.set_exception(result)
         else:
-            return None
+            self._future.set_result(result)
+            if self._result_callback:
+                self._result_callback(result)
+
+    def cancel(self):
+        """ Cancels the message and the ones it superseded, unless running """
+        for msg in chain((self,), self._superseded):
+            msg._future.cancel()
+
+    def result(self, timeout=None):
+        """
+        Waits for the result, at most timeout seconds if given. Raises
+        concurrent.futures.TimeoutError if it did not arrive in time.
+        """
+        return self._future.result(timeout)
 
     def run(self):
+        # The action is skipped if every sender cancelled it
+        msgs = [msg for msg in chain((self,), self._superseded)
+                    if msg._future.set_running_or_notify_cancel()]
+        if not msgs:
+            return
+
         try:
             res = self._action()
         except Exception as e:
             res = e
-        finally:
-            self._set_result(res)
 
-# Decorator that hides the details of sending messages to Actors
-def send_msg(func):
+        for msg in msgs:
+            msg._set_result(res)
+
+        if isinstance(res, Exception) and not any(msg._wait_for_result for msg in msgs):
+            raise res
+
+def same_args(*args, **kwds):
+    """ Coalescing key for messages that collapse if their arguments are equal """
+    return (args, tuple(sorted(kwds.items())))
+
+
+def any_args(*args, **kwds):
+    """ Coalescing key for messages that are superseded by the latest one """
+    return ()
+
+
+class Mailbox:
+    """
+    The message queue of an actor. Messages are received in priority order
+    and in the order they were sent within a priority.
+
+    A message sent with a coalescing key replaces the message with the same
+    key still waiting in the mailbox, if any (see ActorCommandMsg.supersede).
+    The new message is queued last, so it is still received after every
+    message that was sent before it.
+    """
+
+    def __init__(self):
+        self._cond = Condition()
+        # [[priority, sequence number, coalescing key, msg]], where msg is
+        # None for replaced messages
+        self._heap = []
+        self._seq = count()
+        self._size = 0
+        # {coalescing key: heap entry}
+        self._keyed = {}
+
+    def __len__(self):
+        return self._size
+
+    def put(self, msg, priority=PRIORITY_NORMAL, coalesce_key=None):
+        with self._cond:
+            if coalesce_key is not None:
+                queued = self._keyed.pop(coalesce_key, None)
+                if queued:
+                    msg.supersede(queued[3])
+                    queued[3] = None
+                    self._size -= 1
+
+            entry = [priority, next(self._seq), coalesce_key, msg]
+            if coalesce_key is not None:
+                self._keyed[coalesce_key] = entry
+
+            heapq.heappush(self._heap, entry)
+            self._size += 1
+            self._cond.notify()
+
+    def get(self):
+        with self._cond:
+            while not self._size:
+                self._cond.wait()
+
+            while True:
+                _, _, coalesce_key, msg = heapq.heappop(self._heap)
+                if msg is not None:
+                    break
+
+            self._size -= 1
+            if coalesce_key is not None:
+                del self._keyed[coalesce_key]
+            return msg
+
+    def clear(self):
+        """ Empties the mailbox and returns the messages it held, in order """
+        with self._cond:
+            msgs = [entry[3] for entry in sorted(self._heap) if entry[3] is not None]
+            self._heap = []
+            self._keyed.clear()
+            self._size = 0
+            return msgs
+
+
+# Decorator that hides the details of sending messages to Actors.
+# Used either as @send_msg or as @send_msg(priority=..., coalesce=...),
+# where coalesce is a function of the arguments returning the coalescing
+# key, e.g. same_args or any_args.
+# A message sent with wait_for_result=True returns the result, waiting at
+# most 'timeout' seconds if given. Other messages return the Future of the
+# message. Calls made by the actor itself run directly and return the result.
+def send_msg(func=None, priority=PRIORITY_NORMAL, coalesce=None):
+    if func is None:
+        return partial(send_msg, priority=priority, coalesce=coalesce)
+
     @wraps(func)
     def wrapper(self, *args, **kwds):
         result_cb = None
         is_sync = False
         send_always = False
+        timeout = None
 
         #make sure the Actor is started
         self.start()
-        if not self._is_started():
+        # Messages to a scheduled actor that quit are dropped by send()
+        if not self._is_started() and not self._closed:
             raise AssertionError("Actor %s is not running" % self.__class__)
 
-        is_external = bool(self._thread_id and self._thread_id != threading.get_ident())
+        is_external = _current_actor() is not self
 
         #strip away any arguments aimed for the decorator
         if kwds:
             result_cb = kwds.pop('result_callback', None)
             is_sync = kwds.pop('wait_for_result', False)
             send_always = kwds.pop('send_always', False)
+            timeout = kwds.pop('timeout', None)
 
         #deadly combo, that will cause a deadlock in the actor
         if send_always and is_sync and not is_external:
@@ -109,26 +294,164 @@ def send_msg(func):
 
         if send_always or is_external:
             action = lambda: func(self, *args, **kwds)
-            msg = ActorCommandMsg(action, wait_for_result=is_sync, result_callback=result_cb)
+            msg = ActorCommandMsg(action, wait_for_result=is_sync, result_callback=result_cb,
+                                  name=func.__name__)
             if DEBUG_DECORATORS:
                 print("Sending %s msg: %s" % ('sync' if is_sync else 'async', func.__name__))
-            self.send(msg)
-            return msg.result()
+            self.send(msg, priority, _coalesce_key(func, coalesce, args, kwds))
+            if not is_sync:
+                return msg.future
+
+            try:
+                return msg.result(timeout)
+            except futures.TimeoutError:
+                # Don't leave work behind that nobody waits for
+                msg.future.cancel()
+                raise
 
         if DEBUG_DECORATORS: print("Calling %s directly" % func.__name__)
         return func(self, *args, **kwds)
     return wrapper
 
+def _coalesce_key(func, coalesce, args, kwds):
+    if not coalesce:
+        return None
+
+    key = (func.__name__, coalesce(*args, **kwds))
+    try:
+        hash(key)
+    except TypeError:
+        # e.g. sets or lists as arguments, those are never coalesced
+        return None
+    return key
+
+_local = threading.local()
+
+def _current_actor():
+    """ The actor handling a message in the calling thread, if any """
+    return getattr(_local, 'actor', None)
+
+class ActorScheduler:
+    """
+    Runs many actors on a small, fixed pool of worker threads. An actor
+    with messages in its mailbox is queued for a worker, which handles one
+    message and then puts the actor back at the end of the queue if it has
+    more. An actor is never run by two workers at once, so it handles its
+    messages one by one, just like an actor with a thread of its own.
+
+    The workers are started when the first actor is scheduled.
+    """
+
+    def __init__(self, num_workers, name):
+        self._num_workers = num_workers
+        self._name = name
+        self._cond = Condition()
+        self._run_queue = deque()
+        # The actors that are queued or being run
+        self._scheduled = set()
+        self._workers = []
+        self._stopping = False
+
+    @property
+    def num_workers(self):
+        return self._num_workers
+
+    def schedule(self, actor):
+        with self._cond:
+            # An actor being run is rescheduled by its worker if needed
+            if actor in self._scheduled:
+                return
+
+            self._scheduled.add(actor)
+            self._run_queue.append(actor)
+
+            while len(self._workers) < self._num_workers:
+                t = Thread(target=self._work, name='%s-%d' % (self._name, len(self._workers)))
+                t.daemon = True
+                t.start()
+                self._workers.append(t)
+
+            self._cond.notify()
+
+    def shutdown(self):
+        """ Stops the workers. Must not be called from one of them. """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            workers = self._workers
+            self._workers = []
+
+        for t in workers:
+            t.join()
+
+        with self._cond:
+            self._stopping = False
+            self._run_queue.clear()
+            self._scheduled.clear()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._run_queue and not self._stopping:
+                    self._cond.wait()
+
+                if self._stopping:
+                    return
+
+                actor = self._run_queue.popleft()
+
+                # A message can be handled by a worker between being put in
+                # the mailbox and the actor being scheduled for it
+                if not len(actor._mailbox):
+                    self._scheduled.discard(actor)
+                    continue
+
+            actor._run_one()
+
+            with self._cond:
+                # An actor that quit still has to handle ActorQuit
+                if not actor._terminated.is_set() and len(actor._mailbox):
+                    self._run_queue.append(actor)
+                    self._cond.notify()
+                else:
+                    self._scheduled.discard(actor)
+
+# Shared by all Indexers and all Crawlers respectively
+_indexer_scheduler = ActorScheduler(INDEXER_WORKERS, 'Indexer')
+_crawl_scheduler = ActorScheduler(MAX_CONCURRENT_CRAWLS, 'Crawler')
+
 class ActorBase:
-    def __init__(self):
-        self._mailbox = Queue()
+    """
+    Actors get a thread of their own, unless they are given an
+    ActorScheduler to share its workers with other actors.
+    """
+
+    def __init__(self, scheduler=None):
+        self._mailbox = Mailbox()
+        self._scheduler = scheduler
         self._started = Event()
         self._terminated = Event()
+        # Set by quit() for scheduled actors, which are not restarted
+        self._closed = False
         self._thread_id = 0
         self.recv_count = 0
+        self._stats = ActorStats()
 
-    def send(self, msg):
-        self._mailbox.put(msg)
+    @property
+    def stats(self):
+        """ The ActorStats of the messages handled so far """
+        return self._stats
+
+    def send(self, msg, priority=PRIORITY_NORMAL, coalesce_key=None):
+        if self._closed:
+            if isinstance(msg, ActorCommandMsg):
+                msg.cancel()
+            return
+
+        self._mailbox.put(msg, priority, coalesce_key)
+        # Messages sent before start() wait for it, as with a thread
+        if self._scheduler and self._started.is_set():
+            self._scheduler.schedule(self)
 
     def recv(self):
         msg = self._mailbox.get()
@@ -138,19 +461,21 @@ class ActorBase:
         return msg
 
     def _close(self):
-        self.send(ActorQuit)
+        self.send(ActorQuit, _PRIORITY_QUIT)
 
     def _join(self):
         self._terminated.wait()
 
     def _bootstrap(self):
         try:
+            _local.actor = self
             self._thread_id = threading.get_ident()
             self._started.set()
             self._run()
         except ActorQuit:
-            pass
+            self._on_quit()
         finally:
+            _local.actor = None
             self._thread_id = 0
             self._started.clear()
             self._terminated.set()
@@ -158,27 +483,88 @@ class ActorBase:
 
     def _run(self):
         while True:
-            msg = self.recv()
+            self._handle(self.recv())
+
+    def _run_one(self):
+        # Handles one message on a worker thread of the scheduler
+        _local.actor = self
+        self._thread_id = threading.get_ident()
+
+        try:
+            self._handle(self.recv())
+        except ActorQuit:
+            self._on_quit()
+            self._started.clear()
+            self._terminated.set()
+        except Exception:
+            # Unlike a thread of its own, the worker must survive this
+            traceback.print_exc()
+        finally:
+            _local.actor = None
+            self._thread_id = 0
+
+    def _handle(self, msg):
+        depth = len(self._mailbox)
+        start = time.perf_counter()
+
+        try:
             if isinstance(msg, ActorCommandMsg):
                 msg.run()
             else:
                 self.handle_message(msg)
+        finally:
+            if isinstance(msg, ActorCommandMsg):
+                self._stats.record(msg.name or 'command', depth, start - msg.sent_at,
+                                   time.perf_counter() - start)
+            else:
+                self._stats.record(type(msg).__name__, depth, None,
+                                   time.perf_counter() - start)
 
     def _is_started(self):
-        return self._started.is_set() and not self._terminated.is_set()
+        return (self._started.is_set() and not self._terminated.is_set() and
+                not self._closed)
 
     def handle_message(self, msg):
         raise UnhandledMessageException(msg)
 
+    def _on_quit(self):
+        """ Called by the actor itself when it quits """
+        pass
+
     def quit(self):
-        self._close()
-        self._join()
+        if not self._scheduler:
+            self._close()
+            self._join()
+            return
+
+        # The workers are shared with other actors and may be busy with them
+        # for a long time, so we never wait here. The queued messages are
+        # dropped and the actor quits on a worker after the message it may be
+        # handling right now.
+        self._closed = True
+        for msg in self._mailbox.clear():
+            if isinstance(msg, ActorCommandMsg):
+                msg.cancel()
+
+        if self._started.is_set():
+            self._mailbox.put(ActorQuit, _PRIORITY_QUIT)
+            self._scheduler.schedule(self)
+        else:
+            self._on_quit()
+            self._terminated.set()
 
     def start(self):
-        if self._is_started():
+        if self._is_started() or self._closed:
             return
 
         self._terminated.clear()
+
+        if self._scheduler:
+            self._started.set()
+            if len(self._mailbox):
+                self._scheduler.schedule(self)
+            return
+
         t = Thread(target=self._bootstrap)
         t.daemon = True
         t.start()
@@ -191,35 +577,112 @@ class Indexer(ActorBase):
     """
 
     def __init__(self):
-        super().__init__()
+        super().__init__(scheduler=_indexer_scheduler)
         self._crawler = Crawler()
         self._crawl_in_progress = False
+        # Folders to crawl once the crawl in progress, if any, is done
         self._partial_crawl_queue = []
+        # The start paths of the crawl in progress, None for a full crawl
+        self._crawl_start_paths = None
         self._index_timestamp = None
         self._two_tier_mode = False
         self._file_index = {}
+        # Kept up to date with the file index, so that diffs only hash the
+        # folders that changed
+        self._merkle_tree = MerkleTree({})
+        # True if the file index changed since the snapshot was written
+        self._snapshot_outdated = False
         self._promotion_set = set()
         self._demotion_set = set()
+        # {file path: True if promoted, False if demoted}, waiting for the
+        # batch window to close
+        self._buffer_changes = {}
+        self._batch_timer = None
         self._config = None
         self._force_rebuild_db = False
+        # Cancels the crawl in progress and the database build that follows
+        self._cancel_token = None
+        # Set when a database build was cancelled, the next crawl rebuilds it
+        self._index_outdated = False
+        self._watcher = None
+        self._head_watcher = None
+        self._streamed_list = None
+        # {path: reason} for the files left out by the size and content checks
+        self._skipped_files = {}
 
     def start(self):
         super().start()
         self._crawler.start()
 
     def quit(self):
+        """ Never blocks, the indexer and its crawler quit on their workers """
+        self._stop_watcher()
+        self._cancel_batch_timer()
+        # Stops the crawl or build in progress instead of letting it finish
+        self.cancel_work()
         self._crawler.quit()
         super().quit()
 
+    def _on_quit(self):
+        self._close_streamed_list()
+        self._write_snapshot()
+
+    def _start_watcher(self):
+        self._stop_watcher()
+
+        if not self._config.is_complete:
+            return
+
+        if self._config.watch_git_head:
+            self._start_head_watcher()
+
+        if not self._config.watch_file_system:
+            return
+
+        file_exts = self._config.file_exts
+        name_filter = lambda name: os.path.splitext(name)[1] in file_exts
+
+        self._watcher = file_watcher.FileWatcher(self.folders_changed,
+                                                 name_filter=name_filter,
+                                                 poll_interval=self._config.watch_poll_interval,
+                                                 on_write=self.files_written)
+        self._watcher.start()
+
+    def _start_head_watcher(self):
+        # A checkout moves HEAD and git knows exactly which files it touched
+        git = git_head_watcher.find_git(self._config.git_path)
+        if not git:
+            if DEBUG: print("%s: git not found, not watching HEAD" % PACKAGE_NAME)
+            return
+
+        self._head_watcher = git_head_watcher.GitHeadWatcher(self.folders_changed, git)
+        self._head_watcher.set_folders(bp for bp, _ in self._config.base_paths())
+        self._head_watcher.start()
+
+    def _stop_watcher(self):
+        for watcher in (self._watcher, self._head_watcher):
+            if watcher:
+                watcher.stop()
+
+        self._watcher = None
+        self._head_watcher = None
+
+    def _watch_indexed_folders(self):
+        if self._watcher:
+            self._watcher.set_folders(v.path for v in self._file_index.values())
+
     def _reset_results(self):
         self._two_tier_mode = False
-        self._partial_crawl_queue.clear()
         self._file_index.clear()
+        self._merkle_tree = MerkleTree({})
         self._promotion_set.clear()
         self._demotion_set.clear()
 
-    def _count_files(self, file_index):
-        return reduce(lambda tot, i: tot + len(i['files']), file_index.values(), 0)
+    def _cancel_batch_timer(self):
+        batch_timer = self._batch_timer
+        self._batch_timer = None
+        if batch_timer:
+            batch_timer.cancel()
 
     def _write_file_list(self, files, file_name):
         # Only try to create our own folder
@@ -227,22 +690,64 @@ class Indexer(ActorBase):
             os.mkdir(os.path.dirname(file_name))
 
         with open(file_name, mode='wt', encoding='utf-8') as file_list:
-            flist = ['"' + f + '"' if ' ' in f else f for f in files]
-            flist.append('\n')
-            file_list.write('\n'.join(flist))
+            file_list.writelines(map(_file_list_entry, files))
+
+    def _open_streamed_list(self):
+        self._close_streamed_list()
 
-    def _gen_index(self, full_update=True):
-        success = False
+        file_name = os.path.join(self._config.db_location, STREAMED_FILE_LIST)
+        if not os.path.exists(os.path.dirname(file_name)):
+            os.mkdir(os.path.dirname(file_name))
+
+        self._streamed_list = open(file_name, mode='wt', encoding='utf-8')
+
+    def _close_streamed_list(self):
+        """ Closes the streamed file list and returns its path, if one was open """
+        streamed_list = self._streamed_list
+        self._streamed_list = None
+
+        if not streamed_list:
+            return None
+
+        streamed_list.close()
+        return streamed_list.name
+
+    @send_msg
+    def _crawl_batch_ready(self, records, cancel_token=None):
+        # Batches of a crawl that was restarted are not in the new list
+        if self._streamed_list and cancel_token is self._cancel_token:
+            self._streamed_list.writelines(_file_list_entry(os.path.join(record.path, f))
+                                           for record in records for f in record.files)
+
+    def _gen_index(self, full_update=True, delta=None, streamed_list=None):
+        """
+        Writes the file lists and starts the (re)build of the cscope database.
+        delta is the IndexDelta that caused the update, if known. When it
+        only contains modified files the file lists are left as they are.
+        streamed_list is the file list written while a full crawl was
+        running, which is used instead of writing it again.
+
+        Returns a concurrent.futures.Future that is done once the database
+        is built, to be handed to _index_built. The build runs on the process
+        loop, so that it does not hold up a worker.
+        """
+        build = None
 
         try:
             primary_list = os.path.join(self._config.db_location, PRIMARY_DB + '.files')
             secondary_list = os.path.join(self._config.db_location, SECONDARY_DB + '.files')
 
-            #generate the file list
-            files = []
-            for v in self._file_index.values():
-                if v['files']:
-                    files.extend(map(lambda f: os.path.join(v['path'], f), v['files']))
+            if DEBUG and delta is not None:
+                print("%s: Updating index for project: %s. %s" %
+                            (PACKAGE_NAME, os.path.dirname(self._config.db_location),
+                             delta.summary()))
+                for folder_delta in delta.folders:
+                    print("  %s" % repr(folder_delta))
+
+            # The file list only needs to be written if files were added or removed
+            main_list = secondary_list if self._two_tier_mode else primary_list
+            write_file_list = full_update and (delta is None or delta.file_set_changed or
+                                               not os.path.exists(main_list))
 
             if self._two_tier_mode:
                 if self._promotion_set:
@@ -250,74 +755,378 @@ class Indexer(ActorBase):
                 elif os.path.exists(primary_list):
                     os.remove(primary_list)
 
-                if full_update:
-                    self._write_file_list(files, secondary_list)
-                    cscope_runner.generate_index(self._config.db_location,
-                                                 _find_window_from_indexer(self),
-                                                 force_rebuild=self._force_rebuild_db)
-                    self._force_rebuild_db = False
+                if full_update and self._config.secondary_db_shards > 1:
+                    build = self._gen_sharded_index(delta)
+                elif full_update:
+                    if write_file_list:
+                        self._write_index_file_list(secondary_list, streamed_list)
+                    build = cscope_runner.start_generate_indexes(
+                                    self._config.db_location, _find_window_from_indexer(self),
+                                    [SECONDARY_DB], force_rebuild=self._force_rebuild_db,
+                                    cancel_token=self._cancel_token)
             else:
-                self._write_file_list(files, primary_list)
+                if write_file_list:
+                    self._write_index_file_list(primary_list, streamed_list)
                 if os.path.exists(secondary_list):
                     os.remove(secondary_list)
+                self._remove_shards()
+        except Exception as e:
+            build = futures.Future()
+            build.set_exception(e)
+
+        if not build:
+            build = futures.Future()
+            build.set_result(None)
 
-            success = True
+        return build
+
+    @send_msg
+    def _index_built(self, build, full_update=True, demoted=None, full_crawl=False,
+                     cancel_token=None):
+        """
+        Sent once a build started by _gen_index is done. demoted are the
+        files to drop from the promotion set if it succeeded.
+        """
+        if cancel_token is not self._cancel_token:
+            # Killed by a restart, the index is still marked as outdated
+            return
+
+        try:
+            build.result()
+
+            if full_update:
+                self._remove_unused_dbs()
+                self._force_rebuild_db = False
+                self._index_outdated = False
+
+            if demoted:
+                self._demotion_set -= demoted
+                self._promotion_set -= demoted
+        except Cancelled:
+            # cscope replaces the database when done, so the old one is intact
+            print("%s: Indexing of project: %s was cancelled" %
+                        (PACKAGE_NAME, os.path.dirname(self._config.db_location)))
         except Exception as e:
-            exc_type, exc_value, exc_traceback = sys.exc_info()
-            lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
-            print("%s: Generating index for project: %s caused an exception")
+            lines = traceback.format_exception(type(e), e, e.__traceback__)
+            print("%s: Generating index for project: %s caused an exception" %
+                        (PACKAGE_NAME, os.path.dirname(self._config.db_location)))
             print(''.join('!! ' + line for line in lines))
 
-        return success
+        if full_update:
+            self._refresh_done(full_crawl)
 
-    @send_msg
-    def _perform_crawl(self, partial_crawl=False):
-        start_path = None
+    def _write_snapshot(self):
+        # Only an index that matches the database is of use, see _load_snapshot
+        if not self._snapshot_outdated or self._index_outdated:
+            return
+        if not self._config or not self._config.is_complete:
+            return
+
+        try:
+            snapshot.write_snapshot(self._config.db_location,
+                                    self._file_index, self._two_tier_mode)
+            self._snapshot_outdated = False
+        except OSError as e:
+            print("%s: Could not save the index of project: %s. %s" %
+                        (PACKAGE_NAME, os.path.dirname(self._config.db_location), e))
+
+    def _remove_unused_dbs(self):
+        # The databases left over from another mode or number of shards are
+        # only removed once the ones replacing them are built
+        if not self._two_tier_mode:
+            return
+
+        num_shards = self._config.secondary_db_shards
+        if num_shards <= 1:
+            self._remove_shards()
+            return
+
+        shard_names = {SECONDARY_DB_SHARD % i for i in range(num_shards)}
+        self._remove_dbs([SECONDARY_DB] +
+                         [name for name in secondary_db_shards(self._config.db_location)
+                               if name not in shard_names])
+
+    def _gen_sharded_index(self, delta):
+        """
+        Writes the file lists of the secondary DB shards and starts building
+        the shards that changed, in parallel. The top level folders of the
+        project are packed into the shards by number of files and stay in
+        their shard until the next full rebuild, see _pack_shards, so
+        a change only affects the shards of the folders it touched.
+        Returns the Future of the build, or None if no shard changed.
+        """
+        db_location = self._config.db_location
+        num_shards = self._config.secondary_db_shards
+        base_paths = sorted((path for path, _ in self._config.base_paths()),
+                            key=len, reverse=True)
+        rebuild_all = delta is None or self._force_rebuild_db or self._index_outdated
+
+        folder_files = {}
+        for record in self._file_index.values():
+            folder = _top_level_folder(record.path, base_paths)
+            folder_files.setdefault(folder, []).extend(os.path.join(record.path, f)
+                                                       for f in record.files)
+
+        # A full rebuild rebalances the shards
+        old_map = {} if rebuild_all else _read_shard_map(db_location, num_shards)
+        shard_map = _pack_shards({folder: len(files) for folder, files in folder_files.items()},
+                                 num_shards, old_map)
+
+        shards = [[] for _ in range(num_shards)]
+        for folder, files in sorted(folder_files.items()):
+            shards[shard_map[folder]].extend(files)
+
+        file_set_changed = set()
+        files_changed = set()
+
+        if not rebuild_all:
+            # Shards that gained or lost a top level folder
+            for folder in shard_map.keys() | old_map.keys():
+                if shard_map.get(folder) != old_map.get(folder):
+                    file_set_changed.update(shard for shard in (shard_map.get(folder),
+                                                                 old_map.get(folder))
+                                                  if shard is not None)
+
+            for folder_delta in delta.folders:
+                shard = shard_map.get(_top_level_folder(folder_delta.path, base_paths))
+                if shard is None:
+                    # The whole top level folder is gone, see above
+                    continue
+                if folder_delta.added or folder_delta.removed:
+                    file_set_changed.add(shard)
+                elif folder_delta.modified:
+                    files_changed.add(shard)
+
+            files_changed |= file_set_changed
+
+        to_build = []
+        for shard, files in enumerate(shards):
+            name = SECONDARY_DB_SHARD % shard
+            file_list, db_file = _db_files(db_location, name)[:2]
+
+            if not files:
+                # cscope refuses to build a database without files
+                self._remove_dbs([name])
+                continue
+
+            if rebuild_all or shard in file_set_changed or not os.path.exists(file_list):
+                self._write_file_list(files, file_list)
+            if rebuild_all or shard in files_changed or not os.path.exists(db_file):
+                to_build.append(name)
+
+        if shard_map != old_map:
+            _write_shard_map(db_location, num_shards, shard_map)
+
+        if DEBUG:
+            print("%s: Building %d of %d secondary DB shards for project: %s" %
+                        (PACKAGE_NAME, len(to_build), num_shards, db_location))
+
+        if not to_build:
+            return None
+
+        return cscope_runner.start_generate_indexes(db_location, _find_window_from_indexer(self),
+                                                    to_build, force_rebuild=self._force_rebuild_db,
+                                                    cancel_token=self._cancel_token)
+
+    def _remove_shards(self):
+        self._remove_dbs(secondary_db_shards(self._config.db_location))
+
+        shard_map = os.path.join(self._config.db_location, SHARD_MAP)
+        if os.path.exists(shard_map):
+            os.remove(shard_map)
+
+    def _remove_dbs(self, names):
+        for name in names:
+            for path in _db_files(self._config.db_location, name):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _write_index_file_list(self, file_name, streamed_list):
+        # Writes every file in the index to file_name
+        if streamed_list and os.path.exists(streamed_list):
+            os.replace(streamed_list, file_name)
+            return
+
+        self._write_file_list((os.path.join(v.path, f) for v in self._file_index.values()
+                                                           for f in v.files),
+                              file_name)
+
+    def _load_snapshot(self):
+        """
+        Loads the file index saved by a previous session. The snapshot is only
+        used if the database it describes is still around, so that queries can
+        be served right away.
+        """
+        if not self._config or not self._config.is_complete:
+            return False
+
+        try:
+            file_index, two_tier_mode = snapshot.read_snapshot(self._config.db_location)
+        except snapshot.SnapshotError as e:
+            if DEBUG: print("%s: No usable snapshot. %s" % (PACKAGE_NAME, e))
+            return False
+
+        num_shards = self._config.secondary_db_shards
+
+        if two_tier_mode and num_shards > 1:
+            # The shards must have been built for the current number of shards
+            found = set(secondary_db_shards(self._config.db_location))
+            if not found or found - {SECONDARY_DB_SHARD % i for i in range(num_shards)}:
+                if DEBUG: print("%s: Snapshot found but the DB shards don't match" % PACKAGE_NAME)
+                return False
+        else:
+            if two_tier_mode:
+                db_file = os.extsep.join([SECONDARY_DB, cscope_runner.CSCOPE_DB_EXT])
+            else:
+                db_file = os.extsep.join([PRIMARY_DB, cscope_runner.CSCOPE_FILE_LIST_EXT])
+
+            if not os.path.isfile(os.path.join(self._config.db_location, db_file)):
+                if DEBUG: print("%s: Snapshot found but %s is missing" % (PACKAGE_NAME, db_file))
+                return False
+
+        self._reset_results()
+        self._two_tier_mode = two_tier_mode
+        self._file_index = file_index
+        self._merkle_tree = MerkleTree(file_index)
+        return True
+
+    def _partial_crawl_paths(self):
+        """
+        Reduces the partial crawl queue to a sorted list of disjoint sub trees.
+        Paths that no longer exist are replaced by their closest existing
+        parent and paths outside of the project are dropped.
+        """
+        paths = set()
+
+        for path in self._partial_crawl_queue:
+            path = os.path.normpath(path)
+            while path and not os.path.isdir(path):
+                parent = os.path.dirname(path)
+                if parent == path:
+                    break
+                path = parent
+
+            base_path, _ = self._config.find_base_path(path)
+            if base_path:
+                paths.add(path)
+
+        start_paths = []
+        for path in sorted(paths):
+            # sorting puts every path right after the sub trees containing it
+            if start_paths and _is_subpath(path, start_paths[-1]):
+                continue
+            start_paths.append(path)
+
+        return start_paths
+
+    @send_msg(coalesce=same_args)
+    def _perform_crawl(self, partial_crawl=False, restart=False):
+        """
+        Starts a crawl, followed by an update of the database if anything
+        changed. With restart a crawl in progress is cancelled and started
+        over, otherwise the request is dropped while one is running.
+        """
+        start_paths = None
 
         if not self._config or not self._config.is_complete:
             return
 
+        if self._crawl_in_progress and restart:
+            if DEBUG: print("Restarting refresh of project: %s" % self._config.db_location)
+            self.cancel_work()
+            self._crawl_in_progress = False
+            self._requeue_crawl_paths()
+            streamed_list = self._close_streamed_list()
+            if streamed_list and os.path.exists(streamed_list):
+                os.remove(streamed_list)
+
         if self._crawl_in_progress:
-            print("Project: '%s' refresh is already in progress" % self._config.db_location)
+            # The queue is crawled when the crawl in progress is done
+            if DEBUG: print("Project: '%s' refresh is already in progress" %
+                                self._config.db_location)
             return
         elif partial_crawl:
-            #try to find a starting point that includes all paths in
-            #self._partial_crawl_queue
-            start_path = os.path.commonprefix(self._partial_crawl_queue)
-            if start_path.endswith(os.path.sep):
-                start_path = start_path[:-1]
-
-            if start_path and not os.path.exists(start_path):
-                start_path = os.path.dirname(start_path)
-
-            base_path, _ = self._config.find_base_path(start_path)
-            if start_path and not base_path:
-                start_path = None
+            start_paths = self._partial_crawl_paths() or None
 
         if DEBUG:
-            if start_path:
-                print("Performing partial refresh starting from %s for project: %s" %
-                            (start_path, self._config.db_location))
+            if start_paths:
+                print("Performing partial refresh of %s for project: %s" %
+                            (', '.join(start_paths), self._config.db_location))
             else:
                 print("Performing full refresh for project: %s" % self._config.db_location)
 
+        # Explicit refreshes always stat every file
+        incremental = self._config.incremental_crawl and not self._force_rebuild_db
+
+        self._cancel_token = CancelToken()
+
+        # A full crawl finds every file in the project, so its results can
+        # be written to the file list while it is still running
+        batch_callback = None
+        if not start_paths:
+            self._open_streamed_list()
+            batch_callback = partial(self._crawl_batch_ready, cancel_token=self._cancel_token)
+
+        # Changes queued from now on may have been missed by this crawl
         self._partial_crawl_queue.clear()
+        self._crawl_start_paths = start_paths
         self._crawl_in_progress = True
         self._crawler.crawl(self._config,
-                            user_data=start_path,
-                            start_path=start_path,
-                            result_callback=self._crawl_result_ready)
+                            user_data=start_paths,
+                            start_paths=start_paths,
+                            incremental=incremental,
+                            batch_callback=batch_callback,
+                            cancel_token=self._cancel_token,
+                            result_callback=partial(self._crawl_result_ready,
+                                                    cancel_token=self._cancel_token))
+
+
+    def cancel_work(self):
+        """
+        Cancels the crawl or database build in progress, if any. Unlike the
+        other methods this one is not a message, so that it takes effect
+        right away. The caller is expected to send the request that makes
+        the work obsolete, e.g. refresh() or set_config(), right after.
+        """
+        cancel_token = self._cancel_token
+        if cancel_token:
+            cancel_token.cancel()
+
+    def _requeue_crawl_paths(self):
+        # A cancelled partial crawl is queued again. Cancelled full crawls
+        # are always followed by another full crawl.
+        if self._crawl_start_paths:
+            self._partial_crawl_queue.extend(self._crawl_start_paths)
+        self._crawl_start_paths = None
 
+    @property
+    def _work_cancelled(self):
+        return bool(self._cancel_token and self._cancel_token.cancelled)
 
     @send_msg
-    def _crawl_result_ready(self, result):
+    def _crawl_result_ready(self, result, cancel_token=None):
+        if cancel_token is not self._cancel_token:
+            # The crawl was restarted
+            return
+
         self._crawl_in_progress = False
+        # All batches were sent before the result, so the list is complete
+        streamed_list = self._close_streamed_list()
+
+        if result is None:
+            if DEBUG: print("Crawl of project: %s was cancelled" % self._config.db_location)
+            self._requeue_crawl_paths()
+            if streamed_list and os.path.exists(streamed_list):
+                os.remove(streamed_list)
+            return
+
+        self._crawl_start_paths = None
         crawl_res, partial_update = result
 
         if DEBUG:
-            print("Crawl results received. Found %d files" % self._count_files(crawl_res))
+            print("Crawl results received. Found %d files" % count_files(crawl_res))
 
-        if self._count_files(crawl_res) > TWO_TIER_THRESHOLD:
+        if count_files(crawl_res) > TWO_TIER_THRESHOLD:
             if not self._two_tier_mode:
                 if partial_update:
                     print("%s: A partial update of project: %s resulted in threshold exceeded. "
@@ -340,192 +1149,556 @@ class Indexer(ActorBase):
 
         if partial_update:
             # Extract the relevant subset to compare
-            for k, v in list(self._file_index.values()):
-                if k['path'].startswith(partial_update):
+            for k, v in list(self._file_index.items()):
+                if any(_is_subpath(v.path, p) for p in partial_update):
                     file_index[k] = v
                     del self._file_index[k]
         else:
             file_index = self._file_index
             self._file_index = {}
-            self._partial_crawl_queue.clear()
-            partial_update = ''
+            partial_update = None
+
+        self._update_skipped_files(partial_update)
+
+        # The crawl result replaces the old entries whether or not anything
+        # changed, otherwise an unchanged crawl would leave the index empty
+        crawl_tree = MerkleTree(crawl_res)
+        delta = diff_index(file_index, crawl_res, self._merkle_tree, crawl_tree)
+        self._file_index.update(crawl_res)
+
+        if partial_update:
+            self._merkle_tree.update(crawl_res.values(),
+                                     removed=[d.path for d in delta.folders
+                                                     if crawl_tree.record(d.path) is None])
+        else:
+            self._merkle_tree = crawl_tree
 
-        if (file_index != crawl_res):
+        build = None
+
+        if delta.files_changed or self._index_outdated:
             if DEBUG:
                 print("Crawl of project: %s contained changes." %
                                     os.path.dirname(self._config.db_location))
 
-            self._file_index.update(crawl_res)
+            # removed from the demotion list once the database is built
+            demoted = {f for f in self._demotion_set
+                            if not partial_update or
+                               any(_is_subpath(f, p) for p in partial_update)}
+            build = self._gen_index(delta=delta, streamed_list=streamed_list)
+
+        if streamed_list and os.path.exists(streamed_list):
+            os.remove(streamed_list)
+
+        if delta:
+            self._snapshot_outdated = True
+            self._watch_indexed_folders()
+
+        if not build:
+            self._refresh_done(full_crawl=not partial_update)
+            return
+
+        # Like the crawl, the refresh is in progress until the database is
+        # built, and the index is outdated unless the build succeeds
+        self._crawl_in_progress = True
+        self._index_outdated = True
+        build.add_done_callback(partial(self._index_built, demoted=demoted,
+                                        full_crawl=not partial_update,
+                                        cancel_token=cancel_token))
+
+    def _refresh_done(self, full_crawl=False):
+        self._crawl_in_progress = False
 
-            if self._gen_index():
-                #remove files from the demotion list
-                tmp = {f for f in self._demotion_set if f.startswith(partial_update)}
-                self._demotion_set -= tmp
-                self._promotion_set -= tmp
+        # Saved after full crawls and on quit rather than after every update
+        if full_crawl:
+            self._write_snapshot()
 
-        # Perfrom any pending partial crawls
+        # Crawl what changed while this refresh was running
         if self._partial_crawl_queue:
             self._perform_crawl(partial_crawl=True, send_always=True)
 
-    @send_msg
+    def _update_skipped_files(self, partial_update):
+        stats = self._crawler.last_stats
+        skipped = stats.skipped_files if stats else {}
+        old_skipped = set(self._skipped_files)
+
+        if partial_update:
+            for path in list(self._skipped_files.keys()):
+                if any(_is_subpath(path, p) for p in partial_update):
+                    del self._skipped_files[path]
+        else:
+            self._skipped_files.clear()
+
+        self._skipped_files.update(skipped)
+
+        if set(self._skipped_files) - old_skipped:
+            print("%s: %d files in project: %s are not indexed. "
+                  "Run 'SublimeCscope: Show Skipped Files' for details." %
+                    (PACKAGE_NAME, len(self._skipped_files),
+                     os.path.dirname(self._config.db_location)))
+
+    @property
+    def crawler_stats(self):
+        return self._crawler.stats
+
+    @property
+    def last_crawl_stats(self):
+        return self._crawler.last_stats
+
+    @send_msg(priority=PRIORITY_HIGH)
+    def get_skipped_files(self):
+        return dict(self._skipped_files)
+
+    @send_msg(coalesce=same_args)
     def refresh(self):
         self._force_rebuild_db = True
-        self._perform_crawl()
+        self._perform_crawl(restart=True)
 
-    @send_msg
+    @send_msg(coalesce=any_args)
     def set_config(self, config):
         if config and config != self._config:
             if DEBUG: print("New config received. Refreshing project %s" % config.db_location)
+            warm_start = self._config is None
             self._config = config
-            self.refresh()
+            self._start_watcher()
+
+            if warm_start and self._load_snapshot():
+                # The index from the previous session is served as is while
+                # a crawl verifies it. The database is only rebuilt if the
+                # crawl finds any differences.
+                if DEBUG: print("Verifying snapshot of project %s" % config.db_location)
+                self._watch_indexed_folders()
+                self._perform_crawl()
+            else:
+                self.refresh()
+        elif self._work_cancelled:
+            # Cancelled for a config that turned out to be the current one
+            self._perform_crawl(restart=True)
 
     @send_msg
+    def folders_changed(self, folders):
+        """
+        Called by the file watcher and the git HEAD watcher with the set of
+        folders that were modified outside of the editor.
+        """
+        if not self._config or not self._config.is_complete:
+            return
+
+        if folders is file_watcher.ALL_FOLDERS:
+            self._perform_crawl()
+        else:
+            self._partial_crawl_queue.extend(folders)
+            self._perform_crawl(partial_crawl=True)
+
+    @send_msg
+    def files_written(self, paths):
+        """
+        Called by the file watcher with files whose contents were written,
+        in folders where no files were added or removed. Most of them are
+        saves from the editor, which promote_buffer takes care of.
+        """
+        if not self._config or not self._config.is_complete:
+            return
+
+        # The primary DB is indexed on the fly, only the secondary DB can
+        # be out of date. Promoted files are in the primary DB.
+        if not self._two_tier_mode:
+            return
+
+        folders = {os.path.dirname(p) for p in paths if not self._is_promoted(p)}
+        if folders:
+            self.folders_changed(folders)
+
+    # Buffer changes are user driven and go before any crawl results
+    @send_msg(priority=PRIORITY_HIGH, coalesce=same_args)
     def promote_buffer(self, file_path):
 
-        if file_path in self._promotion_set:
+        if not self._config or not self._config.is_complete:
+            return
+
+        if self._is_promoted(file_path):
             return
 
         base, name = os.path.split(file_path)
-        st = os.stat(base)
+        key = folder_key(os.stat(base))
 
-        if st.st_ino in self._file_index:
+        if key in self._file_index:
             # in case the folder exists in the index under a different name
             # use that name instead
-            base = self._file_index[st.st_ino]['path']
+            base = self._file_index[key].path
             file_path = os.path.join(base, name)
 
-        if file_path in self._promotion_set:
+        if self._is_promoted(file_path):
             return
 
         if not self._config.file_matches(base, name):
             return
 
         if DEBUG: print("Promoting: %s" % file_path)
+        self._queue_buffer_change(file_path, True)
 
-        if self._two_tier_mode:
-            self._promotion_set.add(os.path.join(base, name))
-            self._gen_index(full_update=False)
-        elif not name in self._file_index.get(st.st_ino, {}).get('files',[]):
-            # file not found in index
-            self._perform_crawl()
-
-    @send_msg
+    @send_msg(priority=PRIORITY_HIGH, coalesce=same_args)
     def demote_buffer(self, file_path):
 
-        if file_path not in self._promotion_set:
+        if not self._is_promoted(file_path):
             return
 
         if file_path in self._demotion_set:
             return
 
         if DEBUG: print("Demoting: %s" % file_path)
-        self._demotion_set.add(file_path)
-        self._partial_crawl_queue.append(os.path.dirname(file_path))
-        self._perform_crawl(True, send_always=True)
+        self._queue_buffer_change(file_path, False)
+
+    def _is_promoted(self, file_path):
+        # Counts the promotions and demotions that are still being batched
+        promoted = self._buffer_changes.get(file_path, None)
+        if promoted is None:
+            return file_path in self._promotion_set
+        return promoted
+
+    def _queue_buffer_change(self, file_path, promoted):
+        """
+        Batches promotions and demotions over the buffer batch window, so
+        that e.g. saving or closing many buffers at once only rewrites the
+        file list once and only crawls once.
+        """
+        self._buffer_changes[file_path] = promoted
+
+        window = self._config.buffer_batch_window
+        if not window:
+            self._apply_buffer_changes()
+        elif not self._batch_timer:
+            self._batch_timer = threading.Timer(window, self._apply_buffer_changes)
+            self._batch_timer.daemon = True
+            self._batch_timer.start()
+
+    @send_msg(priority=PRIORITY_HIGH)
+    def _apply_buffer_changes(self):
+        """ Applies the batched promotions and demotions in one pass. """
+        self._batch_timer = None
+        changes = self._buffer_changes
+        self._buffer_changes = {}
+
+        if not self._config or not self._config.is_complete or not changes:
+            return
+
+        promoted = {f for f, p in changes.items() if p and f not in self._promotion_set}
+        demoted = {f for f, p in changes.items()
+                        if not p and f in self._promotion_set and f not in self._demotion_set}
+
+        if DEBUG:
+            print("Applying %d promotions and %d demotions for project: %s" %
+                        (len(promoted), len(demoted), self._config.db_location))
+
+        if promoted:
+            if self._two_tier_mode:
+                self._promotion_set |= promoted
+                self._index_built(self._gen_index(full_update=False), full_update=False,
+                                  cancel_token=self._cancel_token)
+            elif any(not self._in_index(f) for f in promoted):
+                # file not found in index
+                self._perform_crawl()
+
+        if demoted:
+            self._demotion_set |= demoted
+            self._partial_crawl_queue.extend(os.path.dirname(f) for f in demoted)
+            self._perform_crawl(partial_crawl=True, send_always=True)
+
+    def _in_index(self, file_path):
+        base, name = os.path.split(file_path)
+        try:
+            record = self._file_index.get(folder_key(os.stat(base)), None)
+        except OSError:
+            return False
+        return bool(record) and name in record
 
 
 
 class Crawler(ActorBase):
     """ The Crawler scans the project folders for files to index. """
+
+    def __init__(self):
+        super().__init__(scheduler=_crawl_scheduler)
+        self._scandir_crawler = scandir_crawler.ScandirCrawler()
+        self._network_crawler = scandir_crawler.ScandirCrawler(
+                            default_workers=scandir_crawler.NETWORK_MAX_WORKERS,
+                            stat_batch_size=scandir_crawler.NETWORK_STAT_BATCH_SIZE)
+        # Folder listings of the git index crawls, see git_index.crawl_folder
+        self._git_folder_cache = {}
+        self._last_stats = None
+
+    @property
+    def last_stats(self):
+        """ The CrawlStats of the most recently finished crawl """
+        return self._last_stats
+
     @send_msg
-    def crawl(self, config, user_data, start_path=None):
-        result = defaultdict(dict)
+    def crawl(self, config, user_data, start_paths=None, incremental=False,
+              batch_callback=None, cancel_token=None):
+        """
+        Crawls the project folders of config, or only the sub trees in
+        start_paths if given. The sub trees must not overlap.
+
+        If batch_callback is given it is called with lists of DirRecords
+        while the crawl is running. Every record in the result is passed to
+        it exactly once, before the crawl returns.
+
+        Returns None if cancel_token was cancelled before the crawl was done.
+        """
+        try:
+            return self._crawl(config, user_data, start_paths, incremental,
+                               batch_callback, cancel_token)
+        except Cancelled:
+            if DEBUG: print("%s: Crawl was cancelled" % PACKAGE_NAME)
+            return None
 
-        if start_path:
-            base_path, follow_syms = config.find_base_path(start_path)
-            folders_to_search = [(start_path, base_path, follow_syms)]
+    def _crawl(self, config, user_data, start_paths, incremental, batch_callback,
+               cancel_token):
+        result = {}
+        stats = CrawlStats()
+        stream = _RecordStream(batch_callback)
+        config.begin_crawl()
+
+        if start_paths:
+            folders_to_search = []
+            for start_path in start_paths:
+                base_path, follow_syms = config.find_base_path(start_path)
+                folders_to_search.append((start_path, base_path, follow_syms))
+
+                # Project folders nested in the sub tree are pruned from its
+                # crawl, see IndexerConfig.folder_name_matches
+                folders_to_search.extend((bp, bp, follow) for bp, follow in config.base_paths()
+                                            if bp != start_path and _is_subpath(bp, start_path))
         else:
             folders_to_search = [(base_path, base_path, follow_syms) for
                                      base_path, follow_syms in config.base_paths()]
 
-        for start, base, follow_syms in folders_to_search:
-            os_walk = partial(os.walk, followlinks=follow_syms)
-            os_stat = partial(os.stat, follow_symlinks=follow_syms)
-            file_matcher = partial(config.file_matches, base_path=base)
-            folder_matcher = partial(config.folder_matches, base_path=base)
-            visited_files = set()
-            self._crawl_one_subfolder(start, result,
-                                      os_walk, os_stat,
-                                      file_matcher, folder_matcher,
-                                      visited_files)
+        # Outer folders first, so that the result does not depend on the
+        # order of the folders in the project
+        folders_to_search.sort()
+
+        if not start_paths and scandir_crawler.HAS_SCANDIR:
+            folders_to_search = self._crawl_git_folders(folders_to_search, config,
+                                                        result, stats, cancel_token)
+            for record in result.values():
+                stream.add(record)
+
+        if scandir_crawler.HAS_SCANDIR:
+            folders_to_search = self._crawl_network_folders(folders_to_search, config,
+                                                            result, incremental, stats,
+                                                            stream, cancel_token)
+
+        if config.crawler_engine == CRAWLER_ENGINE_SCANDIR and scandir_crawler.HAS_SCANDIR:
+            self._scandir_crawler.crawl(folders_to_search, config, result,
+                                        max_workers=config.crawler_threads,
+                                        incremental=incremental, stats=stats,
+                                        record_callback=stream.add,
+                                        cancel_token=cancel_token)
+        else:
+            # Shared by all project folders, so that a file reachable from
+            # several of them is only indexed once
+            visited_files = InodeSet()
+            for start, base, follow_syms in folders_to_search:
+                os_walk = partial(os.walk, followlinks=follow_syms)
+                os_stat = partial(_counted_stat, stats, follow_symlinks=follow_syms)
+                file_matcher = partial(config.file_name_matches, base_path=base, stats=stats)
+                folder_matcher = partial(config.folder_name_matches, base_path=base,
+                                         stats=stats)
+                content_matcher = partial(config.file_content_matches, stats=stats)
+                self._crawl_one_subfolder(start, result,
+                                          os_walk, os_stat,
+                                          file_matcher, folder_matcher, content_matcher,
+                                          config.folder_visited,
+                                          visited_files, stats, stream, cancel_token)
+
+        stream.flush()
+        self._last_stats = stats
+        if DEBUG: print("%s: Crawl issued %s" % (PACKAGE_NAME, stats.summary()))
 
         return (result, user_data)
 
+    def _crawl_git_folders(self, folders_to_search, config, result, stats, cancel_token):
+        # Folders configured to use git enumeration are crawled using the
+        # git index. Returns the folders that still need a regular crawl.
+        # Partial crawls are triggered by changes to specific files, which the
+        # git index may not know about yet, so those always use the file system.
+        remaining = []
+
+        for start, base, follow_syms in folders_to_search:
+            if (config.file_enumeration(base) != FILE_ENUMERATION_GIT or
+                    not git_index.crawl_folder(start, base, follow_syms,
+                                               config, result, stats,
+                                               folder_cache=self._git_folder_cache,
+                                               cancel_token=cancel_token)):
+                remaining.append((start, base, follow_syms))
+
+        return remaining
+
+    def _crawl_network_folders(self, folders_to_search, config, result,
+                               incremental, stats, stream, cancel_token):
+        # Folders on network file systems are crawled by a scandir crawler
+        # with a much wider pool, whatever the configured crawler engine is.
+        # Folders in network mode that turn out to be on a local file system
+        # are crawled as usual. Returns the folders that still need a
+        # regular crawl.
+        network_folders = []
+        remaining = []
+
+        for folder in folders_to_search:
+            if config.crawl_mode(folder[1]) != CRAWL_MODE_NETWORK:
+                remaining.append(folder)
+            elif scandir_crawler.is_network_mount(folder[0]) is False:
+                if DEBUG: print("%s: %s is not on a network file system, crawling it "
+                                "in local mode" % (PACKAGE_NAME, folder[0]))
+                remaining.append(folder)
+            else:
+                network_folders.append(folder)
+
+        if network_folders:
+            self._network_crawler.crawl(network_folders, config, result,
+                                        max_workers=config.network_crawler_threads,
+                                        incremental=incremental, stats=stats,
+                                        record_callback=stream.add,
+                                        cancel_token=cancel_token)
+
+        return remaining
+
     def _crawl_one_subfolder(self, start_path, result, os_walk,
-                             os_stat, file_matcher,
-                             folder_matcher, visited_files):
+                             os_stat, file_matcher, folder_matcher,
+                             content_matcher, folder_visited, visited_files, stats,
+                             stream, cancel_token=None):
+        # file_matcher and folder_matcher only look at names, which is
+        # cheap compared to a stat call. Only entries that pass them are
+        # stat:ed and then checked for the right file type. Folders excluded
+        # by an ignore file are pruned by folder_matcher, before being listed.
+        # folder_visited is called with the stat result of every folder
+        # before its entries are matched, like the scandir engine does.
 
         start_path = os.path.normpath(start_path)
         if DEBUG: print("Starting to crawl folder: %s" % start_path)
 
-        prev = None
-        prev_inode = 0
+        # The stat results of the sub folders that passed folder_matcher, so
+        # that they are not stat:ed again when they are entered
+        folder_stats = {}
 
         for current, subdirs, files in os_walk(start_path):
-            inode = prev_inode
-
-            if current != prev:
-                prev = current
-                inode = os_stat(current).st_ino
-                if inode in result:
-                    AssertionError("Inode %d already seen. path: %s == %s" %
-                                    (inode, current, result[inode]['path']))
-
-                result[inode]['path'] = current
-                result[inode]['magic'] = 0
-                result[inode]['files'] = []
+            if cancel_token:
+                cancel_token.check()
+
+            stats.listdir_calls += 1
+            st = folder_stats.pop(current, None) or os_stat(current)
+            folder_visited(current, st)
+            key = folder_key(st)
+            if key in result:
+                # Sub folders are checked before they are entered, so this is
+                # a project folder that was reached through another one
+                if DEBUG: print("Folder %s was already visited" % current)
+                subdirs.clear()
+                continue
 
-            self._process_files(current, files, result[inode],
-                                os_stat, file_matcher, visited_files)
+            result[key] = self._process_files(current, files, os_stat, file_matcher,
+                                              content_matcher, visited_files, stats)
+            stream.add(result[key])
             self._process_subfolders(current, subdirs, os_stat,
-                                     folder_matcher, result.keys())
+                                     folder_matcher, result.keys(), folder_stats, stats)
 
-    def _process_files(self, path, files, result,
-                       os_stat, file_matcher, visited_files):
+    def _process_files(self, path, files, os_stat, file_matcher,
+                       content_matcher, visited_files, stats):
+        matching_files = []
+        hashes = []
 
         for f in files:
+            if not file_matcher(path, f):
+                stats.rejected_by_name += 1
+                continue
+
             try:
                 st = os_stat(os.path.join(path, f))
             except (FileNotFoundError, OSError) as e:
                 print("%s: %s" % (PACKAGE_NAME, e))
                 continue
 
-            if st.st_ino in visited_files:
+            if (st.st_dev, st.st_ino) in visited_files:
                 if DEBUG: print("File %s was already visited" % os.path.join(path, f))
                 continue
 
-            if file_matcher(path, f, st.st_mode):
-                result['files'].append(f)
-                result['magic'] += st.st_size + st.st_mtime
-                visited_files.add(st.st_ino)
+            if not stat.S_ISREG(st.st_mode):
+                continue
+
+            hash_value = file_hash(st.st_mtime_ns, st.st_size, st.st_ino)
+            if content_matcher(path, f, st.st_size, hash_value):
+                matching_files.append(f)
+                hashes.append(hash_value)
+                visited_files.add((st.st_dev, st.st_ino))
+
+        return DirRecord(path, matching_files, hashes)
 
 
     def _process_subfolders(self, path, subdirs, os_stat,
-                            folder_matcher, visited_folders):
+                            folder_matcher, visited_folders, folder_stats, stats):
         filtered_subdirs = []
         for d in subdirs:
+            if not folder_matcher(path, d):
+                stats.rejected_by_name += 1
+                continue
+
             try:
                 st = os_stat(os.path.join(path, d))
             except (FileNotFoundError, OSError) as e:
                 print("%s: %s" % (PACKAGE_NAME, e))
                 continue
 
-            if st.st_ino in visited_folders:
+            if folder_key(st) in visited_folders:
                 if DEBUG: print("File %s was already visited" % os.path.join(path, d))
                 continue
 
-            if folder_matcher(path, d, st.st_mode):
+            if stat.S_ISDIR(st.st_mode):
                 filtered_subdirs.append(d)
+                folder_stats[os.path.join(path, d)] = st
 
         subdirs.clear()
         subdirs.extend(filtered_subdirs)
 
 
 
+class _RecordStream:
+    """ Hands the DirRecords found by a crawl to a callback in batches """
+
+    def __init__(self, callback, batch_size=0):
+        self._callback = callback
+        self._batch_size = batch_size or STREAM_BATCH_SIZE
+        self._batch = []
+
+    def add(self, record):
+        if not self._callback:
+            return
+
+        self._batch.append(record)
+        if len(self._batch) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._batch:
+            self._callback(self._batch)
+            self._batch = []
+
+
 class IndexerConfig():
     def __init__(self, window):
         self._is_complete = False
         self._file_exts = None
+        self._crawler_engine = CRAWLER_ENGINE_WALK
+        self._crawler_threads = 0
+        self._network_crawler_threads = 0
+        self._incremental_crawl = False
+        self._watch_file_system = False
+        self._watch_poll_interval = file_watcher.DEFAULT_POLL_INTERVAL
+        self._watch_git_head = False
+        self._buffer_batch_window = 0
+        self._git_path = None
+        self._secondary_db_shards = 1
+        self._file_guard = file_guard.FileGuard()
+        self._nested_folders = set()
+        self._ignore_files = ignore_files.IgnoreFiles(())
         self._db_location = get_db_location(window)
 
         if not self._db_location:
@@ -538,8 +1711,27 @@ class IndexerConfig():
             return
 
         self._search_std_incl_folders = settings.get('search_std_include_folders', window)
+        self._crawler_engine = settings.get('crawler_engine', window)
+        self._crawler_threads = settings.get('crawler_threads', window)
+        self._network_crawler_threads = settings.get('network_crawler_threads', window)
+        self._incremental_crawl = settings.get('incremental_crawl', window)
+        self._watch_file_system = settings.get('watch_file_system', window)
+        self._watch_poll_interval = settings.get('watch_poll_interval', window)
+        self._watch_git_head = settings.get('watch_git_head', window)
+        self._buffer_batch_window = settings.get('buffer_batch_window', window)
+        self._git_path = settings.get('git_path', window)
+        self._secondary_db_shards = settings.get('secondary_db_shards', window)
+        if self._secondary_db_shards <= 0:
+            self._secondary_db_shards = os.cpu_count() or 1
         self._std_incl_folders = _set_from_sorted_list(settings.get('std_include_folders', window))
+        self._file_guard = file_guard.FileGuard(settings.get('index_max_file_size', window),
+                                                settings.get('index_skip_binary_files', window),
+                                                settings.get('index_generated_markers', window))
+        if settings.get('honor_ignore_files', window):
+            self._ignore_files = ignore_files.IgnoreFiles()
         self._folder_configs = {}
+        # compiled from the patterns in _folder_configs and _index_blacklist
+        self._matchers = {}
         self._index_blacklist = set()
         global_folder_exclude = []
         global_folder_include = []
@@ -560,7 +1752,7 @@ class IndexerConfig():
         for folder in proj_data['folders']:
             folder_path = folder['path']
             if not folder_path:
-                next
+                continue
 
             if not os.path.isabs(folder_path):
                 base_path, _ = os.path.split(self._db_location)
@@ -569,8 +1761,13 @@ class IndexerConfig():
                                     (folder_path, base_path + os.path.sep))
                 folder_path = os.path.join(base_path, folder_path)
 
+            folder_path = os.path.normpath(folder_path)
             folder_config = {}
             folder_config['follow_symlinks'] = folder.get('follow_symlinks', True)
+            folder_config['crawl_mode'] = folder.get('sublimecscope_crawl_mode',
+                                                     CRAWL_MODE_LOCAL)
+            folder_config['file_enumeration'] = folder.get('sublimecscope_file_enumeration',
+                                                           FILE_ENUMERATION_FILESYSTEM)
             folder_config['file_whitelist'] = _set_from_sorted_list(global_file_include + \
                                                         folder.get('file_include_patterns',[]))
             folder_config['file_blacklist'] = _set_from_sorted_list(global_file_exclude + \
@@ -581,6 +1778,21 @@ class IndexerConfig():
                                                         folder.get('folder_exclude_patterns',[]))
 
             self._folder_configs[folder_path] = folder_config
+            self._matchers[folder_path] = pattern_matcher.FolderConfigMatcher(
+                                                folder_config['file_whitelist'],
+                                                folder_config['file_blacklist'],
+                                                folder_config['folder_whitelist'],
+                                                folder_config['folder_blacklist'],
+                                                self._index_blacklist)
+
+        # Folders inside other project folders are crawled on their own, so
+        # that every folder is crawled once, using the patterns of the
+        # innermost project folder containing it
+        self._nested_folders = {fp for fp in self._folder_configs
+                                    if any(fp != other and _is_subpath(fp, other)
+                                           for other in self._folder_configs)}
+        if DEBUG and self._nested_folders:
+            print("%s: Nested project folders: %s" % (PACKAGE_NAME, sorted(self._nested_folders)))
 
         # For the config to be consider complete (i.e. usable) we need at least
         # one file extention and one folder.
@@ -598,6 +1810,46 @@ class IndexerConfig():
     def db_location(self):
         return self._db_location
 
+    @property
+    def crawler_engine(self):
+        return self._crawler_engine
+
+    @property
+    def crawler_threads(self):
+        return self._crawler_threads
+
+    @property
+    def network_crawler_threads(self):
+        return self._network_crawler_threads
+
+    @property
+    def incremental_crawl(self):
+        return self._incremental_crawl
+
+    @property
+    def watch_file_system(self):
+        return self._watch_file_system
+
+    @property
+    def watch_poll_interval(self):
+        return self._watch_poll_interval
+
+    @property
+    def watch_git_head(self):
+        return self._watch_git_head
+
+    @property
+    def buffer_batch_window(self):
+        return self._buffer_batch_window
+
+    @property
+    def git_path(self):
+        return self._git_path
+
+    @property
+    def secondary_db_shards(self):
+        return self._secondary_db_shards
+
     @property
     def search_std_incl_folders(self):
         return self._search_std_incl_folders
@@ -622,7 +1874,19 @@ class IndexerConfig():
                            '_folder_configs',
                            '_index_blacklist',
                            '_search_std_incl_folders',
-                           '_std_incl_folders'
+                           '_std_incl_folders',
+                           '_crawler_engine',
+                           '_crawler_threads',
+                           '_network_crawler_threads',
+                           '_incremental_crawl',
+                           '_watch_file_system',
+                           '_watch_poll_interval',
+                           '_watch_git_head',
+                           '_buffer_batch_window',
+                           '_git_path',
+                           '_secondary_db_shards',
+                           '_file_guard',
+                           '_ignore_files'
                           ]
             ldict = self.__dict__
             rdict = r.__dict__
@@ -648,156 +1912,268 @@ class IndexerConfig():
 
         return not res
 
-    def _is_whitelisted_file(self, base_path, dirpath, file_name):
-        _, ext = os.path.splitext(file_name)
+    def begin_crawl(self):
+        """ Called by the Crawler before every crawl """
+        self._ignore_files.revalidate()
 
-        if not ext in self._file_exts:
-            return False
+    def folder_visited(self, dirpath, st):
+        """
+        Called by crawlers with the stat result of the folders they visit,
+        which spares the ignore files of unchanged folders some stat calls.
+        """
+        if self._ignore_files:
+            self._ignore_files.folder_visited(dirpath, st.st_mtime_ns)
 
-        full_name = os.path.join(dirpath, file_name)
-        include_patterns = self._folder_configs[base_path]['file_whitelist']
+    def find_base_path(self, dirpath):
+        not_found = (None, None)
 
-        # if the list is empty then all files are allowed
-        if not include_patterns:
-            return True
+        if not dirpath:
+            return not_found
 
-        for pattern in include_patterns:
-            if fnmatch.fnmatch(file_name, pattern):
-                return True
+        # The innermost project folder containing dirpath
+        matches = [bp for bp in self._folder_configs.keys() if _is_subpath(dirpath, bp)]
+        if matches:
+            bp = max(matches, key=len)
+            return (bp, self._folder_configs[bp]['follow_symlinks'])
 
-            if fnmatch.fnmatch(full_name, pattern):
-                return True
+        if DEBUG:
+            print("No base path found for '%s' in (%s)" % (dirpath, self._folder_configs.keys()))
+        return not_found
 
-        return False
 
+    def file_enumeration(self, base_path):
+        folder_config = self._folder_configs.get(base_path, None)
+        if not folder_config:
+            return FILE_ENUMERATION_FILESYSTEM
 
-    def _is_blacklisted_file(self, base_path, dirpath, file_name):
-        exclude_patterns = self._folder_configs[base_path]['file_blacklist']
+        return folder_config['file_enumeration']
 
-        # if the list is empty then all files are allowed
-        if not exclude_patterns:
-            return False
+    def crawl_mode(self, base_path):
+        folder_config = self._folder_configs.get(base_path, None)
+        if not folder_config:
+            return CRAWL_MODE_LOCAL
 
-        full_name = os.path.join(dirpath, file_name)
+        return folder_config['crawl_mode']
 
-        for pattern in exclude_patterns:
-            if fnmatch.fnmatch(file_name, pattern):
-                return True
+    def base_paths(self):
+        return tuple((key, self._folder_configs[key]['follow_symlinks'])
+                                        for key in self._folder_configs.keys())
 
-            if fnmatch.fnmatch(full_name, pattern):
-                return True
+    def file_matches(self, dirpath, file_name, st_mode=0, base_path=None):
+        st = None
+        if not base_path:
+            base_path, follow_symlinks = self.find_base_path(dirpath)
+            if not base_path:
+                return False
+
+            st = os.stat(os.path.join(dirpath, file_name), follow_symlinks=follow_symlinks)
+            st_mode = st.st_mode
 
-        for pattern in self._index_blacklist:
-            if fnmatch.fnmatch(file_name, pattern):
-                return True
+        if not stat.S_ISREG(st_mode):
+            return False
 
-            if fnmatch.fnmatch(full_name, pattern):
-                return True
+        if not self.file_name_matches(dirpath, file_name, base_path):
+            return False
 
-        return False
+        # Without a stat result of our own only the name can be checked
+        return st is None or self.file_content_matches(dirpath, file_name, st.st_size,
+                                        file_hash(st.st_mtime_ns, st.st_size, st.st_ino))
 
-    def _is_whitelisted_folder(self, base_path, dirpath, folder):
-        include_patterns = self._folder_configs[base_path]['folder_whitelist']
+    def file_name_matches(self, dirpath, file_name, base_path, stats=None):
+        """
+        The part of file_matches that only depends on the name, i.e. what
+        a crawler can check before it has to stat the file. The ignore files
+        read are added to stats, if given.
+        """
+        _, ext = os.path.splitext(file_name)
+        if not ext in self._file_exts:
+            return False
 
-        # if the list is empty then all files are allowed
-        if not include_patterns:
+        if not self._matchers[base_path].file_matches(dirpath, file_name):
+            return False
+
+        return not (self._ignore_files and
+                    self._ignore_files.is_ignored(dirpath, file_name, False, base_path,
+                                                  stats))
+
+
+    def file_content_matches(self, dirpath, file_name, st_size, hash_value, stats=None):
+        """
+        The size and content part of file_matches, for files that passed
+        file_name_matches. Skipped files are recorded in stats, if given.
+        """
+        if not self._file_guard:
             return True
 
-        full_path = os.path.join(dirpath, folder)
+        path = os.path.join(dirpath, file_name)
+        reason = self._file_guard.check(path, st_size, hash_value, stats)
+        if reason and stats is not None:
+            stats.skipped_files[path] = reason
 
-        for pattern in include_patterns:
-            if fnmatch.fnmatch(folder, pattern):
-                return True
+        return not reason
 
-            if fnmatch.fnmatch(full_path, pattern):
-                return True
+    def folder_matches(self, dirpath, folder, st_mode=0, base_path=None):
+        if not base_path:
+            base_path, follow_symlinks = self.find_base_path(dirpath)
+            if not base_path:
+                return False
+
+            st_mode = os.stat(os.path.join(dirpath, folder),
+                              follow_symlinks=follow_symlinks).st_mode
 
-        return False
+        if not stat.S_ISDIR(st_mode):
+            return False
 
-    def _is_blacklisted_folder(self, base_path, dirpath, folder):
-        exclude_patterns = self._folder_configs[base_path]['folder_blacklist']
+        return self.folder_name_matches(dirpath, folder, base_path)
 
-        # if the list is empty then all files are allowed
-        if not exclude_patterns:
+    def folder_name_matches(self, dirpath, folder, base_path, stats=None):
+        """
+        The part of folder_matches that only depends on the name. Nested
+        project folders never match, since they are crawled on their own.
+        The ignore files read are added to stats, if given.
+        """
+        if self._nested_folders and os.path.join(dirpath, folder) in self._nested_folders:
             return False
 
-        full_path = os.path.join(dirpath, folder)
+        if not self._matchers[base_path].folder_matches(dirpath, folder):
+            return False
 
-        for pattern in exclude_patterns:
-            if fnmatch.fnmatch(folder, pattern):
-                return True
+        return not (self._ignore_files and
+                    self._ignore_files.is_ignored(dirpath, folder, True, base_path, stats))
 
-            if fnmatch.fnmatch(full_path, pattern):
-                return True
 
-        for pattern in self._index_blacklist:
-            if fnmatch.fnmatch(folder, pattern):
-                return True
+def _file_list_entry(path):
+    # cscope needs file names containing spaces to be quoted
+    return ('"%s"\n' if ' ' in path else '%s\n') % path
 
-            if fnmatch.fnmatch(full_path, pattern):
-                return True
+def _top_level_folder(path, base_paths):
+    """
+    Returns the folder right below the project folder that path is in, or
+    the project folder itself for path == project folder. base_paths must be
+    sorted longest first so that nested project folders win.
+    """
+    for base_path in base_paths:
+        if path == base_path:
+            return path
+        if _is_subpath(path, base_path):
+            return os.path.join(base_path, os.path.relpath(path, base_path).split(os.sep)[0])
 
-        return False
+    return path
 
-    def find_base_path(self, dirpath):
-        not_found = (None, None)
 
-        if not dirpath:
-            return not_found
+def _pack_shards(folder_sizes, num_shards, shard_map):
+    """
+    Packs the folders in folder_sizes, {folder: number of files}, into
+    num_shards shards and returns {folder: shard}. The folders in shard_map
+    stay where they are, so that an update only changes the shards of the
+    folders it touched. The rest go largest first to the shard with the
+    fewest files so far.
+    """
+    packed = {folder: shard for folder, shard in shard_map.items()
+                            if folder in folder_sizes and shard < num_shards}
+    loads = [0] * num_shards
+    for folder, shard in packed.items():
+        loads[shard] += folder_sizes[folder]
 
-        for bp in self._folder_configs.keys():
-            if dirpath.startswith(bp):
-                return (bp, self._folder_configs[bp]['follow_symlinks'])
+    for folder in sorted(folder_sizes.keys() - packed.keys(),
+                         key=lambda folder: (-folder_sizes[folder], folder)):
+        shard = loads.index(min(loads))
+        packed[folder] = shard
+        loads[shard] += folder_sizes[folder]
 
-        if DEBUG:
-            print("No base path found for '%s' in (%s)" % (dirpath, self._folder_configs.keys()))
-        return not_found
+    return packed
 
 
-    def base_paths(self):
-        return tuple((key, self._folder_configs[key]['follow_symlinks'])
-                                        for key in self._folder_configs.keys())
+def _read_shard_map(db_location, num_shards):
+    # Empty if missing, unreadable or written for another number of shards
+    try:
+        with open(os.path.join(db_location, SHARD_MAP)) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        if DEBUG: print("%s: No usable shard map. %s" % (PACKAGE_NAME, e))
+        return {}
 
-    def file_matches(self, dirpath, file_name, st_mode=0, base_path=None):
-        if not base_path:
-            base_path, follow_symlinks = self.find_base_path(dirpath)
-            if not base_path:
-                return False
+    if not isinstance(data, dict) or data.get('shards') != num_shards:
+        return {}
 
-            st_mode = os.stat(os.path.join(dirpath, file_name),
-                                follow_symlinks=follow_symlinks).st_mode
+    return data.get('folders', {})
 
-        if not stat.S_ISREG(st_mode):
-            return False
 
-        if not self._is_whitelisted_file(base_path, dirpath, file_name):
-            return False
+def _write_shard_map(db_location, num_shards, shard_map):
+    file_name = os.path.join(db_location, SHARD_MAP)
+    tmp_name = file_name + '.tmp'
 
-        if self._is_blacklisted_file(base_path, dirpath, file_name):
-            return False
+    with open(tmp_name, 'w') as f:
+        json.dump({'shards': num_shards, 'folders': shard_map}, f)
 
-        return True
+    os.replace(tmp_name, file_name)
 
 
-    def folder_matches(self, dirpath, folder, st_mode=0, base_path=None):
-        if not base_path:
-            base_path, follow_symlinks = self.find_base_path(dirpath)
-            if not base_path:
-                return False
+def _db_files(db_location, name):
+    """ The file list, the database and the inverted index files of a DB """
+    file_list = os.path.join(db_location,
+                             os.extsep.join([name, cscope_runner.CSCOPE_FILE_LIST_EXT]))
+    db_file = os.path.join(db_location, os.extsep.join([name, cscope_runner.CSCOPE_DB_EXT]))
+    return [file_list, db_file, db_file + '.in', db_file + '.po']
 
-            st_mode = os.stat(os.path.join(dirpath, file_name), follow_symlinks=follow_symlinks)
 
-        if not stat.S_ISDIR(st_mode):
-            return False
+def secondary_db_shards(db_location):
+    """ Returns the names of the secondary DB shards built in db_location """
+    try:
+        names = os.listdir(db_location)
+    except OSError:
+        return []
 
-        if not self._is_whitelisted_folder(base_path, dirpath, folder):
-            return False
+    shard_re = re.compile(r'^%s-\d+\.%s$' % (SECONDARY_DB, cscope_runner.CSCOPE_DB_EXT))
+    return sorted(os.path.splitext(name)[0] for name in names if shard_re.match(name))
 
-        if self._is_blacklisted_folder(base_path, dirpath, folder):
-            return False
 
-        return True
+def get_skipped_files(win):
+    """
+    Returns {path: reason} for the files that the indexer of the project
+    in window 'win' left out because of their size or content.
+    Returns None if the indexer is too busy to answer within
+    UI_CALL_TIMEOUT seconds.
+    """
+    proj_file = _get_proj_name(win)
+    indexer_data = _indexers.get(proj_file, None) if proj_file else None
+    if not indexer_data:
+        return {}
+
+    try:
+        return indexer_data['indexer'].get_skipped_files(wait_for_result=True,
+                                                         timeout=UI_CALL_TIMEOUT)
+    except futures.TimeoutError:
+        return None
+
+def get_stats(win):
+    """
+    Returns a list of lines describing the message traffic of the indexer
+    of the project in window 'win', and of its crawler. Does not wait for
+    the indexer, so it also works while the indexer is backed up.
+    """
+    proj_file = _get_proj_name(win)
+    indexer_data = _indexers.get(proj_file, None) if proj_file else None
+    if not indexer_data:
+        return []
 
+    indexer = indexer_data['indexer']
+    lines = ["Indexer:"] + indexer.stats.summary()
+    lines += ['', "Crawler:"] + indexer.crawler_stats.summary()
+
+    crawl_stats = indexer.last_crawl_stats
+    if crawl_stats:
+        lines += ['', "Last crawl: %s" % crawl_stats.summary()]
+
+    return lines
+
+def _counted_stat(stats, path, follow_symlinks=True):
+    stats.stat_calls += 1
+    return os.stat(path, follow_symlinks=follow_symlinks)
+
+def _is_subpath(path, parent):
+    """ Returns True if path is parent or somewhere below it """
+    return path == parent or path.startswith(os.path.join(parent, ''))
 
 # The folder where we store cscope indexes for workspaces (since they have no project
 # folder associated with them.)
@@ -921,6 +2297,8 @@ def refresh(win=None, explicit_refresh=True):
             # Since there is a change in the config
             # The indexer will do an implicit refresh
             explicit_refresh = False
+            # Work for the old config is of no use
+            indexer.cancel_work()
             indexer.set_config(indexer_cfg)
             indexer_data['config'] = indexer_cfg
 
@@ -933,6 +2311,7 @@ def refresh(win=None, explicit_refresh=True):
         indexer.start()
 
         if explicit_refresh:
+            indexer.cancel_work()
             indexer.refresh()
 
 
@@ -1008,6 +2387,7 @@ def settings_changed(proj_file=None):
             return
         new_config = IndexerConfig(win)
         if new_config != config:
+           indexer.cancel_work()
            indexer.set_config(new_config)
            indexer_data['config'] = new_config
 
@@ -1024,3 +2404,7 @@ def quit():
         indexer_data.setdefault('windows',[]).clear()
 
     _trim_indexers()
+
+    _indexer_scheduler.shutdown()
+    _crawl_scheduler.shutdown()
+    cscope_runner.quit()
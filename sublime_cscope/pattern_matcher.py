@@ -0,0 +1,181 @@
+import os
+import re
+
+# fnmatch normalizes the case of both pattern and name on case insensitive
+# platforms. Do the same, but only where it actually makes a difference.
+_NORMCASE = os.path.normcase if os.path.normcase('A') != 'A' else None
+
+_SEPS = os.sep + (os.altsep or '')
+_NOT_SEP = '[^%s]' % re.escape(_SEPS)
+
+# The folder decision memo is dropped when it grows beyond this many entries
+MAX_MEMO_SIZE = 100000
+
+
+def translate_pattern(pattern, in_name):
+    """
+    Translates a shell pattern to a regular expression with the same
+    semantics as fnmatch. If in_name is True the wildcards never match a
+    path separator, which makes the expression usable for matching the last
+    component of a full path.
+    """
+    any_char = _NOT_SEP if in_name else '.'
+    res = []
+    i, n = 0, len(pattern)
+
+    while i < n:
+        c = pattern[i]
+        i += 1
+
+        if c == '*':
+            # collapse consecutive stars
+            while i < n and pattern[i] == '*':
+                i += 1
+            res.append(any_char + '*')
+        elif c == '?':
+            res.append(any_char)
+        elif c == '[':
+            j = i
+            if j < n and pattern[j] == '!':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+
+            if j >= n:
+                res.append('\\[')
+                continue
+
+            stuff = pattern[i:j].replace('\\', '\\\\')
+            i = j + 1
+
+            if stuff[0] == '!':
+                stuff = '^' + (re.escape(_SEPS) if in_name else '') + stuff[1:]
+            elif stuff[0] in ('^', '['):
+                stuff = '\\' + stuff
+            res.append('[%s]' % stuff)
+        else:
+            res.append(re.escape(c))
+
+    return ''.join(res)
+
+
+def _simple_extension(pattern):
+    # Returns '.ext' for patterns of the form '*.ext' without other wildcards
+    if not pattern.startswith('*.'):
+        return None
+
+    ext = pattern[1:]
+    if '.' in ext[1:] or any(c in ext for c in '*?[' + _SEPS):
+        return None
+
+    return ext
+
+
+class PatternMatcher:
+    """
+    A set of shell patterns (see fnmatch) compiled into a single regular
+    expression. A name matches if the pattern matches either the name itself
+    or the full path (dirpath joined with name), just like calling
+    fnmatch.fnmatch for both of them with every pattern.
+
+    Patterns of the form '*.ext' are handled by a set lookup on the extension
+    of the name and never reach the regular expression.
+    """
+
+    def __init__(self, patterns):
+        self._patterns = sorted(set(patterns))
+        self._exts = set()
+        alternatives = []
+
+        for pattern in self._patterns:
+            if _NORMCASE:
+                pattern = _NORMCASE(pattern)
+
+            ext = _simple_extension(pattern)
+            if ext:
+                self._exts.add(ext)
+                continue
+
+            # Matches the full path
+            alternatives.append(translate_pattern(pattern, False))
+
+            # Matches the last path component. A pattern containing a
+            # separator can never match a plain name and one starting with
+            # '*' is already covered by the full path alternative.
+            if not pattern.startswith('*') and not any(sep in pattern for sep in _SEPS):
+                alternatives.append('(?:.*[%s])?%s' % (re.escape(_SEPS),
+                                                       translate_pattern(pattern, True)))
+
+        self._regex = None
+        if alternatives:
+            self._regex = re.compile('(?:%s)\\Z' % '|'.join(alternatives), re.S)
+
+    def __bool__(self):
+        return bool(self._patterns)
+
+    def __eq__(self, r):
+        if not isinstance(r, self.__class__):
+            return NotImplemented
+        return self._patterns == r._patterns
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self._patterns)
+
+    @property
+    def patterns(self):
+        return self._patterns
+
+    def matches(self, dirpath, name):
+        if _NORMCASE:
+            dirpath = _NORMCASE(dirpath)
+            name = _NORMCASE(name)
+
+        if self._exts:
+            dot = name.rfind('.')
+            if dot >= 0 and name[dot:] in self._exts:
+                return True
+
+        if self._regex:
+            return self._regex.match(os.path.join(dirpath, name)) is not None
+
+        return False
+
+
+class FolderConfigMatcher:
+    """
+    The compiled include/exclude rules of one project folder. Folder
+    decisions are memoized by full path since every crawl asks the same
+    questions about the same folders.
+    """
+
+    def __init__(self, file_whitelist, file_blacklist,
+                 folder_whitelist, folder_blacklist, index_blacklist=()):
+        self.file_whitelist = PatternMatcher(file_whitelist)
+        self.file_blacklist = PatternMatcher(list(file_blacklist) + list(index_blacklist))
+        self.folder_whitelist = PatternMatcher(folder_whitelist)
+        self.folder_blacklist = PatternMatcher(list(folder_blacklist) + list(index_blacklist))
+        self._folder_memo = {}
+
+    def file_matches(self, dirpath, file_name):
+        # if the whitelist is empty then all files are allowed
+        if self.file_whitelist and not self.file_whitelist.matches(dirpath, file_name):
+            return False
+
+        return not self.file_blacklist.matches(dirpath, file_name)
+
+    def folder_matches(self, dirpath, folder):
+        key = os.path.join(dirpath, folder)
+        res = self._folder_memo.get(key, None)
+
+        if res is None:
+            res = not self.folder_blacklist.matches(dirpath, folder)
+            if res and self.folder_whitelist:
+                res = self.folder_whitelist.matches(dirpath, folder)
+
+            if len(self._folder_memo) >= MAX_MEMO_SIZE:
+                self._folder_memo.clear()
+            self._folder_memo[key] = res
+
+        return res
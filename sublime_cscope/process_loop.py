@@ -0,0 +1,229 @@
+import locale
+import subprocess
+import sys
+import threading
+from concurrent import futures
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+from ..SublimeCscope import DEBUG, PACKAGE_NAME
+
+# An event loop outside of the main thread can run subprocesses as of
+# Python 3.8, where the threaded child watcher became the default on posix
+# and the proactor event loop the default on Windows. Older plugin hosts
+# have to block a thread per process instead.
+HAS_ASYNCIO = asyncio is not None and sys.version_info >= (3, 8)
+
+# How often a stopping loop checks whether the killed processes are gone
+STOP_POLL_INTERVAL = 0.01
+
+_ProtocolBase = asyncio.SubprocessProtocol if HAS_ASYNCIO else object
+
+
+class _LineProtocol(_ProtocolBase):
+    """
+    Splits the output of a process into lines and hands them to on_line as
+    they arrive. Resolves the future with the exit code once the process has
+    exited and all of its output has been handed over. Output that arrives
+    after the process was killed is dropped, since whoever cancelled the
+    future may already have moved on.
+    """
+
+    def __init__(self, loop, on_line, future, timeout, running):
+        self._loop = loop
+        self._on_line = on_line
+        self._future = future
+        self._timeout = timeout
+        self._running = running
+        self._encoding = locale.getpreferredencoding(False)
+        self._buffer = b''
+        self._error = None
+        self._timer = None
+        self._transport = None
+        self._killed = False
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._running.add(self)
+
+        if self._timeout:
+            self._timer = self._loop.call_later(self._timeout, self.fail,
+                                                futures.TimeoutError())
+
+        # Cancelling the future kills the process. Called right away if it
+        # was cancelled while the process was starting.
+        self._future.add_done_callback(self._future_done)
+
+    def pipe_data_received(self, fd, data):
+        if self._error or self._killed:
+            return
+
+        lines = (self._buffer + data).split(b'\n')
+        self._buffer = lines.pop()
+
+        for line in lines:
+            if not self._feed(line):
+                break
+
+    def connection_lost(self, exc):
+        if self._buffer and not self._error and not self._killed:
+            self._feed(self._buffer)
+        self._buffer = b''
+
+        if self._timer:
+            self._timer.cancel()
+        self._running.discard(self)
+
+        try:
+            if self._error:
+                self._future.set_exception(self._error)
+            else:
+                self._future.set_result(self._transport.get_returncode())
+        except futures.InvalidStateError:
+            # Cancelled
+            pass
+
+        self._transport.close()
+
+    def fail(self, error):
+        """ Kills the process. The future raises error instead. """
+        if not self._error:
+            self._error = error
+        self.kill()
+
+    def kill(self):
+        self._killed = True
+
+        if self._transport.is_closing() or self._transport.get_returncode() is not None:
+            return
+
+        try:
+            self._transport.kill()
+        except ProcessLookupError:
+            pass
+
+    def _future_done(self, future):
+        if future.cancelled():
+            # Set right away, the loop may be in the middle of feeding lines
+            self._killed = True
+            self._loop.call_soon_threadsafe(self.kill)
+
+    def _feed(self, line):
+        if self._killed:
+            return False
+
+        line = line.decode(self._encoding, errors='replace').rstrip('\r')
+        if not line:
+            return True
+
+        try:
+            self._on_line(line)
+        except Exception as e:
+            self.fail(e)
+            return False
+
+        return True
+
+
+class ProcessLoop:
+    """
+    An asyncio event loop on a thread of its own which runs processes and
+    reads their output, so that any number of processes can be in flight
+    without a thread blocked on each of them. The thread is started by the
+    first process. Requires HAS_ASYNCIO.
+    """
+
+    def __init__(self, name='Process loop'):
+        self._name = name
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        # The protocols of the running processes, only used by the loop thread
+        self._running = set()
+
+    @property
+    def num_running(self):
+        return len(self._running)
+
+    def run_process(self, args, on_line, cwd=None, timeout=None):
+        """
+        Starts a process and hands each line it writes to stdout or stderr,
+        without line ending, to on_line. on_line is called from the loop
+        thread. Returns a concurrent.futures.Future with the exit code.
+
+        Cancelling the future kills the process. If on_line raises, or the
+        process runs for longer than timeout seconds, the process is killed
+        and the future raises the exception or futures.TimeoutError.
+        """
+        future = futures.Future()
+        self._ensure_started().call_soon_threadsafe(self._start_process, args, on_line,
+                                                    cwd, timeout, future)
+        return future
+
+    def shutdown(self):
+        """ Kills the running processes and stops the loop thread. """
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+
+        if not loop:
+            return
+
+        loop.call_soon_threadsafe(self._stop, loop)
+        thread.join()
+
+    def _ensure_started(self):
+        with self._lock:
+            if not self._loop:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._run, args=(self._loop,),
+                                                name=self._name)
+                self._thread.daemon = True
+                self._thread.start()
+
+            return self._loop
+
+    def _run(self, loop):
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+        if DEBUG:
+            print("%s: %s stopped" % (PACKAGE_NAME, self._name))
+
+    def _start_process(self, args, on_line, cwd, timeout, future):
+        if future.cancelled():
+            return
+
+        loop = asyncio.get_event_loop()
+        protocol = _LineProtocol(loop, on_line, future, timeout, self._running)
+        task = loop.create_task(loop.subprocess_exec(lambda: protocol, *args, cwd=cwd,
+                                                     stdin=subprocess.DEVNULL,
+                                                     stdout=subprocess.PIPE,
+                                                     stderr=subprocess.STDOUT))
+
+        def started(task):
+            if task.cancelled():
+                future.cancel()
+            elif task.exception():
+                try:
+                    future.set_exception(task.exception())
+                except futures.InvalidStateError:
+                    pass
+
+        task.add_done_callback(started)
+
+    def _stop(self, loop):
+        for protocol in list(self._running):
+            protocol.fail(futures.CancelledError())
+
+        # Wait for the killed processes to be reaped before stopping
+        if self._running:
+            loop.call_later(STOP_POLL_INTERVAL, self._stop, loop)
+        else:
+            loop.stop()
@@ -18,7 +18,21 @@ mod_prefix = PACKAGE_NAME + '.sublime_cscope'
 
 mods_load_order = ['']
 mods_load_order.append('.settings')
+mods_load_order.append('.file_index')
+mods_load_order.append('.crawl_stats')
+mods_load_order.append('.cancellation')
+mods_load_order.append('.actor_stats')
 mods_load_order.append('.event_listener')
+mods_load_order.append('.scandir_crawler')
+mods_load_order.append('.snapshot')
+mods_load_order.append('.watch_thread')
+mods_load_order.append('.file_watcher')
+mods_load_order.append('.git_index')
+mods_load_order.append('.git_head_watcher')
+mods_load_order.append('.pattern_matcher')
+mods_load_order.append('.file_guard')
+mods_load_order.append('.ignore_files')
+mods_load_order.append('.process_loop')
 mods_load_order.append('.indexer')
 mods_load_order.append('.cscope_runner')
 mods_load_order.append('.cscope_results')
@@ -32,8 +46,26 @@ if DEBUG:
     mods_load_order.append('.tests.test_indexer')
     mods_load_order.append('.tests.test_event_listener')
     mods_load_order.append('.tests.test_cscope_results')
+    mods_load_order.append('.tests.test_snapshot')
+    mods_load_order.append('.tests.test_file_watcher')
+    mods_load_order.append('.tests.test_git_index')
+    mods_load_order.append('.tests.test_git_head_watcher')
+    mods_load_order.append('.tests.test_pattern_matcher')
+    mods_load_order.append('.tests.test_file_index')
+    mods_load_order.append('.tests.test_file_guard')
+    mods_load_order.append('.tests.test_ignore_files')
+    mods_load_order.append('.tests.test_cancellation')
+    mods_load_order.append('.tests.test_actor_stats')
+    mods_load_order.append('.tests.test_process_loop')
+    mods_load_order.append('.tests.test_cscope_runner')
     mods_load_order.append('.debug_commands')
     mods_load_order.append('.debug_commands.run_tests_command')
+    mods_load_order.append('.benchmarks')
+    mods_load_order.append('.benchmarks.bench_crawler')
+    mods_load_order.append('.benchmarks.bench_pattern_matcher')
+    mods_load_order.append('.benchmarks.bench_file_index')
+    mods_load_order.append('.benchmarks.bench_actor')
+    mods_load_order.append('.debug_commands.run_benchmarks_command')
 
 
 for suffix in mods_load_order:
@@ -0,0 +1,465 @@
+import os
+import re
+import stat
+import time
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from ..SublimeCscope import DEBUG, PACKAGE_NAME
+from .file_index import DirRecord, InodeSet, folder_key, file_hash
+from .crawl_stats import CrawlStats
+
+# os.scandir was added in Python 3.5. Older plugin hosts have to fall back
+# on the os.walk based crawler.
+HAS_SCANDIR = hasattr(os, 'scandir')
+
+# Directory listings are mostly I/O bound so we can afford more threads
+# than there are cores. Same heuristic as ThreadPoolExecutor in Python 3.8.
+DEFAULT_MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+# On network file systems every stat is a round trip to the server. The
+# network crawl mode hides that latency by keeping many requests in flight
+# at once, from a much wider pool.
+NETWORK_MAX_WORKERS = 64
+
+# The entries of a folder are stat:ed this many at a time by the network
+# crawl mode, so that large folders are spread over the pool as well.
+NETWORK_STAT_BATCH_SIZE = 16
+
+# File system types of the Linux mount table that are served over the
+# network, see is_network_mount
+NETWORK_FS_TYPES = frozenset(('nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'ncpfs', 'afs',
+                              '9p', 'ceph', 'glusterfs', 'lustre', 'fuse.sshfs'))
+MOUNTS_FILE = '/proc/self/mounts'
+
+# Jobs handed to the executor at a time, per worker. The rest wait in a
+# queue, which keeps the memory held by finished but unprocessed jobs
+# bounded on very wide trees.
+IN_FLIGHT_PER_WORKER = 2
+
+NSECS_PER_SEC = 1000000000
+
+# Folders with an mtime this close to the start of a crawl are not trusted
+# by incremental crawls. Covers file systems with a coarse mtime resolution.
+RACY_MTIME_NS = 2 * NSECS_PER_SEC
+
+
+class ScandirCrawler:
+    """
+    Crawls a set of folders using os.scandir. Each directory listing is
+    a separate job that is fanned out over a bounded thread pool, both across
+    base paths and across subtrees. The DirEntry objects returned by scandir
+    are reused for type information and the stat result of each sub folder
+    is handed down to the job that lists it, so every entry is stat:ed once.
+    Entries are matched by name before that, so rejected ones are never
+    stat:ed at all.
+
+    With a stat_batch_size the entries of each folder are instead stat:ed
+    by separate jobs of at most that many entries, which is what the network
+    crawl mode uses (see NETWORK_STAT_BATCH_SIZE).
+
+    The result has the same layout as the one produced by the os.walk based
+    crawler, i.e. a dict of DirRecord keyed by folder_key().
+    """
+
+    def __init__(self, max_workers=0, default_workers=DEFAULT_MAX_WORKERS,
+                 stat_batch_size=0):
+        self._max_workers = max_workers or default_workers
+        self._stat_batch_size = stat_batch_size
+        # {path: (st_dev, st_ino, st_mtime_ns, files, subdirs, skipped_files)}
+        self._folder_cache = {}
+        self._cache_config = None
+
+    def crawl(self, folders_to_search, config, result, max_workers=0,
+              incremental=False, stats=None, record_callback=None, cancel_token=None):
+        """
+        folders_to_search is a list of (start_path, base_path, follow_symlinks)
+        tuples, just like the one used by Crawler.crawl. The file system calls
+        made are added to stats, if given.
+
+        record_callback, if given, is called with every DirRecord as soon as
+        it is final. Folders that only contain files with a single name
+        are final as soon as they have been listed. The ones containing
+        symlinks or hard links have to wait until the end of the crawl.
+
+        In incremental mode only folders whose mtime (or device/inode) changed
+        since the previous crawl are listed. The file lists of the other
+        folders are carried forward from the previous crawl. Note that
+        modifying a file in place does not change the mtime of its folder,
+        so incremental crawls only pick up added, removed and renamed files.
+        The files skipped in carried forward folders are added to stats
+        again, just as if they had been listed.
+
+        Raises cancellation.Cancelled if cancel_token is cancelled while
+        crawling. Folders already listed stay in the incremental cache.
+        """
+        # The pool only lives as long as the crawl, so that the crawlers of
+        # idle projects don't hold on to any threads
+        max_workers = max_workers or self._max_workers
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return self._crawl(executor, max_workers, folders_to_search, config, result,
+                               incremental, stats, record_callback, cancel_token)
+
+    def _crawl(self, executor, max_workers, folders_to_search, config, result,
+               incremental, stats, record_callback, cancel_token):
+        max_in_flight = max_workers * IN_FLIGHT_PER_WORKER
+        if stats is None:
+            stats = CrawlStats()
+
+        if config != self._cache_config:
+            self._folder_cache.clear()
+            self._cache_config = config
+
+        folder_cache = self._folder_cache if incremental else {}
+        crawl_start_ns = int(time.time() * NSECS_PER_SEC)
+        stat_inline = not self._stat_batch_size
+
+        # {folder key: (path, root_index, [(name, file key, file hash, is_unique)])}
+        scanned = {}
+        # The folders that contain files which may be reachable by several names
+        ambiguous = {}
+        # Shared by all project folders, like in Crawler.crawl
+        visited_files = InodeSet()
+        seen_folders = set(result.keys())
+        # Jobs are (function, args, done callback). At most max_in_flight
+        # of them are handed to the executor at a time, the rest are queued.
+        pending = {}
+        queued = deque()
+        deferred_links = []
+        num_cached = 0
+
+        def list_folder(path, key, root_idx, st=None):
+            seen_folders.add(key)
+            _, base, follow_syms = folders_to_search[root_idx]
+            queued.append((_scan_folder,
+                           (path, base, follow_syms, config, st,
+                            folder_cache.get(path, None), stat_inline),
+                           partial(folder_listed, path, key, root_idx, follow_syms)))
+
+        def folder_listed(path, key, root_idx, follow_syms, scan_res):
+            if scan_res is None:
+                return
+
+            st, files, subdirs, from_cache, job_stats, unstated = scan_res
+            stats.merge(job_stats)
+
+            if not unstated:
+                folder_done(path, key, root_idx, st, files, subdirs, from_cache,
+                            job_stats.skipped_files)
+                return
+
+            # Stat the entries of the folder in batches spread over the pool.
+            # Batches go first in the queue so that folders are completed
+            # before new ones are started.
+            size = self._stat_batch_size
+            batches = [unstated[i:i + size] for i in range(0, len(unstated), size)]
+            batch_res = [None] * len(batches)
+
+            for idx in reversed(range(len(batches))):
+                queued.appendleft((_stat_entries,
+                                   (path, batches[idx], follow_syms, config),
+                                   partial(batch_stated, path, key, root_idx,
+                                           st, batch_res, idx)))
+
+        def batch_stated(path, key, root_idx, st, batch_res, idx, stat_res):
+            files, subdirs, job_stats = stat_res
+            stats.merge(job_stats)
+            batch_res[idx] = (files, subdirs, job_stats.skipped_files)
+
+            # Keep the order of the directory listing, whatever order the
+            # batches finish in
+            if all(res is not None for res in batch_res):
+                skipped = {}
+                for _, _, batch_skipped in batch_res:
+                    skipped.update(batch_skipped)
+
+                folder_done(path, key, root_idx, st,
+                            [f for files, _, _ in batch_res for f in files],
+                            [d for _, subdirs, _ in batch_res for d in subdirs],
+                            False, skipped)
+
+        def folder_done(path, key, root_idx, st, files, subdirs, from_cache, skipped):
+            nonlocal num_cached
+            scanned[key] = (path, root_idx, files)
+
+            # Files with a single name always win over the other names of
+            # a file, so those can be marked as visited right away
+            for _, file_key, _, is_unique in files:
+                if is_unique:
+                    visited_files.add(file_key)
+
+            if all(is_unique for _, _, _, is_unique in files):
+                result[key] = DirRecord(path, [f[0] for f in files], [f[2] for f in files])
+                if record_callback:
+                    record_callback(result[key])
+            else:
+                ambiguous[key] = (path, root_idx, files)
+
+            if from_cache:
+                num_cached += 1
+            else:
+                self._update_cache(path, st, files, subdirs, skipped, crawl_start_ns)
+
+            for name, sub_key, is_link, sub_st in subdirs:
+                sub_path = os.path.join(path, name)
+                if is_link:
+                    deferred_links.append((sub_path, sub_key, root_idx, sub_st))
+                elif sub_key in seen_folders:
+                    if DEBUG: print("Folder %s was already visited" % sub_path)
+                else:
+                    list_folder(sub_path, sub_key, root_idx, sub_st)
+
+        for root_idx, (start, base, follow_syms) in enumerate(folders_to_search):
+            start = os.path.normpath(start)
+            if DEBUG: print("Starting to crawl folder: %s" % start)
+
+            try:
+                stats.stat_calls += 1
+                st = os.stat(start, follow_symlinks=follow_syms)
+            except (FileNotFoundError, OSError) as e:
+                print("%s: %s" % (PACKAGE_NAME, e))
+                continue
+
+            if folder_key(st) not in seen_folders:
+                list_folder(start, folder_key(st), root_idx, st)
+
+        while pending or queued:
+            if cancel_token and cancel_token.cancelled:
+                # Listings already handed to the executor can't be stopped
+                queued.clear()
+                wait(pending.keys())
+                cancel_token.check()
+
+            while queued and len(pending) < max_in_flight:
+                func, args, done_callback = queued.popleft()
+                pending[executor.submit(func, *args)] = done_callback
+
+            done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                done_callback = pending.pop(future)
+                done_callback(future.result())
+
+            # Symlinked folders are the only way the same folder can show up
+            # under several names. Wait until all real folders have been seen
+            # and then resolve the links in sorted order so that the chosen
+            # name does not depend on thread scheduling.
+            if not pending and not queued and deferred_links:
+                deferred_links.sort(key=lambda l: l[0])
+                for sub_path, sub_key, root_idx, sub_st in deferred_links:
+                    if sub_key in seen_folders:
+                        if DEBUG: print("Folder %s was already visited" % sub_path)
+                    else:
+                        list_folder(sub_path, sub_key, root_idx, sub_st)
+                deferred_links.clear()
+
+        if DEBUG and incremental:
+            print("%s: Incremental crawl listed %d of %d folders" %
+                        (PACKAGE_NAME, len(scanned) - num_cached, len(scanned)))
+
+        self._prune_cache(folders_to_search, scanned)
+
+        self._collect_results(ambiguous, result, visited_files, record_callback)
+        return result
+
+    def _update_cache(self, path, st, files, subdirs, skipped, crawl_start_ns):
+        # A folder modified within the mtime granularity of the file system
+        # right before the crawl started may be modified again without any
+        # visible change of its mtime. Such folders are not cached.
+        if st.st_mtime_ns + RACY_MTIME_NS >= crawl_start_ns:
+            self._folder_cache.pop(path, None)
+            return
+
+        self._folder_cache[path] = (st.st_dev, st.st_ino, st.st_mtime_ns, files,
+                                    [(name, key, is_link, None) for name, key, is_link, _ in subdirs],
+                                    skipped)
+
+    def _prune_cache(self, folders_to_search, scanned):
+        # Forget about folders below the crawled paths that no longer exist
+        visited = {path for path, _, _ in scanned.values()}
+        starts = tuple(os.path.normpath(start) for start, _, _ in folders_to_search)
+        prefixes = tuple(os.path.join(start, '') for start in starts)
+
+        for path in list(self._folder_cache.keys()):
+            if path in visited:
+                continue
+            if path in starts or path.startswith(prefixes):
+                del self._folder_cache[path]
+
+    def _collect_results(self, scanned, result, visited_files, record_callback):
+        # Files reachable by several names (hard links or symlinks) are only
+        # indexed once. Files with a single name have already been added to
+        # visited_files, so those always win. Resolve the rest in path order
+        # to keep the result deterministic.
+        for key, (path, root_idx, files) in sorted(scanned.items(), key=lambda i: i[1][0]):
+            matching_files = []
+            hashes = []
+
+            for name, file_key, hash_value, is_unique in files:
+                if not is_unique and file_key in visited_files:
+                    if DEBUG: print("File %s was already visited" % os.path.join(path, name))
+                    continue
+
+                matching_files.append(name)
+                hashes.append(hash_value)
+                visited_files.add(file_key)
+
+            result[key] = DirRecord(path, matching_files, hashes)
+            if record_callback:
+                record_callback(result[key])
+
+
+def _scan_folder(path, base_path, follow_syms, config, st=None, cached=None,
+                 stat_entries=True):
+    """
+    Lists one folder and returns the files and sub folders that pass
+    the config filters. If the folder has not changed since 'cached' was
+    recorded the cached listing is returned instead. Runs in a worker thread.
+
+    Entries are first matched by name and only the ones that pass are
+    stat:ed. The file type is taken from the directory entry where the file
+    system provides it, so is_dir() is normally free. If stat_entries is
+    False the entries to stat are returned instead, see _stat_entries.
+    """
+    stats = CrawlStats()
+
+    if st is None:
+        try:
+            stats.stat_calls += 1
+            st = os.stat(path, follow_symlinks=follow_syms)
+        except OSError:
+            return None
+
+    config.folder_visited(path, st)
+
+    if cached:
+        dev, ino, mtime_ns, cached_files, cached_subdirs, cached_skipped = cached
+        if (st.st_dev, st.st_ino, st.st_mtime_ns) == (dev, ino, mtime_ns):
+            stats.skipped_files.update(cached_skipped)
+            return (st, cached_files, cached_subdirs, True, stats, None)
+
+    try:
+        stats.listdir_calls += 1
+        entries = list(os.scandir(path))
+    except OSError:
+        # Same behaviour as os.walk: unreadable folders are silently skipped
+        return None
+
+    unstated = []
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+
+        if is_dir:
+            name_matches = config.folder_name_matches(path, entry.name, base_path, stats)
+        else:
+            name_matches = config.file_name_matches(path, entry.name, base_path, stats)
+
+        if name_matches:
+            unstated.append((entry, is_dir))
+        else:
+            stats.rejected_by_name += 1
+
+    if not stat_entries:
+        return (st, [], [], False, stats, unstated)
+
+    files, subdirs, entry_stats = _stat_entries(path, unstated, follow_syms, config)
+    stats.merge(entry_stats)
+
+    return (st, files, subdirs, False, stats, None)
+
+
+def _stat_entries(path, entries, follow_syms, config):
+    """
+    Stats the (DirEntry, is_dir) pairs in entries and returns the files and
+    sub folders among them, leaving out files that fail the size and content
+    checks of config. Runs in a worker thread.
+
+    Files that are neither symlinks nor hard linked can only be reached by
+    one name, which is recorded as is_unique. st_nlink is always 0 on
+    Windows, so no file is unique there.
+    """
+    files = []
+    subdirs = []
+    stats = CrawlStats()
+
+    for entry, is_dir in entries:
+        try:
+            stats.stat_calls += 1
+            entry_st = entry.stat(follow_symlinks=follow_syms)
+        except (FileNotFoundError, OSError) as e:
+            print("%s: %s" % (PACKAGE_NAME, e))
+            continue
+
+        if is_dir:
+            if stat.S_ISDIR(entry_st.st_mode):
+                subdirs.append((entry.name, folder_key(entry_st), entry.is_symlink(), entry_st))
+        elif stat.S_ISREG(entry_st.st_mode):
+            hash_value = file_hash(entry_st.st_mtime_ns, entry_st.st_size, entry_st.st_ino)
+            if config.file_content_matches(path, entry.name, entry_st.st_size,
+                                           hash_value, stats):
+                files.append((entry.name, (entry_st.st_dev, entry_st.st_ino), hash_value,
+                              entry_st.st_nlink == 1 and not entry.is_symlink()))
+
+    return (files, subdirs, stats)
+
+
+def is_network_mount(path):
+    """
+    Returns True if path is on a network file system, False if it is not,
+    or None if that can't be told on this platform.
+    """
+    if os.name == 'nt':
+        return _is_remote_drive(path)
+
+    fs_type = _mount_fs_type(path)
+    if fs_type is None:
+        return None
+    return fs_type in NETWORK_FS_TYPES
+
+
+def _mount_fs_type(path, mounts_file=MOUNTS_FILE):
+    # The file system type of the innermost mount point containing path,
+    # from the mount table of Linux
+    try:
+        with open(mounts_file, encoding='utf-8', errors='surrogateescape') as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+
+    path = os.path.realpath(path)
+    mount_point = None
+    fs_type = None
+
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+
+        # Spaces and the like are escaped as octal, e.g. \040
+        point = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), fields[1])
+        inside = path == point or path.startswith(point.rstrip('/') + '/')
+        # Later mounts on the same mount point hide the earlier ones
+        if inside and (mount_point is None or len(point) >= len(mount_point)):
+            mount_point = point
+            fs_type = fields[2]
+
+    return fs_type
+
+
+def _is_remote_drive(path):
+    path = os.path.abspath(path)
+    unc = path.startswith('\\\\') and not path.startswith('\\\\?\\')
+    if unc or path.upper().startswith('\\\\?\\UNC\\'):
+        return True
+
+    try:
+        import ctypes
+        DRIVE_REMOTE = 4
+        drive = os.path.splitdrive(path)[0].lstrip('\\?') + '\\'
+        return ctypes.windll.kernel32.GetDriveTypeW(drive) == DRIVE_REMOTE
+    except (ImportError, AttributeError, OSError):
+        return None
@@ -20,7 +20,22 @@ SETTING_DEFAULTS = {
                         'search_std_include_folders': False,
                         'extra_include_folders': [],
                         'tmp_folder': [],
-                        'maximum_results': 1000
+                        'maximum_results': 1000,
+                        'query_timeout': 60,
+                        'secondary_db_shards': 1,
+                        'crawler_engine': 'scandir',
+                        'crawler_threads': 0,
+                        'network_crawler_threads': 0,
+                        'incremental_crawl': False,
+                        'watch_file_system': True,
+                        'watch_poll_interval': 10,
+                        'watch_git_head': True,
+                        'buffer_batch_window': 0.5,
+                        'git_path': None,
+                        'index_max_file_size': 0,
+                        'index_skip_binary_files': False,
+                        'index_generated_markers': [],
+                        'honor_ignore_files': False
                    }
 
 def load_settings():
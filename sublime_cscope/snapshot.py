@@ -0,0 +1,140 @@
+import os
+import sys
+import struct
+from array import array
+
+from ..SublimeCscope import DEBUG, PACKAGE_NAME
+from .file_index import DirRecord, NAME_SEPARATOR, HASH_TYPECODE
+
+# The file index of a project is persisted next to the cscope databases
+# so that the next session can start serving queries right away and
+# verify the index in the background instead of doing a full rebuild.
+SNAPSHOT_FILE = 'index.snapshot'
+
+SNAPSHOT_MAGIC = b'SCIX'
+SNAPSHOT_VERSION = 5
+
+FLAG_TWO_TIER = 0x1
+
+# magic, version, flags, number of folders
+_HEADER = struct.Struct('<4sHHI')
+# folder device, folder inode, path length, number of files, file names length.
+# Followed by the path, the file names and the 64 bit hash of each file.
+_FOLDER = struct.Struct('<QQIII')
+_HASH_SIZE = array(HASH_TYPECODE).itemsize
+_SWAP_HASHES = sys.byteorder != 'little'
+
+_ENCODING = 'utf-8'
+_ERRORS = 'surrogateescape'
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def snapshot_path(db_location):
+    return os.path.join(db_location, SNAPSHOT_FILE)
+
+
+def write_snapshot(db_location, file_index, two_tier_mode):
+    """
+    Writes the file index to db_location. The snapshot is written
+    to a temporary file first so that a crash never leaves a truncated
+    snapshot behind.
+    """
+    file_name = snapshot_path(db_location)
+    tmp_name = file_name + '.tmp'
+
+    flags = FLAG_TWO_TIER if two_tier_mode else 0
+
+    with open(tmp_name, mode='wb') as f:
+        f.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, flags,
+                             len(file_index)))
+
+        for (dev, ino), record in file_index.items():
+            path = record.path.encode(_ENCODING, _ERRORS)
+            names = record.packed_files.encode(_ENCODING, _ERRORS)
+            f.write(_FOLDER.pack(dev, ino, len(path), record.num_files, len(names)))
+            f.write(path)
+            f.write(names)
+
+            hashes = record.hashes
+            if _SWAP_HASHES:
+                hashes = array(HASH_TYPECODE, hashes)
+                hashes.byteswap()
+            f.write(hashes.tobytes())
+
+    os.replace(tmp_name, file_name)
+
+
+def read_snapshot(db_location):
+    """
+    Reads a snapshot written by write_snapshot.
+    Returns a tuple (file_index, two_tier_mode).
+    Raises SnapshotError if the snapshot is missing, truncated or was
+    written by an incompatible version.
+    """
+    file_name = snapshot_path(db_location)
+
+    try:
+        with open(file_name, mode='rb') as f:
+            data = f.read()
+    except OSError as e:
+        raise SnapshotError(str(e))
+
+    if len(data) < _HEADER.size:
+        raise SnapshotError("%s is truncated" % file_name)
+
+    magic, version, flags, num_folders = _HEADER.unpack_from(data, 0)
+
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotError("%s is not a snapshot file" % file_name)
+
+    if version != SNAPSHOT_VERSION:
+        raise SnapshotError("%s has unsupported version %d" % (file_name, version))
+
+    file_index = {}
+    offset = _HEADER.size
+
+    try:
+        for _ in range(num_folders):
+            dev, ino, path_len, num_files, names_len = _FOLDER.unpack_from(data, offset)
+            offset += _FOLDER.size
+
+            path = data[offset:offset+path_len].decode(_ENCODING, _ERRORS)
+            offset += path_len
+            names = data[offset:offset+names_len].decode(_ENCODING, _ERRORS)
+            offset += names_len
+
+            hashes_len = num_files * _HASH_SIZE
+            if offset + hashes_len > len(data):
+                raise SnapshotError("%s is truncated" % file_name)
+
+            hashes = array(HASH_TYPECODE)
+            hashes.frombytes(data[offset:offset+hashes_len])
+            if _SWAP_HASHES:
+                hashes.byteswap()
+            offset += hashes_len
+
+            num_names = names.count(NAME_SEPARATOR) + 1 if num_files else 0
+            if num_names != num_files or (names and not num_files) or len(path) == 0:
+                raise SnapshotError("%s is corrupt" % file_name)
+
+            file_index[(dev, ino)] = DirRecord.from_packed(path, num_files, names, hashes)
+    except struct.error:
+        raise SnapshotError("%s is truncated" % file_name)
+
+    if offset != len(data):
+        raise SnapshotError("%s has trailing data" % file_name)
+
+    if DEBUG:
+        print("%s: Read snapshot with %d folders from %s" %
+                    (PACKAGE_NAME, len(file_index), file_name))
+
+    return (file_index, bool(flags & FLAG_TWO_TIER))
+
+
+def remove_snapshot(db_location):
+    file_name = snapshot_path(db_location)
+    if os.path.exists(file_name):
+        os.remove(file_name)
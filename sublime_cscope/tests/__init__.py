@@ -2,3 +2,15 @@
 from .test_indexer import *
 from .test_event_listener import *
 from .test_cscope_results import *
+from .test_snapshot import *
+from .test_file_watcher import *
+from .test_git_index import *
+from .test_git_head_watcher import *
+from .test_pattern_matcher import *
+from .test_file_index import *
+from .test_file_guard import *
+from .test_ignore_files import *
+from .test_cancellation import *
+from .test_actor_stats import *
+from .test_process_loop import *
+from .test_cscope_runner import *
@@ -0,0 +1,51 @@
+import unittest
+
+from ..actor_stats import ActorStats, RollingHistogram
+
+
+class RollingHistogramTests(unittest.TestCase):
+
+    def test_percentiles(self):
+        hist = RollingHistogram()
+        self.assertEqual(hist.percentile(50), 0)
+        self.assertEqual(hist.max, 0)
+
+        for value in range(1, 101):
+            hist.add(value)
+
+        self.assertEqual(hist.count, 100)
+        self.assertEqual(hist.percentile(50), 51)
+        self.assertEqual(hist.percentile(90), 91)
+        self.assertEqual(hist.percentile(100), 100)
+        self.assertEqual(hist.max, 100)
+
+    def test_window(self):
+        hist = RollingHistogram(window=10)
+        for value in range(100):
+            hist.add(value)
+
+        # Only the recent samples count
+        self.assertEqual(len(hist), 10)
+        self.assertEqual(hist.count, 100)
+        self.assertEqual(hist.percentile(0), 90)
+        self.assertEqual(hist.sum, sum(range(90, 100)))
+
+
+class ActorStatsTests(unittest.TestCase):
+
+    def test_summary(self):
+        stats = ActorStats()
+        stats.record('promote_buffer', 0, 0.001, 0.002)
+        stats.record('_crawl_result_ready', 3, 0.5, 1.0)
+        stats.record('_crawl_result_ready', 1, 0.25, 2.0)
+        stats.record('tuple', 0, None, 0.001)
+
+        lines = stats.summary()
+        self.assertEqual(lines[0], "4 messages, mailbox depth p50 1, p90 3, max 3")
+
+        # The message taking the most time is listed first
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[1].split()[:2], ['_crawl_result_ready', '2'])
+        self.assertIn("wait p50 500.0ms", lines[1])
+        self.assertIn("run p50 2000.0ms", lines[1])
+        self.assertIn("wait p50 0.0ms", lines[3])
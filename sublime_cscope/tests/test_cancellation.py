@@ -0,0 +1,37 @@
+import unittest
+from unittest.mock import MagicMock
+
+from ..cancellation import CancelToken, Cancelled
+
+
+class CancelTokenTests(unittest.TestCase):
+
+    def test_cancel(self):
+        token = CancelToken()
+        self.assertFalse(token.cancelled)
+        token.check()
+
+        token.cancel()
+        token.cancel()
+        self.assertTrue(token.cancelled)
+        self.assertRaises(Cancelled, token.check)
+
+    def test_callbacks(self):
+        token = CancelToken()
+        callback = MagicMock()
+        removed = MagicMock()
+
+        token.add_callback(callback)
+        token.add_callback(removed)
+        token.remove_callback(removed)
+        self.assertFalse(callback.called)
+
+        token.cancel()
+        token.cancel()
+        callback.assert_called_once_with()
+        self.assertFalse(removed.called)
+
+        # Too late to wait for the cancel
+        late = MagicMock()
+        token.add_callback(late)
+        late.assert_called_once_with()
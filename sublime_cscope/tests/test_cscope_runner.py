@@ -0,0 +1,163 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+
+from .. import cscope_runner
+from .. import indexer
+from ..cancellation import CancelToken, Cancelled
+from ..process_loop import HAS_ASYNCIO
+
+# Prints two results for the database it is asked to query
+FAKE_CSCOPE = """#!%s
+import sys
+db = [a[2:] for a in sys.argv[1:] if a.startswith('-f')][0]
+for line in (1, 2):
+    print('/src/%%s.c func %%d text' %% (db, line))
+"""
+
+# Builds the database it is asked to build once all builds have started,
+# or never if sleep is set
+FAKE_CSCOPE_BUILD = """#!%s
+import glob, sys, time
+db = [a[2:] for a in sys.argv[1:] if a.startswith('-f')][0]
+open(db + '.started', 'w').close()
+while len(glob.glob('*.started')) < %d or %s:
+    time.sleep(0.01)
+open(db, 'w').close()
+"""
+
+
+@unittest.skipUnless(os.name == 'posix', "the fake cscope is a script")
+class CscopeQueryCommandTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_location = self.tmp_dir.name
+        self.cscope = os.path.join(self.db_location, 'cscope')
+
+        with open(self.cscope, 'w') as f:
+            f.write(FAKE_CSCOPE % sys.executable)
+        os.chmod(self.cscope, 0o755)
+
+        self.settings = {'cscope_path': self.cscope,
+                         'extra_include_folders': [],
+                         'maximum_results': 1000,
+                         'query_timeout': 10}
+
+        patches = [patch.object(cscope_runner.settings, 'get',
+                                lambda key, win: self.settings.get(key, None)),
+                   patch.object(indexer, 'get_db_location', lambda win: self.db_location),
+                   patch.object(cscope_runner, 'sublime')]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+        self.sublime = cscope_runner.sublime
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def query(self):
+        command = cscope_runner.CscopeQueryCommand('find_symbol', 'foo', win=MagicMock())
+        command.run()
+        return command.results.get_sorted_results()
+
+    def add_dbs(self, *names):
+        for name in names:
+            open(os.path.join(self.db_location, name + '.out'), 'w').close()
+
+    def test_shards(self):
+        self.add_dbs('secondary-0', 'secondary-1', 'secondary-2')
+
+        results = self.query()
+
+        self.assertEqual(sorted(results),
+                         [('/src/secondary-%d.out.c' % shard, line, 'func', 'text')
+                            for shard in range(3) for line in (1, 2)])
+
+    def test_unsharded_db_first(self):
+        self.add_dbs('secondary', 'secondary-0')
+
+        results = self.query()
+
+        self.assertEqual({r[0] for r in results}, {'/src/secondary.out.c'})
+
+    def test_shards_result_limit(self):
+        self.settings['maximum_results'] = 3
+        self.add_dbs('secondary-0', 'secondary-1', 'secondary-2')
+
+        self.assertEqual(self.query(), [])
+        self.assertEqual(self.sublime.error_message.call_count, 1)
+
+
+@unittest.skipUnless(os.name == 'posix' and HAS_ASYNCIO,
+                     "the fake cscope is a script, run on the process loop")
+class GenerateIndexesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_location = self.tmp_dir.name
+        self.cscope = os.path.join(self.db_location, 'cscope')
+        self.settings = {'cscope_path': self.cscope, 'extra_include_folders': []}
+
+        patches = [patch.object(cscope_runner.settings, 'get',
+                                lambda key, win: self.settings.get(key, None)),
+                   patch.object(cscope_runner, 'sublime')]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_cscope(self, num_builds, sleep=False):
+        with open(self.cscope, 'w') as f:
+            f.write(FAKE_CSCOPE_BUILD % (sys.executable, num_builds, sleep))
+        os.chmod(self.cscope, 0o755)
+
+    def test_builds_at_once(self):
+        names = ['secondary-%d' % i for i in range(5)]
+        self.write_cscope(len(names))
+
+        results = cscope_runner.generate_indexes(self.db_location, MagicMock(), names)
+
+        self.assertEqual(len(results), len(names))
+        for name in names:
+            self.assertTrue(os.path.exists(os.path.join(self.db_location, name + '.out')))
+
+    def test_cancel(self):
+        names = ['secondary-%d' % i for i in range(3)]
+        self.write_cscope(len(names), sleep=True)
+        cancel_token = CancelToken()
+
+        def cancel_when_started():
+            for _ in range(1000):
+                started = [n for n in os.listdir(self.db_location) if n.endswith('.started')]
+                if len(started) == len(names):
+                    break
+                threading.Event().wait(0.01)
+            cancel_token.cancel()
+
+        threading.Thread(target=cancel_when_started).start()
+
+        with self.assertRaises(Cancelled):
+            cscope_runner.generate_indexes(self.db_location, MagicMock(), names,
+                                           cancel_token=cancel_token)
+
+        self.assertFalse([n for n in os.listdir(self.db_location) if n.endswith('.out')])
+
+    def test_start_without_waiting(self):
+        names = ['secondary-%d' % i for i in range(2)]
+        self.write_cscope(len(names), sleep=True)
+        cancel_token = CancelToken()
+
+        build = cscope_runner.start_generate_indexes(self.db_location, MagicMock(), names,
+                                                     cancel_token=cancel_token)
+        self.assertFalse(build.done())
+
+        cancel_token.cancel()
+        with self.assertRaises(Cancelled):
+            build.result(10)
@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from .. import file_guard
+from ..file_guard import FileGuard
+from ..crawl_stats import CrawlStats
+
+
+class FileGuardTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_disabled(self):
+        self.assertFalse(FileGuard())
+        self.assertFalse(FileGuard(0, False, []))
+        self.assertEqual(FileGuard(10, True, ['@generated']),
+                         FileGuard(10, True, ['@generated', '@generated']))
+        self.assertNotEqual(FileGuard(10), FileGuard(11))
+
+    def test_max_size(self):
+        guard = FileGuard(max_size=100)
+
+        with patch('builtins.open') as mock_open:
+            self.assertIsNone(guard.check('/proj/small.c', 100, 1))
+            self.assertEqual(guard.check('/proj/large.h', 101, 1),
+                             file_guard.SKIPPED_TOO_LARGE % 100)
+            self.assertFalse(mock_open.called)
+
+    def test_content(self):
+        guard = FileGuard(skip_binary=True, generated_markers=['@generated'])
+        source = self.write('source.c', b'int main() { return 0; }\n')
+        binary = self.write('binary.c', b'\x7fELF\0\0\0')
+        generated = self.write('regs.h', b'/* @generated by regtool */\n#define X 1\n')
+        late_marker = self.write('late.h', b' ' * file_guard.SNIFF_SIZE + b'@generated')
+
+        self.assertIsNone(guard.check(source, 25, 1))
+        self.assertEqual(guard.check(binary, 7, 1), file_guard.SKIPPED_BINARY)
+        self.assertEqual(guard.check(generated, 40, 1),
+                         file_guard.SKIPPED_GENERATED % '@generated')
+        self.assertIsNone(guard.check(late_marker, file_guard.SNIFF_SIZE + 10, 1))
+        self.assertIsNone(guard.check(os.path.join(self.tmp_dir.name, 'gone.c'), 1, 1))
+
+    def test_sniff_cache(self):
+        guard = FileGuard(skip_binary=True)
+        path = self.write('main.c', b'int x;\n')
+        stats = CrawlStats()
+
+        self.assertIsNone(guard.check(path, 7, 1, stats))
+        self.assertIsNone(guard.check(path, 7, 1, stats))
+        self.assertEqual(stats.file_reads, 1)
+
+        # A new file hash means the file changed
+        self.write('main.c', b'\0')
+        self.assertEqual(guard.check(path, 1, 2, stats), file_guard.SKIPPED_BINARY)
+        self.assertEqual(stats.file_reads, 2)
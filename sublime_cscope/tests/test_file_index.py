@@ -0,0 +1,237 @@
+import hashlib
+import unittest
+from unittest.mock import patch
+
+from .. import file_index
+from ..file_index import DirRecord, InodeSet
+
+
+class DirRecordTests(unittest.TestCase):
+
+    def test_files(self):
+        record = DirRecord('/proj/src', ['main.c', 'file with spaces.h'], [125, 3])
+
+        self.assertEqual(record.path, '/proj/src')
+        self.assertEqual(record.num_files, 2)
+        self.assertEqual(record.files, ['main.c', 'file with spaces.h'])
+        self.assertEqual(record.items(), {'main.c': 125, 'file with spaces.h': 3})
+        self.assertIn('main.c', record)
+        self.assertNotIn('main', record)
+
+    def test_empty(self):
+        record = DirRecord('/proj/empty')
+
+        self.assertEqual(record.num_files, 0)
+        self.assertEqual(record.files, [])
+        self.assertNotIn('', record)
+
+    def test_equality(self):
+        record = DirRecord('/proj/src', ['main.c'], [125])
+
+        self.assertEqual(record, DirRecord('/proj/src', ['main.c'], [125]))
+        self.assertNotEqual(record, DirRecord('/proj/src', ['util.c'], [125]))
+        self.assertNotEqual(record, DirRecord('/proj/src', ['main.c'], [13]))
+        self.assertNotEqual(record, DirRecord('/proj/lib', ['main.c'], [125]))
+
+        packed = DirRecord.from_packed('/proj/src', 1, record.packed_files, record.hashes)
+        self.assertEqual(record, packed)
+
+    def test_count_files(self):
+        index = {(1, 1): DirRecord('/a', ['x.c', 'y.c'], [0, 0]),
+                 (1, 2): DirRecord('/b'),
+                 (2, 1): DirRecord('/c', ['z.c'], [0])}
+
+        self.assertEqual(file_index.count_files(index), 3)
+
+    def test_file_hash(self):
+        # the old magic value (size + mtime) could not tell these apart
+        self.assertNotEqual(file_index.file_hash(1000 * 10**9, 11, 5),
+                            file_index.file_hash(1001 * 10**9, 10, 5))
+        self.assertEqual(file_index.file_hash(10**9, 10, 5),
+                         file_index.file_hash(10**9, 10, 5))
+
+    @unittest.skipUnless(hasattr(hashlib, 'blake2b'), "hashed with sha1")
+    def test_file_hash_is_stable(self):
+        # Persisted in snapshots, so it must not change between sessions
+        self.assertEqual(file_index.file_hash(10**9, 10, 5), 12089553657365328399)
+        self.assertEqual(file_index.file_hash(-1, 0, 2**64 - 1), 15688089297175504034)
+
+    def test_digest(self):
+        record = DirRecord('/proj/src', ['main.c', 'util.c'], [1, 2])
+
+        self.assertEqual(record.digest, DirRecord('/other', ['main.c', 'util.c'], [1, 2]).digest)
+        self.assertNotEqual(record.digest, DirRecord('/proj/src', ['main.c', 'util.c'], [1, 3]).digest)
+        self.assertNotEqual(record.digest, DirRecord('/proj/src', ['main.c', 'utils.c'], [1, 2]).digest)
+
+
+class MerkleTreeTests(unittest.TestCase):
+
+    def gen_index(self, changes={}):
+        index = {}
+        ino = 0
+        for top in range(3):
+            for sub in range(3):
+                ino += 1
+                path = '/proj/top%d/sub%d' % (top, sub)
+                index[(1, ino)] = DirRecord(path, ['a.c'], [changes.get(path, 1)])
+            ino += 1
+            index[(1, ino)] = DirRecord('/proj/top%d' % top)
+        index[(1, 0)] = DirRecord('/proj', ['main.c'], [1])
+        return index
+
+    def test_tree_hashes(self):
+        old_tree = file_index.MerkleTree(self.gen_index())
+        new_tree = file_index.MerkleTree(self.gen_index({'/proj/top1/sub2': 2}))
+
+        self.assertEqual(old_tree.roots, ['/proj'])
+        self.assertEqual(sorted(old_tree.children('/proj/top1')),
+                         ['/proj/top1/sub%d' % i for i in range(3)])
+
+        for path in ('/proj', '/proj/top1', '/proj/top1/sub2'):
+            self.assertNotEqual(old_tree.tree_hash(path), new_tree.tree_hash(path))
+
+        for path in ('/proj/top0', '/proj/top2', '/proj/top1/sub0'):
+            self.assertEqual(old_tree.tree_hash(path), new_tree.tree_hash(path))
+
+    def test_changed_folders_descends_only_into_changed_trees(self):
+        old_tree = file_index.MerkleTree(self.gen_index())
+        new_tree = file_index.MerkleTree(self.gen_index({'/proj/top1/sub2': 2}))
+
+        with patch.object(old_tree, 'children', wraps=old_tree.children) as mock_children:
+            changed = file_index.changed_folders(old_tree, new_tree)
+
+        self.assertEqual(changed, ['/proj/top1/sub2'])
+        visited = sorted(c[0][0] for c in mock_children.call_args_list)
+        self.assertEqual(visited, ['/proj', '/proj/top1', '/proj/top1/sub2'])
+
+    def assertSameTree(self, tree, index):
+        expected = file_index.MerkleTree(index)
+        self.assertEqual(tree.roots, expected.roots)
+        for record in index.values():
+            self.assertEqual(tree.tree_hash(record.path), expected.tree_hash(record.path))
+            self.assertEqual(sorted(tree.children(record.path)),
+                             sorted(expected.children(record.path)))
+
+    def test_update(self):
+        tree = file_index.MerkleTree(self.gen_index())
+        index = self.gen_index({'/proj/top1/sub2': 2})
+        del index[(1, 4)]
+        index[(1, 20)] = DirRecord('/proj/top0/sub0/new', ['b.c'], [1])
+
+        with patch.object(tree, '_hash', wraps=tree._hash) as mock_hash:
+            tree.update([r for r in index.values() if r.path.startswith('/proj/top1')] +
+                        [index[(1, 20)]],
+                        removed=['/proj/top0'])
+
+        # Only the changed folders and their parents are hashed again
+        self.assertEqual(sorted(c[0][0] for c in mock_hash.call_args_list),
+                         ['/proj', '/proj/top0/sub0', '/proj/top0/sub0/new',
+                          '/proj/top1', '/proj/top1/sub2'])
+        self.assertSameTree(tree, index)
+
+    def test_update_adopts_sub_folders(self):
+        index = self.gen_index()
+        tree = file_index.MerkleTree({k: r for k, r in index.items() if r.path != '/proj'})
+        self.assertEqual(tree.roots, ['/proj/top%d' % i for i in range(3)])
+
+        tree.update([index[(1, 0)]])
+        self.assertSameTree(tree, index)
+
+        tree.update([], removed=['/proj'])
+        self.assertEqual(tree.roots, ['/proj/top%d' % i for i in range(3)])
+
+
+class IndexDeltaTests(unittest.TestCase):
+
+    def setUp(self):
+        self.old_index = {
+            (1, 1): DirRecord('/proj', ['a.c', 'b.c', 'c.c'], [1, 2, 3]),
+            (1, 2): DirRecord('/proj/same', ['x.c'], [1]),
+            (1, 3): DirRecord('/proj/gone', ['y.c'], [1]),
+            (1, 4): DirRecord('/proj/old_name', ['z.c'], [1])
+        }
+
+    def test_no_changes(self):
+        delta = file_index.diff_index(self.old_index, dict(self.old_index))
+
+        self.assertFalse(delta)
+        self.assertFalse(delta.files_changed)
+
+    def test_changes(self):
+        new_index = {
+            (1, 1): DirRecord('/proj', ['a.c', 'c.c', 'd.c'], [1, 4, 1]),
+            (1, 2): DirRecord('/proj/same', ['x.c'], [1]),
+            (1, 4): DirRecord('/proj/new_name', ['z.c'], [1]),
+            (1, 5): DirRecord('/proj/empty')
+        }
+
+        delta = file_index.diff_index(self.old_index, new_index)
+
+        self.assertTrue(delta.files_changed)
+        self.assertTrue(delta.file_set_changed)
+        self.assertEqual(sorted(delta.added), ['/proj/d.c', '/proj/new_name/z.c'])
+        self.assertEqual(sorted(delta.removed), ['/proj/b.c', '/proj/gone/y.c',
+                                                 '/proj/old_name/z.c'])
+        self.assertEqual(delta.modified, ['/proj/c.c'])
+        self.assertIn('/proj/empty', [d.path for d in delta.folders])
+
+    def test_only_modified(self):
+        new_index = dict(self.old_index)
+        new_index[(1, 2)] = DirRecord('/proj/same', ['x.c'], [2])
+
+        delta = file_index.diff_index(self.old_index, new_index)
+
+        self.assertTrue(delta.files_changed)
+        self.assertFalse(delta.file_set_changed)
+        self.assertEqual(delta.modified, ['/proj/same/x.c'])
+
+    def test_partial_diff(self):
+        new_index = {(1, 3): DirRecord('/proj/gone', ['y.c', 'w.c'], [1, 1])}
+        old_part = {(1, 3): self.old_index[(1, 3)]}
+
+        # The tree of the whole index is compared from the folders in old_part
+        delta = file_index.diff_index(old_part, new_index,
+                                      old_tree=file_index.MerkleTree(self.old_index))
+
+        self.assertEqual(delta.added, ['/proj/gone/w.c'])
+        self.assertEqual(delta.removed, [])
+
+    def test_empty_folder_added(self):
+        new_index = dict(self.old_index)
+        new_index[(1, 5)] = DirRecord('/proj/empty')
+
+        delta = file_index.diff_index(self.old_index, new_index)
+
+        self.assertTrue(delta)
+        self.assertFalse(delta.files_changed)
+
+
+class InodeSetTests(unittest.TestCase):
+
+    def test_membership(self):
+        inodes = InodeSet()
+        count = file_index.MIN_PENDING_INODES * 3
+
+        for ino in range(count, 0, -1):
+            inodes.add((1, ino * 2))
+        inodes.add((1, 2))
+
+        self.assertEqual(len(inodes), count)
+        self.assertIn((1, 2), inodes)
+        self.assertIn((1, count * 2), inodes)
+        self.assertNotIn((1, 3), inodes)
+        self.assertNotIn((1, count * 2 + 2), inodes)
+        self.assertNotIn((2, 2), inodes)
+
+    def test_large_inodes(self):
+        inodes = InodeSet()
+        huge = 2 ** 100
+
+        for ino in range(file_index.MIN_PENDING_INODES):
+            inodes.add((1, ino))
+        inodes.add((1, huge))
+        inodes.add((1, -1))
+
+        self.assertIn((1, huge), inodes)
+        self.assertIn((1, -1), inodes)
+        self.assertIn((1, 0), inodes)
@@ -0,0 +1,123 @@
+
+import os
+import queue
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from .. import file_watcher
+from .. import watch_thread
+
+_libc_to_mock = 'SublimeCscope.sublime_cscope.file_watcher._libc'
+
+
+class FileWatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.realpath(self.tmp_dir.name)
+        self.sub = os.path.join(self.root, 'sub')
+        os.mkdir(self.sub)
+
+        self.changes = queue.Queue()
+        self.watcher = None
+
+    def tearDown(self):
+        if self.watcher:
+            self.watcher.stop()
+        self.tmp_dir.cleanup()
+
+    def start_watcher(self):
+        name_filter = lambda name: name.endswith('.c')
+        self.watcher = file_watcher.FileWatcher(self.changes.put,
+                                                name_filter=name_filter,
+                                                coalesce_delay=0.1,
+                                                poll_interval=0.1)
+        self.watcher.start()
+        self.watcher.set_folders([self.root, self.sub])
+
+    def touch(self, *path):
+        with open(os.path.join(*path), 'w') as f:
+            f.write('x')
+
+    @unittest.skipUnless(file_watcher.inotify_available(), "inotify not available")
+    def test_inotify(self):
+        self.start_watcher()
+        self.assertEqual(self.watcher.num_watched, 2)
+        self.assertEqual(self.watcher.num_polled, 0)
+
+        # Files that don't pass the name filter should be ignored
+        self.touch(self.root, 'ignored.o')
+        self.touch(self.sub, 'file1.c')
+        self.touch(self.sub, 'file2.c')
+
+        # The changes should be coalesced into one notification
+        self.assertEqual(self.changes.get(timeout=5), {self.sub})
+        self.assertTrue(self.changes.empty())
+
+        os.mkdir(os.path.join(self.root, 'new_folder'))
+        self.assertEqual(self.changes.get(timeout=5), {self.root})
+
+    @unittest.skipUnless(file_watcher.inotify_available(), "inotify not available")
+    def test_files_written(self):
+        self.touch(self.sub, 'file1.c')
+        self.written = queue.Queue()
+        self.watcher = file_watcher.FileWatcher(self.changes.put,
+                                                name_filter=lambda name: name.endswith('.c'),
+                                                coalesce_delay=0.1,
+                                                on_write=self.written.put)
+        self.watcher.start()
+        self.watcher.set_folders([self.root, self.sub])
+
+        # Writing an existing file is reported as a file
+        self.touch(self.sub, 'file1.c')
+        self.assertEqual(self.written.get(timeout=5), {os.path.join(self.sub, 'file1.c')})
+        self.assertTrue(self.changes.empty())
+
+        # Unless files were added to its folder as well
+        self.touch(self.sub, 'file1.c')
+        self.touch(self.sub, 'file2.c')
+        self.assertEqual(self.changes.get(timeout=5), {self.sub})
+        self.assertTrue(self.written.empty())
+
+    def test_polling_fallback(self):
+        with patch(_libc_to_mock, None):
+            self.start_watcher()
+            self.assertEqual(self.watcher.num_watched, 0)
+            self.assertEqual(self.watcher.num_polled, 2)
+
+            # make sure the mtime of the folder changes
+            st = os.stat(self.sub)
+            os.utime(self.sub, ns=(st.st_atime_ns, st.st_mtime_ns - 10**9))
+            self.watcher.set_folders([self.root])
+            self.watcher.set_folders([self.root, self.sub])
+
+            self.touch(self.sub, 'file1.c')
+            self.assertEqual(self.changes.get(timeout=5), {self.sub})
+
+    def test_set_folders(self):
+        self.start_watcher()
+        self.watcher.set_folders([self.sub, os.path.join(self.root, 'missing')])
+
+        self.assertEqual(self.watcher.num_watched + self.watcher.num_polled, 1)
+
+    def test_shared_thread(self):
+        thread = watch_thread.WatchThread()
+        watchers = [file_watcher.FileWatcher(self.changes.put, coalesce_delay=0.1,
+                                             watch_thread=thread)
+                    for _ in range(3)]
+        for watcher in watchers:
+            watcher.start()
+            watcher.set_folders([self.root])
+
+        self.assertEqual(thread.num_watchers, 3)
+        worker = thread._thread
+        self.touch(self.root, 'file1.c')
+        self.assertEqual([self.changes.get(timeout=5) for _ in watchers], [{self.root}] * 3)
+
+        # The thread exits once the last watcher is stopped
+        for watcher in watchers:
+            watcher.stop()
+        worker.join(5)
+        self.assertFalse(worker.is_alive())
+        self.assertIsNone(thread._thread)
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from .. import git_head_watcher
+
+GIT = shutil.which('git')
+
+
+@unittest.skipUnless(GIT, "git is not installed")
+class GitHeadWatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.realpath(self.tmp_dir.name)
+        self.changes = []
+
+        self.git('init', '-q')
+        self.write('main.c', 'src/util.c', 'src/deep/a.c', 'lib/b.c', 'doc/readme.c')
+        self.commit('initial')
+
+        self.watcher = git_head_watcher.GitHeadWatcher(self.changes.append, GIT)
+
+    def tearDown(self):
+        self.watcher.stop()
+        self.tmp_dir.cleanup()
+
+    def git(self, *args):
+        subprocess.check_call((GIT, '-c', 'user.name=test', '-c', 'user.email=test@test') +
+                              args, cwd=self.root,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def write(self, *rel_paths):
+        for rel_path in rel_paths:
+            path = os.path.join(self.root, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'a') as f:
+                f.write(rel_path)
+
+    def commit(self, message):
+        self.git('add', '-A')
+        self.git('commit', '-q', '-m', message)
+
+    def test_checkout(self):
+        self.watcher.set_folders([os.path.join(self.root, 'src'),
+                                  os.path.join(self.root, 'lib')])
+        self.assertEqual(self.watcher.num_repos, 1)
+
+        # The first poll records HEAD
+        self.watcher.poll()
+        self.assertEqual(self.changes, [])
+
+        self.git('checkout', '-q', '-b', 'topic')
+        self.watcher.poll()
+        self.assertEqual(self.changes, [])
+
+        self.write('src/deep/a.c', 'src/deep/new.c', 'doc/readme.c', 'main.c')
+        os.remove(os.path.join(self.root, 'lib', 'b.c'))
+        self.commit('topic')
+        self.watcher.poll()
+
+        # Folders outside of the watched folders are not reported
+        self.assertEqual(self.changes, [{os.path.join(self.root, 'src', 'deep'),
+                                         os.path.join(self.root, 'lib')}])
+
+        self.git('checkout', '-q', '-')
+        self.watcher.poll()
+        self.assertEqual(len(self.changes), 2)
+        self.assertEqual(self.changes[1], self.changes[0])
+
+        self.watcher.poll()
+        self.assertEqual(len(self.changes), 2)
+
+    def test_not_a_repository(self):
+        with tempfile.TemporaryDirectory() as other:
+            self.watcher.set_folders([other])
+
+        self.assertEqual(self.watcher.num_repos, 0)
+
+    def test_find_git(self):
+        self.assertEqual(git_head_watcher.find_git(), GIT)
+        self.assertEqual(git_head_watcher.find_git(os.path.join(self.root, 'missing')), GIT)
@@ -0,0 +1,153 @@
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+from unittest.mock import MagicMock
+
+from .. import git_index
+from .. import indexer
+from ..cancellation import CancelToken, Cancelled
+from ..crawl_stats import CrawlStats
+
+HAS_GIT = shutil.which('git') is not None
+
+
+@unittest.skipUnless(HAS_GIT, "git is not installed")
+class GitIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.realpath(self.tmp_dir.name)
+
+        self.mconfig = MagicMock(indexer.IndexerConfig)
+        self.mconfig.file_name_matches.side_effect = self.mock_file_name_matches
+        self.mconfig.folder_name_matches.side_effect = self.mock_folder_name_matches
+
+        for rel_path in ('main.c', 'main.o', 'src/util.c', 'src/deep/a long name.c',
+                         'src/deep/b.c', 'out/generated.c'):
+            path = os.path.join(self.root, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(rel_path)
+
+        self.git('init', '-q')
+        self.git('add', '.')
+
+        with open(os.path.join(self.root, 'src', 'untracked.c'), 'w') as f:
+            f.write('untracked')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def git(self, *args):
+        subprocess.check_call(('git',) + args, cwd=self.root,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def mock_file_name_matches(self, dirpath, file_name, base_path, stats=None):
+        return file_name.endswith('.c')
+
+    def mock_folder_name_matches(self, dirpath, folder, base_path, stats=None):
+        return folder not in ('out', '.git')
+
+    def crawl(self, file_enumeration):
+        self.mconfig.file_enumeration.return_value = file_enumeration
+        crawler = indexer.Crawler()
+        crawler.start()
+
+        try:
+            result, _ = crawler.crawl(self.mconfig, None, wait_for_result=True)
+        finally:
+            crawler.quit()
+
+        return {v.path: v.items() for v in result.values()}
+
+    def test_find_git_dir(self):
+        sub = os.path.join(self.root, 'src', 'deep')
+        self.assertEqual(git_index.find_git_dir(sub),
+                         (self.root, os.path.join(self.root, '.git')))
+
+    def test_read_index(self):
+        for version in ('2', '3', '4'):
+            self.git('update-index', '--index-version', version)
+            entries = git_index.read_git_index(os.path.join(self.root, '.git'))
+            paths = [e.path for e in entries]
+
+            self.assertEqual(paths, ['main.c', 'main.o', 'out/generated.c',
+                                     'src/deep/a long name.c', 'src/deep/b.c',
+                                     'src/util.c'])
+
+            st = os.stat(os.path.join(self.root, 'src', 'util.c'))
+            util = entries[paths.index('src/util.c')]
+            self.assertEqual(util.size, st.st_size)
+            self.assertEqual(util.mtime_ns, st.st_mtime_ns)
+
+    def test_invalid_index(self):
+        with open(os.path.join(self.root, '.git', 'index'), 'r+b') as f:
+            f.truncate(40)
+
+        with self.assertRaises(git_index.GitIndexError):
+            git_index.read_git_index(os.path.join(self.root, '.git'))
+
+    def test_same_result_as_file_system(self):
+        self.mconfig.base_paths.return_value = [(self.root, True)]
+        self.mconfig.crawler_engine = indexer.CRAWLER_ENGINE_WALK
+
+        fs_result = self.crawl(indexer.FILE_ENUMERATION_FILESYSTEM)
+
+        for version in ('2', '4'):
+            self.git('update-index', '--index-version', version)
+            git_result = self.crawl(indexer.FILE_ENUMERATION_GIT)
+
+            self.assertIn('untracked.c', git_result[os.path.join(self.root, 'src')])
+            self.assertEqual(git_result, fs_result)
+
+    def test_not_a_repository(self):
+        shutil.rmtree(os.path.join(self.root, '.git'))
+        result = {}
+
+        self.assertFalse(git_index.crawl_folder(self.root, self.root, True,
+                                                self.mconfig, result))
+        self.assertEqual(result, {})
+
+    def test_folder_cache(self):
+        # Make sure the folders are not considered racy by the crawler
+        for path, _, _ in os.walk(self.root):
+            os.utime(path, (1000000000, 1000000000))
+
+        folder_cache = {}
+
+        def crawl():
+            result = {}
+            stats = CrawlStats()
+            self.assertTrue(git_index.crawl_folder(self.root, self.root, True, self.mconfig,
+                                                   result, stats, folder_cache=folder_cache))
+            return {v.path: sorted(v.files) for v in result.values()}, stats
+
+        first, stats = crawl()
+        # The root, src and src/deep, out is rejected by name
+        self.assertEqual(stats.listdir_calls, 3)
+
+        second, stats = crawl()
+        self.assertEqual(second, first)
+        self.assertEqual(stats.listdir_calls, 0)
+
+        src = os.path.join(self.root, 'src')
+        with open(os.path.join(src, 'new.c'), 'w') as f:
+            f.write('new')
+
+        third, stats = crawl()
+        self.assertEqual(stats.listdir_calls, 1)
+        self.assertEqual(third[src], ['new.c', 'untracked.c', 'util.c'])
+
+        shutil.rmtree(os.path.join(src, 'deep'))
+        crawl()
+        self.assertNotIn(os.path.join(src, 'deep'), folder_cache)
+
+    def test_cancel(self):
+        token = CancelToken()
+        token.cancel()
+
+        with self.assertRaises(Cancelled):
+            git_index.crawl_folder(self.root, self.root, True, self.mconfig, {},
+                                   cancel_token=token)
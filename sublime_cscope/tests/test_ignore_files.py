@@ -0,0 +1,158 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from .. import ignore_files
+from ..ignore_files import IgnoreFiles
+from ..crawl_stats import CrawlStats
+
+
+def _ignored(lines, rel_path, is_dir=False):
+    for regex, negated, dir_only in reversed(ignore_files.parse_ignore_file(lines)):
+        if dir_only and not is_dir:
+            continue
+        if regex.match(rel_path):
+            return not negated
+    return False
+
+
+class ParseIgnoreFileTests(unittest.TestCase):
+
+    def test_patterns(self):
+        self.assertTrue(_ignored(['*.o'], 'src/main.o'))
+        self.assertFalse(_ignored(['*.o'], 'src/main.c'))
+        self.assertTrue(_ignored(['build'], 'sub/build', is_dir=True))
+        self.assertTrue(_ignored(['build/'], 'build', is_dir=True))
+        self.assertFalse(_ignored(['build/'], 'build'))
+        self.assertTrue(_ignored(['/out'], 'out'))
+        self.assertFalse(_ignored(['/out'], 'sub/out'))
+        self.assertTrue(_ignored(['doc/*.c'], 'doc/x.c'))
+        self.assertFalse(_ignored(['doc/*.c'], 'doc/sub/x.c'))
+        self.assertFalse(_ignored(['doc/*.c'], 'sub/doc/x.c'))
+        self.assertTrue(_ignored(['**/gen'], 'a/b/gen', is_dir=True))
+        self.assertTrue(_ignored(['a/**/b.c'], 'a/b.c'))
+        self.assertTrue(_ignored(['a/**/b.c'], 'a/x/y/b.c'))
+        self.assertTrue(_ignored(['vendor/**'], 'vendor/lib/x.c'))
+        self.assertTrue(_ignored(['file?.c'], 'file1.c'))
+        self.assertFalse(_ignored(['file?.c'], 'file/.c'))
+
+    def test_comments_and_escapes(self):
+        self.assertEqual(ignore_files.parse_ignore_file(['# comment\n', '\n', '/\n']), [])
+        self.assertTrue(_ignored(['\\#hash.c'], '#hash.c'))
+        self.assertTrue(_ignored(['\\!bang.c'], '!bang.c'))
+        self.assertTrue(_ignored(['star\\*.c'], 'star*.c'))
+        self.assertFalse(_ignored(['star\\*.c'], 'stars.c'))
+        self.assertTrue(_ignored(['trailing.c   \n'], 'trailing.c'))
+        self.assertTrue(_ignored(['space\\ '], 'space '))
+
+    def test_negation(self):
+        lines = ['*.c', '!keep.c', 'keep.c.bak', 'secret/keep.c']
+
+        self.assertTrue(_ignored(lines, 'main.c'))
+        self.assertFalse(_ignored(lines, 'keep.c'))
+        self.assertTrue(_ignored(lines, 'secret/keep.c'))
+        self.assertEqual(len(ignore_files.parse_ignore_file(lines)), 3)
+
+
+class IgnoreFilesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.realpath(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, rel_path, lines, mtime_ns=None):
+        path = os.path.join(self.root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        if mtime_ns:
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def test_disabled(self):
+        self.assertFalse(IgnoreFiles(()))
+        self.assertTrue(IgnoreFiles())
+        self.assertEqual(IgnoreFiles(), IgnoreFiles())
+        self.assertNotEqual(IgnoreFiles(), IgnoreFiles(['.gitignore']))
+
+    def test_hierarchy(self):
+        self.write('.gitignore', ['*.o', 'build/', 'gen*'])
+        self.write('.ignore', ['!generated.c'])
+        self.write(os.path.join('src', '.gitignore'), ['!*.o', '/local.c'])
+        ignore = IgnoreFiles()
+        src = os.path.join(self.root, 'src')
+
+        self.assertTrue(ignore.is_ignored(self.root, 'main.o', False, self.root))
+        self.assertFalse(ignore.is_ignored(self.root, 'main.c', False, self.root))
+        self.assertFalse(ignore.is_ignored(self.root, 'generated.c', False, self.root))
+        self.assertTrue(ignore.is_ignored(self.root, 'build', True, self.root))
+        self.assertFalse(ignore.is_ignored(self.root, 'local.c', False, self.root))
+        self.assertFalse(ignore.is_ignored(src, 'main.o', False, self.root))
+        self.assertTrue(ignore.is_ignored(src, 'local.c', False, self.root))
+        self.assertFalse(ignore.is_ignored(os.path.join(src, 'sub'), 'local.c',
+                                           False, self.root))
+
+        # Everything in an ignored folder is ignored, even if the folder
+        # was never crawled, as for a file opened in a buffer
+        build = os.path.join(self.root, 'build', 'sub')
+        self.assertTrue(ignore.is_ignored(build, 'main.c', False, self.root))
+
+        # Ignore files above the base path do not apply
+        self.assertFalse(ignore.is_ignored(src, 'main.c', False, src))
+        self.assertFalse(ignore.is_ignored(src, 'gen.c', False, src))
+
+    def test_cache(self):
+        self.write('.gitignore', ['*.o'], mtime_ns=10**18)
+        ignore = IgnoreFiles()
+
+        with patch.object(ignore_files, 'parse_ignore_file',
+                          wraps=ignore_files.parse_ignore_file) as mock_parse:
+            self.assertTrue(ignore.is_ignored(self.root, 'x.o', False, self.root))
+            ignore.revalidate()
+            self.assertTrue(ignore.is_ignored(self.root, 'x.o', False, self.root))
+            self.assertEqual(mock_parse.call_count, 1)
+
+            # Not picked up until the next crawl
+            self.write('.gitignore', ['*.c'], mtime_ns=2 * 10**18)
+            self.assertTrue(ignore.is_ignored(self.root, 'x.o', False, self.root))
+
+            ignore.revalidate()
+            self.assertFalse(ignore.is_ignored(self.root, 'x.o', False, self.root))
+            self.assertTrue(ignore.is_ignored(self.root, 'x.c', False, self.root))
+            self.assertEqual(mock_parse.call_count, 2)
+
+            os.remove(os.path.join(self.root, '.gitignore'))
+            ignore.revalidate()
+            self.assertFalse(ignore.is_ignored(self.root, 'x.c', False, self.root))
+
+    def test_unchanged_folders(self):
+        self.write('.gitignore', ['*.o'], mtime_ns=10**18)
+        src = os.path.join(self.root, 'src')
+        os.mkdir(src)
+        ignore = IgnoreFiles()
+
+        def crawl(folder_mtime):
+            stats = CrawlStats()
+            ignore.revalidate()
+            ignore.folder_visited(self.root, folder_mtime)
+            ignore.folder_visited(src, folder_mtime)
+            self.assertTrue(ignore.is_ignored(src, 'x.o', False, self.root, stats))
+            return stats
+
+        stats = crawl(10**18)
+        self.assertEqual((stats.stat_calls, stats.file_reads), (4, 1))
+
+        # Only the ignore file that exists is checked for in place changes
+        stats = crawl(10**18)
+        self.assertEqual((stats.stat_calls, stats.file_reads), (1, 0))
+
+        stats = crawl(2 * 10**18)
+        self.assertEqual((stats.stat_calls, stats.file_reads), (4, 0))
+
+        # Folders modified right before they were visited are not trusted
+        ignore = IgnoreFiles()
+        crawl(os.stat(self.root).st_mtime_ns)
+        self.assertEqual(crawl(os.stat(self.root).st_mtime_ns).stat_calls, 4)
@@ -1,28 +1,47 @@
 
 import os
+import time
+import tempfile
 import threading
 import unittest
 import itertools
+from concurrent import futures
+from functools import partial
 from unittest.mock import call, patch, MagicMock
 
 
 from .. import indexer
+from ..file_index import DirRecord, MerkleTree, file_hash
+from ..file_guard import FileGuard
+from ..ignore_files import IgnoreFiles
+from ..pattern_matcher import FolderConfigMatcher
+from ..crawl_stats import CrawlStats
+from ..cancellation import CancelToken, Cancelled
 
 _indexer_package_path = 'SublimeCscope.sublime_cscope.indexer'
 _indexer_to_mock = _indexer_package_path + '.Indexer'
 _indexer_config_to_mock = _indexer_package_path + '.IndexerConfig'
 _sublime_to_mock = _indexer_package_path + '.sublime'
 _os_to_mock = _indexer_package_path + '.os'
+_scandir_to_mock = 'SublimeCscope.sublime_cscope.scandir_crawler.os.scandir'
+_network_mount_to_mock = 'SublimeCscope.sublime_cscope.scandir_crawler.is_network_mount'
 
 DUMMY_FILE_ST_MODE = 33188
 DUMMY_FOLDER_ST_MODE = 16877
 DUMMY_SYMLINK_ST_MODE = 41471
+DUMMY_ST_DEV = 2049
+
+
+def _done_future(result=None):
+    future = futures.Future()
+    future.set_result(result)
+    return future
 
 
 class TestActor(indexer.ActorBase):
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, scheduler=None):
+        super().__init__(scheduler=scheduler)
         self.request = []
         self.recv_response = []
         self.sent_response = []
@@ -53,6 +72,30 @@ class TestActor(indexer.ActorBase):
         self.recv_response.append(resp)
         self.recv_response_event.set()
 
+    @indexer.send_msg
+    def block(self, started, release):
+        started.set()
+        release.wait(5)
+
+    @indexer.send_msg
+    def plain_request(self, value):
+        self.request.append(value)
+        return value
+
+    @indexer.send_msg(priority=indexer.PRIORITY_HIGH)
+    def urgent_request(self, value):
+        self.request.append(value)
+        return value
+
+    @indexer.send_msg(coalesce=indexer.same_args)
+    def coalesced_request(self, value):
+        self.request.append(value)
+        return value
+
+    @indexer.send_msg
+    def failing_request(self):
+        raise ValueError("failed")
+
 
 
 class ActorTests(unittest.TestCase):
@@ -150,15 +193,791 @@ class ActorTests(unittest.TestCase):
         self.assertEqual(req['requester_id'], self.actor1_id, "Requester ID did not come through")
         self.assertEqual(req['receiver_id'], self.actor1_id, "Request was not recieved by correct actor")
 
+    def test_priority_and_coalescing(self):
+        started = threading.Event()
+        release = threading.Event()
+        results = []
+
+        # Keep the actor busy until every sender is done
+        self.testActor1.block(started, release)
+        self.assertTrue(started.wait(5))
+
+        def send(i):
+            self.testActor1.plain_request('normal%d' % i, result_callback=results.append)
+            for _ in range(10):
+                self.testActor1.coalesced_request('crawl', result_callback=results.append)
+            self.testActor1.urgent_request('urgent%d' % i, result_callback=results.append)
+
+        senders = [threading.Thread(target=send, args=(i,)) for i in range(4)]
+        for t in senders:
+            t.start()
+        for t in senders:
+            t.join()
+
+        self.assertEqual(len(self.testActor1._mailbox), 4 + 4 + 1)
+        release.set()
+        self.assertEqual(self.testActor1.plain_request('last', wait_for_result=True), 'last')
+
+        executed = self.testActor1.request
+        self.assertEqual(sorted(executed[:4]), ['urgent%d' % i for i in range(4)])
+        # The coalesced message takes the place of the last one sent
+        self.assertEqual(sorted(executed[4:8]), ['normal%d' % i for i in range(4)])
+        self.assertEqual(executed[8:], ['crawl', 'last'])
+
+        # The senders of the coalesced messages all got the result
+        self.assertEqual(results.count('crawl'), 40)
+        self.assertEqual(len(results), 48)
+
+    def test_unhashable_args_not_coalesced(self):
+        started = threading.Event()
+        release = threading.Event()
+        self.testActor1.block(started, release)
+        self.assertTrue(started.wait(5))
+
+        for _ in range(3):
+            self.testActor1.coalesced_request(['not', 'hashable'])
+            self.testActor1.coalesced_request(('hashable',))
+
+        self.assertEqual(len(self.testActor1._mailbox), 4)
+        release.set()
+        self.testActor1.plain_request('last', wait_for_result=True)
+
+    def test_quit_after_pending_messages(self):
+        started = threading.Event()
+        release = threading.Event()
+        self.testActor1.block(started, release)
+        self.assertTrue(started.wait(5))
+
+        self.testActor1.plain_request('pending')
+        self.testActor1._close()
+        self.testActor1.urgent_request('urgent')
+        release.set()
+        self.testActor1._join()
+
+        self.assertEqual(self.testActor1.request, ['urgent', 'pending'])
+
+
+    def test_future(self):
+        future = self.testActor1.plain_request('value')
+        self.assertEqual(future.result(5), 'value')
+
+        done = threading.Event()
+        future.add_done_callback(lambda f: done.set())
+        self.assertTrue(done.is_set())
+
+        self.assertRaises(ValueError, self.testActor1.failing_request, wait_for_result=True)
+
+    def test_timeout_and_cancel(self):
+        started = threading.Event()
+        release = threading.Event()
+        self.testActor1.block(started, release)
+        self.assertTrue(started.wait(5))
+
+        with self.assertRaises(indexer.futures.TimeoutError):
+            self.testActor1.plain_request('timed out', wait_for_result=True, timeout=0.01)
+
+        future = self.testActor1.plain_request('cancelled')
+        self.assertTrue(future.cancel())
+
+        release.set()
+        self.assertEqual(self.testActor1.plain_request('last', wait_for_result=True, timeout=5),
+                         'last')
+
+        # Neither the request that timed out nor the cancelled one was run
+        self.assertEqual(self.testActor1.request, ['last'])
+
+    def test_stats(self):
+        started = threading.Event()
+        release = threading.Event()
+        self.testActor1.block(started, release)
+        self.assertTrue(started.wait(5))
+
+        self.testActor1.plain_request(1)
+        self.testActor1.plain_request(2)
+        future = self.testActor1.plain_request(3)
+        release.set()
+        future.result(5)
+        # Stats are recorded after the result is delivered
+        self.testActor1.quit()
+
+        lines = self.testActor1.stats.summary()
+        self.assertEqual(lines[0], "4 messages, mailbox depth p50 1, p90 2, max 2")
+        self.assertEqual(sorted(line.split()[0] for line in lines[1:]),
+                         ['block', 'plain_request'])
+        self.assertEqual(self.testActor2.stats.summary(),
+                         ["0 messages, mailbox depth p50 0, p90 0, max 0"])
+
+
+class MailboxTests(unittest.TestCase):
+
+    def test_order(self):
+        mailbox = indexer.Mailbox()
+        msgs = [indexer.ActorCommandMsg(lambda i=i: i) for i in range(5)]
+
+        mailbox.put(msgs[0], indexer.PRIORITY_LOW)
+        mailbox.put(msgs[1])
+        mailbox.put(msgs[2], coalesce_key='k')
+        mailbox.put(msgs[3], indexer.PRIORITY_HIGH)
+        mailbox.put(msgs[4], coalesce_key='k')
+
+        self.assertEqual(len(mailbox), 4)
+        self.assertEqual([mailbox.get() for _ in range(4)],
+                         [msgs[3], msgs[1], msgs[4], msgs[0]])
+        self.assertEqual(len(mailbox), 0)
+
+    def test_superseded_result(self):
+        mailbox = indexer.Mailbox()
+        first = indexer.ActorCommandMsg(lambda: 'first', wait_for_result=True)
+        second = indexer.ActorCommandMsg(lambda: 'second', wait_for_result=True)
+
+        mailbox.put(first, coalesce_key='k')
+        mailbox.put(second, coalesce_key='k')
+        mailbox.get().run()
+
+        self.assertEqual(first.result(), 'second')
+        self.assertEqual(second.result(), 'second')
+
+    def test_superseded_cancelled(self):
+        mailbox = indexer.Mailbox()
+        first = indexer.ActorCommandMsg(lambda: 'first', wait_for_result=True)
+        second = indexer.ActorCommandMsg(lambda: 'second', wait_for_result=True)
+
+        mailbox.put(first, coalesce_key='k')
+        mailbox.put(second, coalesce_key='k')
+        second.future.cancel()
+        mailbox.get().run()
+
+        # Still run for the sender that did not cancel
+        self.assertEqual(first.result(), 'second')
+        self.assertTrue(second.future.cancelled())
+
+
+class ActorSchedulerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = indexer.ActorScheduler(2, 'Test')
+        self.actors = [TestActor(self.scheduler) for _ in range(5)]
+        for actor in self.actors:
+            actor.start()
+
+    def tearDown(self):
+        for actor in self.actors:
+            actor.quit()
+        self.scheduler.shutdown()
+
+    def test_sequential_per_actor(self):
+        for i in range(50):
+            for actor in self.actors:
+                actor.plain_request(i)
+
+        for actor in self.actors:
+            self.assertEqual(actor.plain_request('last', wait_for_result=True), 'last')
+            self.assertEqual(actor.request, list(range(50)) + ['last'])
+
+        self.assertEqual(len(self.scheduler._workers), 2)
+
+    def test_internal_call(self):
+        actor = self.actors[0]
+        req = actor.test_request(threading.get_ident(), wait_for_result=True)
+
+        # The nested call was made directly, on the same worker
+        self.assertEqual(actor.recv_count, 1)
+        self.assertEqual(req['receiver_id'], actor.request[0]['receiver_id'])
+
+    def test_worker_cap(self):
+        lock = threading.Lock()
+        # [running now, most running at once]
+        running = [0, 0]
+
+        def work():
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.1)
+            with lock:
+                running[0] -= 1
+
+        msgs = []
+        for actor in self.actors:
+            msg = indexer.ActorCommandMsg(work, wait_for_result=True)
+            actor.send(msg)
+            msgs.append(msg)
+
+        for msg in msgs:
+            msg.result()
+
+        self.assertEqual(running, [0, 2])
+
+    def test_messages_before_start(self):
+        actor = TestActor(self.scheduler)
+        msg = indexer.ActorCommandMsg(lambda: 'early', wait_for_result=True)
+        actor.send(msg)
+
+        self.assertEqual(len(actor._mailbox), 1)
+        actor.start()
+        self.assertEqual(msg.result(), 'early')
+
+        actor.quit()
+        self.assertFalse(actor._is_started())
+
+    def test_quit_does_not_wait(self):
+        release = threading.Event()
+        busy = [indexer.ActorCommandMsg(release.wait) for _ in range(2)]
+        self.actors[0].send(busy[0])
+        self.actors[1].send(busy[1])
+
+        # Both workers are busy, the queued messages are dropped
+        actor = self.actors[1]
+        queued = indexer.ActorCommandMsg(lambda: 'queued', wait_for_result=True)
+        actor.send(queued)
+        actor.quit()
+
+        self.assertTrue(queued.future.cancelled())
+        self.assertFalse(actor._is_started())
+        self.assertTrue(actor.plain_request('late').cancelled())
+        self.assertFalse(actor._terminated.is_set())
+
+        release.set()
+        self.assertTrue(actor._terminated.wait(5))
+        self.assertEqual(actor.request, [])
+        self.assertEqual(self.actors[0].plain_request('next', wait_for_result=True), 'next')
 
 
 class IndexerTests(unittest.TestCase):
 
     def setUp(self):
-        pass
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+        self.mconfig = MagicMock(indexer.IndexerConfig)
+        self.mconfig.is_complete = True
+        self.mconfig.db_location = self.tmp_dir.name
+        self.mconfig.watch_file_system = False
+        self.mconfig.watch_git_head = False
+        self.mconfig.secondary_db_shards = 1
+
+        self.test_obj = indexer.Indexer()
+        self.test_obj._perform_crawl = MagicMock()
+        self.test_obj.refresh = MagicMock()
+        self.test_obj.start()
 
     def tearDown(self):
-        pass
+        self.test_obj.quit()
+        self.tmp_dir.cleanup()
+
+    def test_warm_start_from_snapshot(self):
+        file_index = {(1, 42): DirRecord('/proj/src', ['main.c'], [125])}
+        indexer.snapshot.write_snapshot(self.tmp_dir.name, file_index, True)
+        open(os.path.join(self.tmp_dir.name, 'secondary.out'), 'w').close()
+
+        self.test_obj.set_config(self.mconfig, wait_for_result=True)
+
+        # The snapshot should be verified by a crawl, without forcing a rebuild
+        self.test_obj._perform_crawl.assert_called_once_with()
+        self.assertFalse(self.test_obj.refresh.called)
+        self.assertEqual(self.test_obj._file_index, file_index)
+        self.assertTrue(self.test_obj._two_tier_mode)
+
+    def test_snapshot_without_db(self):
+        file_index = {(1, 42): DirRecord('/proj/src', ['main.c'], [125])}
+        indexer.snapshot.write_snapshot(self.tmp_dir.name, file_index, True)
+
+        self.test_obj.set_config(self.mconfig, wait_for_result=True)
+
+        self.test_obj.refresh.assert_called_once_with()
+        self.assertFalse(self.test_obj._perform_crawl.called)
+        self.assertEqual(self.test_obj._file_index, {})
+
+    def test_snapshot_writes(self):
+        self.test_obj.set_config(self.mconfig, wait_for_result=True)
+        snapshot_file = indexer.snapshot.snapshot_path(self.tmp_dir.name)
+
+        full_res = {(1, 1): DirRecord('/proj/src', ['main.c'], [1])}
+        self.test_obj._crawl_result_ready((dict(full_res), None), wait_for_result=True)
+        self.assertEqual(indexer.snapshot.read_snapshot(self.tmp_dir.name)[0], full_res)
+
+        # Partial crawls leave the snapshot alone until the indexer quits
+        partial_res = {(1, 1): DirRecord('/proj/src', ['main.c'], [2])}
+        self.test_obj._crawl_result_ready((partial_res, ['/proj/src']), wait_for_result=True)
+        self.assertEqual(indexer.snapshot.read_snapshot(self.tmp_dir.name)[0], full_res)
+
+        self.test_obj.quit()
+        self.assertTrue(self.test_obj._terminated.wait(5))
+        self.assertEqual(indexer.snapshot.read_snapshot(self.tmp_dir.name)[0], partial_res)
+
+        # Nothing changed since
+        os.remove(snapshot_file)
+        self.test_obj._write_snapshot()
+        self.assertFalse(os.path.exists(snapshot_file))
+
+    def test_folders_changed(self):
+        self.test_obj.set_config(self.mconfig, wait_for_result=True)
+        self.test_obj._perform_crawl.reset_mock()
+
+        self.test_obj.folders_changed({'/proj/src'}, wait_for_result=True)
+
+        self.test_obj._perform_crawl.assert_called_once_with(partial_crawl=True)
+        self.assertEqual(self.test_obj._partial_crawl_queue, ['/proj/src'])
+
+        # A queue overflow in the watcher should result in a full crawl
+        self.test_obj._perform_crawl.reset_mock()
+        self.test_obj.folders_changed(indexer.file_watcher.ALL_FOLDERS, wait_for_result=True)
+
+        self.test_obj._perform_crawl.assert_called_once_with()
+
+    def _buffer_files(self, *names):
+        src = os.path.join(self.tmp_dir.name, 'src')
+        os.makedirs(src, exist_ok=True)
+        paths = [os.path.join(src, name) for name in names]
+        for path in paths:
+            open(path, 'w').close()
+
+        self.mconfig.file_matches.return_value = True
+        self.test_obj.set_config(self.mconfig, wait_for_result=True)
+        self.test_obj._perform_crawl.reset_mock()
+        self.test_obj._two_tier_mode = True
+        self.test_obj._gen_index = MagicMock()
+        return src, paths
+
+    def test_batched_buffer_changes(self):
+        self.mconfig.buffer_batch_window = 60
+        src, (a, b, c) = self._buffer_files('a.c', 'b.c', 'c.c')
+
+        for path in (a, b, c):
+            self.test_obj.promote_buffer(path, wait_for_result=True)
+
+        self.assertFalse(self.test_obj._gen_index.called)
+        self.test_obj._apply_buffer_changes(wait_for_result=True)
+
+        # One file list write for all promotions
+        self.test_obj._gen_index.assert_called_once_with(full_update=False)
+        self.assertEqual(self.test_obj._promotion_set, {a, b, c})
+
+        # The last change of a file wins
+        for path in (a, b, c):
+            self.test_obj.demote_buffer(path, wait_for_result=True)
+        self.test_obj.promote_buffer(c, wait_for_result=True)
+        self.test_obj._apply_buffer_changes(wait_for_result=True)
+
+        # One partial crawl for all demotions
+        self.test_obj._perform_crawl.assert_called_once_with(partial_crawl=True,
+                                                             send_always=True)
+        self.assertEqual(self.test_obj._demotion_set, {a, b})
+        self.assertEqual(self.test_obj._partial_crawl_queue, [src, src])
+        self.assertEqual(self.test_obj._gen_index.call_count, 1)
+
+    def test_batch_window(self):
+        self.mconfig.buffer_batch_window = 0.05
+        _, (a, b) = self._buffer_files('a.c', 'b.c')
+        applied = threading.Event()
+        self.test_obj._gen_index.side_effect = lambda **kwds: applied.set()
+
+        self.test_obj.promote_buffer(a, wait_for_result=True)
+        self.test_obj.promote_buffer(b, wait_for_result=True)
+
+        self.assertTrue(applied.wait(5))
+        self.test_obj._gen_index.assert_called_once_with(full_update=False)
+        self.assertEqual(self.test_obj._promotion_set, {a, b})
+
+    def test_no_batch_window(self):
+        self.mconfig.buffer_batch_window = 0
+        _, (a,) = self._buffer_files('a.c')
+
+        self.test_obj.promote_buffer(a, wait_for_result=True)
+
+        self.test_obj._gen_index.assert_called_once_with(full_update=False)
+        self.assertIsNone(self.test_obj._batch_timer)
+
+    def test_files_written(self):
+        self.mconfig.buffer_batch_window = 60
+        src, (a, b) = self._buffer_files('a.c', 'b.c')
+        self.test_obj.promote_buffer(a, wait_for_result=True)
+
+        # Saves of promoted buffers are already taken care of
+        self.test_obj.files_written({a}, wait_for_result=True)
+        self.assertFalse(self.test_obj._perform_crawl.called)
+
+        self.test_obj.files_written({a, b}, wait_for_result=True)
+        self.test_obj._perform_crawl.assert_called_once_with(partial_crawl=True)
+        self.assertEqual(self.test_obj._partial_crawl_queue, [src])
+
+        # The primary DB is indexed on the fly
+        self.test_obj._perform_crawl.reset_mock()
+        self.test_obj._two_tier_mode = False
+        self.test_obj.files_written({b}, wait_for_result=True)
+        self.assertFalse(self.test_obj._perform_crawl.called)
+
+    def test_crawl_delta(self):
+        self.test_obj.set_config(self.mconfig, wait_for_result=True)
+        primary_list = os.path.join(self.tmp_dir.name, indexer.PRIMARY_DB + '.files')
+
+        crawl_res = {(1, 42): DirRecord('/proj/src', ['main.c'], [125])}
+        self.test_obj._crawl_result_ready((crawl_res, None), wait_for_result=True)
+
+        self.assertEqual(self.test_obj._file_index, crawl_res)
+        with open(primary_list) as f:
+            self.assertEqual(f.read().split(), ['/proj/src/main.c'])
+
+        # An unchanged crawl keeps the index and doesn't touch the file list
+        with patch.object(self.test_obj, '_gen_index') as mock_gen_index:
+            self.test_obj._crawl_result_ready((dict(crawl_res), None), wait_for_result=True)
+            self.assertFalse(mock_gen_index.called)
+            self.assertEqual(self.test_obj._file_index, crawl_res)
+
+        # A modified file rebuilds the index without rewriting the file list
+        crawl_res = {(1, 42): DirRecord('/proj/src', ['main.c'], [135])}
+        with patch.object(self.test_obj, '_write_file_list') as mock_write:
+            self.test_obj._crawl_result_ready((crawl_res, None), wait_for_result=True)
+            self.assertFalse(mock_write.called)
+
+        # An added file rewrites it
+        crawl_res = {(1, 42): DirRecord('/proj/src', ['main.c', 'util.c'], [135, 1])}
+        self.test_obj._crawl_result_ready((crawl_res, None), wait_for_result=True)
+
+        with open(primary_list) as f:
+            self.assertEqual(f.read().split(), ['/proj/src/main.c', '/proj/src/util.c'])
+
+    def test_streamed_file_list(self):
+        self.test_obj.set_config(self.mconfig, wait_for_result=True)
+        primary_list = os.path.join(self.tmp_dir.name, indexer.PRIMARY_DB + '.files')
+        streamed_list = os.path.join(self.tmp_dir.name, indexer.STREAMED_FILE_LIST)
+
+        crawl_res = {(1, 42): DirRecord('/proj/src', ['main.c', 'a b.c'], [1, 2]),
+                     (1, 43): DirRecord('/proj/lib', ['lib.c'], [1])}
+
+        self.test_obj._open_streamed_list()
+        self.test_obj._crawl_batch_ready([crawl_res[(1, 42)]])
+        self.test_obj._crawl_batch_ready([crawl_res[(1, 43)]])
+
+        with patch.object(self.test_obj, '_write_file_list') as mock_write:
+            self.test_obj._crawl_result_ready((crawl_res, None), wait_for_result=True)
+            self.assertFalse(mock_write.called)
+
+        self.assertFalse(os.path.exists(streamed_list))
+        with open(primary_list) as f:
+            self.assertEqual(f.read().splitlines(),
+                             ['/proj/src/main.c', '"/proj/src/a b.c"', '/proj/lib/lib.c'])
+
+        # An unchanged crawl throws the streamed list away
+        self.test_obj._open_streamed_list()
+        self.test_obj._crawl_batch_ready(list(crawl_res.values()))
+        self.test_obj._crawl_result_ready((dict(crawl_res), None), wait_for_result=True)
+
+        self.assertFalse(os.path.exists(streamed_list))
+
+    def test_restart_cancels_crawl(self):
+        self.test_obj.set_config(self.mconfig, wait_for_result=True)
+        self.test_obj._crawler = MagicMock()
+        perform_crawl = partial(indexer.Indexer._perform_crawl, self.test_obj)
+
+        perform_crawl(wait_for_result=True)
+        first_token = self.test_obj._crawler.crawl.call_args[1]['cancel_token']
+
+        # Without restart the request is dropped while a crawl is running
+        perform_crawl(partial_crawl=True, wait_for_result=True)
+        self.assertEqual(self.test_obj._crawler.crawl.call_count, 1)
+
+        perform_crawl(restart=True, wait_for_result=True)
+        second_token = self.test_obj._crawler.crawl.call_args[1]['cancel_token']
+        self.assertEqual(self.test_obj._crawler.crawl.call_count, 2)
+        self.assertTrue(first_token.cancelled)
+        self.assertFalse(second_token.cancelled)
+
+        # The result of the first crawl is of no use
+        crawl_res = {(1, 42): DirRecord('/proj/src', ['main.c'], [125])}
+        self.test_obj._crawl_result_ready((crawl_res, None), cancel_token=first_token,
+                                          wait_for_result=True)
+        self.assertEqual(self.test_obj._file_index, {})
+        self.assertTrue(self.test_obj._crawl_in_progress)
+
+        self.test_obj._crawl_result_ready((crawl_res, None), cancel_token=second_token,
+                                          wait_for_result=True)
+        self.assertEqual(self.test_obj._file_index, crawl_res)
+        self.assertFalse(self.test_obj._crawl_in_progress)
+
+    def _real_crawls(self):
+        # Runs _perform_crawl for real, with a mock crawler
+        os.makedirs(os.path.join(self.tmp_dir.name, 'src'))
+        os.makedirs(os.path.join(self.tmp_dir.name, 'lib'))
+        self.mconfig.find_base_path.side_effect = lambda path: (self.tmp_dir.name, None)
+        self.test_obj.set_config(self.mconfig, wait_for_result=True)
+        self.test_obj._crawler = MagicMock()
+        self.test_obj._perform_crawl = partial(indexer.Indexer._perform_crawl, self.test_obj)
+
+    def _wait_for_crawls(self, count):
+        deadline = time.time() + 5
+        while self.test_obj._crawler.crawl.call_count < count and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.test_obj._crawler.crawl.call_count, count)
+        return self.test_obj._crawler.crawl.call_args[1]
+
+    def test_changes_during_full_crawl(self):
+        self._real_crawls()
+        src = os.path.join(self.tmp_dir.name, 'src')
+
+        self.test_obj._perform_crawl(wait_for_result=True)
+        token = self._wait_for_crawls(1)['cancel_token']
+
+        # Changed after the full crawl may have listed the folder
+        self.test_obj.folders_changed({src}, wait_for_result=True)
+        self.test_obj._crawl_result_ready(({}, None), cancel_token=token,
+                                          wait_for_result=True)
+
+        self.assertEqual(self._wait_for_crawls(2)['start_paths'], [src])
+
+    def test_cancelled_partial_crawl_requeued(self):
+        self._real_crawls()
+        src = os.path.join(self.tmp_dir.name, 'src')
+
+        self.test_obj.folders_changed({src}, wait_for_result=True)
+        token = self._wait_for_crawls(1)['cancel_token']
+        self.assertEqual(self.test_obj._partial_crawl_queue, [])
+
+        self.test_obj.cancel_work()
+        self.test_obj._crawl_result_ready(None, cancel_token=token, wait_for_result=True)
+
+        self.assertEqual(self.test_obj._partial_crawl_queue, [src])
+
+    def test_quit_during_crawl(self):
+        self.test_obj.set_config(self.mconfig, wait_for_result=True)
+        self.test_obj._perform_crawl = partial(indexer.Indexer._perform_crawl, self.test_obj)
+        crawler = self.test_obj._crawler
+        started = threading.Event()
+
+        def crawl(config, user_data, start_paths, incremental, batch_callback, cancel_token):
+            started.set()
+            while True:
+                cancel_token.check()
+                time.sleep(0.01)
+
+        with patch.object(crawler, '_crawl', side_effect=crawl):
+            self.test_obj._perform_crawl(wait_for_result=True)
+            self.assertTrue(started.wait(5))
+            token = self.test_obj._cancel_token
+
+            self.test_obj.quit()
+
+            # The crawl stops right away instead of running to the end
+            self.assertTrue(token.cancelled)
+            self.assertTrue(crawler._terminated.wait(5))
+            self.assertTrue(self.test_obj._terminated.wait(5))
+
+    def test_checkout_during_crawl(self):
+        self._real_crawls()
+        src = os.path.join(self.tmp_dir.name, 'src')
+        lib = os.path.join(self.tmp_dir.name, 'lib')
+
+        # The head watcher reports each checkout through folders_changed
+        self.test_obj.folders_changed({src}, wait_for_result=True)
+        token = self._wait_for_crawls(1)['cancel_token']
+        self.assertTrue(self.test_obj._crawl_in_progress)
+
+        self.test_obj.folders_changed({lib}, wait_for_result=True)
+        self.assertEqual(self.test_obj._crawler.crawl.call_count, 1)
+
+        self.test_obj._crawl_result_ready(({}, {}), cancel_token=token,
+                                          wait_for_result=True)
+
+        self.assertEqual(self._wait_for_crawls(2)['start_paths'], [lib])
+
+    def test_cancelled_build(self):
+        self.test_obj.set_config(self.mconfig, wait_for_result=True)
+        names = ['file%d.c' % i for i in range(indexer.TWO_TIER_THRESHOLD + 1)]
+        crawl_res = {(1, 42): DirRecord('/proj/src', names, list(range(len(names))))}
+
+        with patch.object(indexer.cscope_runner, 'start_generate_indexes',
+                          side_effect=Cancelled) as mock_generate:
+            self.test_obj._crawl_result_ready((crawl_res, None), wait_for_result=True)
+            self.assertTrue(mock_generate.called)
+            self.assertTrue(self.test_obj._index_outdated)
+
+        # The next crawl rebuilds the database, even though nothing changed
+        with patch.object(indexer.cscope_runner, 'start_generate_indexes',
+                          return_value=_done_future()) as mock_generate:
+            self.test_obj._crawl_result_ready((dict(crawl_res), None), wait_for_result=True)
+            self.assertTrue(mock_generate.called)
+            self.assertFalse(self.test_obj._index_outdated)
+
+    def test_build_on_process_loop(self):
+        self._real_crawls()
+        src = os.path.join(self.tmp_dir.name, 'src')
+        names = ['file%d.c' % i for i in range(indexer.TWO_TIER_THRESHOLD + 1)]
+        crawl_res = {(1, 42): DirRecord(src, names, list(range(len(names))))}
+        build = futures.Future()
+
+        with patch.object(indexer.cscope_runner, 'start_generate_indexes',
+                          return_value=build):
+            self.test_obj._crawl_result_ready((crawl_res, None), wait_for_result=True)
+
+        # The worker is free while cscope runs, and the refresh is not done
+        self.test_obj.folders_changed({src}, wait_for_result=True)
+        self.assertTrue(self.test_obj._crawl_in_progress)
+        self.assertTrue(self.test_obj._index_outdated)
+        self.assertEqual(self.test_obj._crawler.crawl.call_count, 0)
+
+        # What changed during the build is crawled once it is done
+        build.set_result([MagicMock()])
+        self.assertEqual(self._wait_for_crawls(1)['start_paths'], [src])
+        self.assertFalse(self.test_obj._index_outdated)
+        self.assertFalse(self.test_obj._force_rebuild_db)
+
+    def test_sharded_build(self):
+        self.mconfig.secondary_db_shards = 3
+        self.mconfig.base_paths.return_value = (('/proj', True),)
+        self.test_obj.set_config(self.mconfig, wait_for_result=True)
+        db_location = self.tmp_dir.name
+
+        folders = ['/proj/dir%d' % i for i in range(6)]
+        names = ['file%d.c' % i for i in range(indexer.TWO_TIER_THRESHOLD // 5)]
+        crawl_res = {(1, i): DirRecord(folder, names, list(range(len(names))))
+                        for i, folder in enumerate(folders)}
+
+        # Left over from the unsharded DB and from more shards
+        for name in ('secondary.out', 'secondary.files', 'secondary-5.out'):
+            open(os.path.join(db_location, name), 'w').close()
+
+        def build(cwd, win, shard_names, **kwds):
+            for name in shard_names:
+                open(os.path.join(cwd, name + '.out'), 'w').close()
+            return _done_future()
+
+        # The folders are all the same size, so they are dealt out in order
+        expected = {}
+        for i, folder in enumerate(folders):
+            expected.setdefault('secondary-%d' % (i % 3), set()).update(
+                                    os.path.join(folder, name) for name in names)
+
+        with patch.object(indexer.cscope_runner, 'start_generate_indexes',
+                          side_effect=build) as mock_generate:
+            self.test_obj._crawl_result_ready((crawl_res, None), wait_for_result=True)
+            self.assertTrue(self.test_obj._two_tier_mode)
+            self.assertEqual(sorted(mock_generate.call_args[0][2]), sorted(expected))
+
+        for name, files in expected.items():
+            with open(os.path.join(db_location, name + '.files')) as f:
+                self.assertEqual({line.strip() for line in f}, files)
+
+        self.assertEqual(indexer.secondary_db_shards(db_location), sorted(expected))
+        self.assertFalse(os.path.exists(os.path.join(db_location, 'secondary.out')))
+        self.assertFalse(os.path.exists(os.path.join(db_location, 'secondary.files')))
+
+        # Only the shard of the modified folder is rebuilt
+        crawl_res = dict(crawl_res)
+        crawl_res[(1, 2)] = DirRecord(folders[2], names, [1] + list(range(1, len(names))))
+
+        with patch.object(indexer.cscope_runner, 'start_generate_indexes',
+                          side_effect=build) as mock_generate:
+            self.test_obj._crawl_result_ready((crawl_res, None), wait_for_result=True)
+            mock_generate.assert_called_once_with(
+                    db_location, None, ['secondary-2'],
+                    force_rebuild=False, cancel_token=self.test_obj._cancel_token)
+
+        # A new top level folder goes to the shard with the fewest files, and
+        # its sub folders go with it
+        crawl_res[(1, 6)] = DirRecord('/proj/new', names[:1], [0])
+        crawl_res[(1, 7)] = DirRecord('/proj/new/sub', names[:1], [0])
+        crawl_res[(1, 2)] = DirRecord(folders[2], names[:-1], list(range(len(names) - 1)))
+
+        with patch.object(indexer.cscope_runner, 'start_generate_indexes',
+                          side_effect=build) as mock_generate:
+            self.test_obj._crawl_result_ready((crawl_res, None), wait_for_result=True)
+            self.assertEqual(mock_generate.call_args[0][2], ['secondary-2'])
+
+        with open(os.path.join(db_location, 'secondary-2.files')) as f:
+            self.assertIn('/proj/new/sub/file0.c', {line.strip() for line in f})
+
+    def test_pack_shards(self):
+        sizes = {'/p/a': 50, '/p/b': 30, '/p/c': 20, '/p/d': 10}
+
+        shard_map = indexer._pack_shards(sizes, 2, {})
+        self.assertEqual(shard_map, {'/p/a': 0, '/p/b': 1, '/p/c': 1, '/p/d': 0})
+
+        # Folders keep their shard, new ones go to the lightest shard
+        sizes['/p/e'] = 5
+        del sizes['/p/b']
+        self.assertEqual(indexer._pack_shards(sizes, 2, shard_map),
+                         {'/p/a': 0, '/p/c': 1, '/p/d': 0, '/p/e': 1})
+
+        # Folders in shards that no longer exist are packed again
+        self.assertEqual(indexer._pack_shards(sizes, 1, {'/p/a': 0, '/p/c': 3}),
+                         {'/p/a': 0, '/p/c': 0, '/p/d': 0, '/p/e': 0})
+
+    def test_top_level_folder(self):
+        base_paths = ['/p/nested', '/p']
+
+        self.assertEqual(indexer._top_level_folder('/p', base_paths), '/p')
+        self.assertEqual(indexer._top_level_folder('/p/a/b/c', base_paths), '/p/a')
+        self.assertEqual(indexer._top_level_folder('/p/nested/x/y', base_paths), '/p/nested/x')
+        self.assertEqual(indexer._top_level_folder('/other/a', base_paths), '/other/a')
+
+    def test_skipped_files_report(self):
+        self.test_obj.set_config(self.mconfig, wait_for_result=True)
+        stats = CrawlStats()
+        stats.skipped_files = {'/proj/src/a/big.h': 'too large', '/proj/lib/bin.c': 'binary'}
+        self.test_obj._crawler._last_stats = stats
+        self.test_obj._crawl_result_ready(({}, None), wait_for_result=True)
+
+        self.assertEqual(self.test_obj.get_skipped_files(wait_for_result=True),
+                         stats.skipped_files)
+
+        # A partial crawl only replaces the files below the crawled sub trees
+        stats = CrawlStats()
+        stats.skipped_files = {'/proj/src/a/gen.h': 'generated'}
+        self.test_obj._crawler._last_stats = stats
+        self.test_obj._crawl_result_ready(({}, ['/proj/src/a']), wait_for_result=True)
+
+        self.assertEqual(self.test_obj.get_skipped_files(wait_for_result=True),
+                         {'/proj/src/a/gen.h': 'generated', '/proj/lib/bin.c': 'binary'})
+
+    def test_partial_crawl_paths(self):
+        self.test_obj.set_config(self.mconfig, wait_for_result=True)
+        root = os.path.realpath(self.tmp_dir.name)
+        for sub in ('src/a', 'src/ab', 'tests/b'):
+            os.makedirs(os.path.join(root, sub))
+
+        self.mconfig.find_base_path.side_effect = lambda path: (
+                    (root, True) if path.startswith(root) else (None, False))
+        self.test_obj._partial_crawl_queue = [
+                    os.path.join(root, 'src/a/x'),
+                    os.path.join(root, 'src/a/gone/deeper'),
+                    os.path.join(root, 'src/ab'),
+                    os.path.join(root, 'tests/b'),
+                    os.path.join(root, 'tests/b/c'),
+                    '/outside/project']
+
+        self.assertEqual(self.test_obj._partial_crawl_paths(),
+                         [os.path.join(root, p) for p in ('src/a', 'src/ab', 'tests/b')])
+
+    def test_partial_crawl_result(self):
+        self.test_obj.set_config(self.mconfig, wait_for_result=True)
+
+        full_res = {(1, 1): DirRecord('/proj', ['main.c'], [1]),
+                    (1, 2): DirRecord('/proj/src/a', ['a.c'], [1]),
+                    (1, 3): DirRecord('/proj/src/ab', ['ab.c'], [1]),
+                    (1, 4): DirRecord('/proj/tests/b', ['b.c'], [1])}
+        self.test_obj._crawl_result_ready((dict(full_res), None), wait_for_result=True)
+
+        partial_res = {(1, 2): DirRecord('/proj/src/a', ['a.c'], [2]),
+                       (1, 5): DirRecord('/proj/tests/b/new', ['n.c'], [1])}
+        with patch.object(self.test_obj, '_gen_index') as mock_gen_index:
+            self.test_obj._crawl_result_ready((partial_res, ['/proj/src/a', '/proj/tests/b']),
+                                              wait_for_result=True)
+
+        delta = mock_gen_index.call_args[1]['delta']
+        self.assertEqual(delta.modified, ['/proj/src/a/a.c'])
+        self.assertEqual(sorted(delta.added + delta.removed),
+                         ['/proj/tests/b/b.c', '/proj/tests/b/new/n.c'])
+
+        # folders outside of the crawled sub trees are kept as they were
+        self.assertEqual(self.test_obj._file_index[(1, 1)], full_res[(1, 1)])
+        self.assertEqual(self.test_obj._file_index[(1, 3)], full_res[(1, 3)])
+        self.assertNotIn((1, 4), self.test_obj._file_index)
+
+        # The tree of the index is updated rather than built again
+        tree = self.test_obj._merkle_tree
+        expected = MerkleTree(self.test_obj._file_index)
+        self.assertEqual(tree.roots, expected.roots)
+        for record in self.test_obj._file_index.values():
+            self.assertEqual(tree.tree_hash(record.path), expected.tree_hash(record.path))
 
 
 
@@ -171,8 +990,9 @@ class CrawlerTests(unittest.TestCase):
         self.bps = ['testfolder/sources', 'testfolder/headers']
         self.mconfig.base_paths.return_value = [(self.bps[0], True), (self.bps[1], True)]
         self.mconfig.find_base_path.return_value = (self.bps[0], True)
-        self.mconfig.file_matches.side_effect = self.mock_matches
-        self.mconfig.folder_matches.side_effect = self.mock_matches
+        self.mconfig.file_name_matches.side_effect = self.mock_matches
+        self.mconfig.folder_name_matches.side_effect = self.mock_matches
+        self.mconfig.crawler_engine = indexer.CRAWLER_ENGINE_WALK
 
         self.test_obj = indexer.Crawler()
         self.test_obj.start()
@@ -181,7 +1001,7 @@ class CrawlerTests(unittest.TestCase):
         self.test_obj.quit()
 
 
-    def mock_matches(self, dirpath, element, st_mode=0, base_path=None):
+    def mock_matches(self, dirpath, element, base_path=None, stats=None):
         self.assertIsNotNone(self.selector_data)
 
         p = os.path.join(dirpath, element)
@@ -227,9 +1047,11 @@ class CrawlerTests(unittest.TestCase):
 
         mock = MagicMock()
         mock.st_mode = mode
+        mock.st_dev = DUMMY_ST_DEV
         mock.st_ino = ino
         mock.st_size = size
         mock.st_mtime = mtime
+        mock.st_mtime_ns = mtime
 
         return mock
 
@@ -354,19 +1176,19 @@ class CrawlerTests(unittest.TestCase):
 
     def gen_expected_result_subdir(self, curr_path, subdir_data,
                                    selector_data, exp_result):
-        result = {}
-        exp_result[subdir_data['ino']] = result
-        result['path'] = curr_path
-        result['files'] = []
-        result['magic'] = 0
+        files = []
+        hashes = []
 
         if 'fdata' in subdir_data:
             for i, f in enumerate(subdir_data['fdata']['files']):
                 p = os.path.join(curr_path, f)
                 if selector_data[p]:
-                    result['files'].append(f)
-                    result['magic'] += subdir_data['fdata']['sizes'][i] + \
-                                        subdir_data['fdata']['mtimes'][i]
+                    files.append(f)
+                    hashes.append(file_hash(subdir_data['fdata']['mtimes'][i],
+                                            subdir_data['fdata']['sizes'][i],
+                                            subdir_data['fdata']['inos'][i]))
+
+        exp_result[(DUMMY_ST_DEV, subdir_data['ino'])] = DirRecord(curr_path, files, hashes)
 
         for sd in set(subdir_data.keys()) - set(('ino', 'fdata')):
             p = os.path.join(curr_path, sd)
@@ -415,6 +1237,380 @@ class CrawlerTests(unittest.TestCase):
 
 
 
+@unittest.skipUnless(indexer.scandir_crawler.HAS_SCANDIR, "os.scandir not available")
+class ScandirCrawlerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.realpath(self.tmp_dir.name)
+
+        self.mconfig = MagicMock(indexer.IndexerConfig)
+        self.mconfig.find_base_path.return_value = (self.root, True)
+        self.mconfig.base_paths.return_value = [(self.root, True)]
+        self.mconfig.file_name_matches.side_effect = self.mock_file_name_matches
+        self.mconfig.folder_name_matches.side_effect = self.mock_folder_name_matches
+        self.mconfig.crawler_threads = 4
+
+        self.test_obj = indexer.Crawler()
+        self.test_obj.start()
+
+    def tearDown(self):
+        self.test_obj.quit()
+        self.tmp_dir.cleanup()
+
+    def mock_file_name_matches(self, dirpath, file_name, base_path, stats=None):
+        return file_name.endswith('.c')
+
+    def mock_folder_name_matches(self, dirpath, folder, base_path, stats=None):
+        return folder != 'out'
+
+    def gen_tree(self, levels=3, subdirs=3, files=4):
+        def gen_level(path, level):
+            for i in range(files):
+                for ext in ('.c', '.o'):
+                    with open(os.path.join(path, 'file%d%s' % (i, ext)), 'w') as f:
+                        f.write('x' * (i + level))
+            if level > 0:
+                for i in range(subdirs):
+                    sub = os.path.join(path, 'sub%d' % i)
+                    os.mkdir(sub)
+                    gen_level(sub, level - 1)
+
+        gen_level(self.root, levels)
+        os.mkdir(os.path.join(self.root, 'out'))
+        with open(os.path.join(self.root, 'out', 'generated.c'), 'w') as f:
+            f.write('x')
+
+    def crawl(self, engine):
+        self.mconfig.crawler_engine = engine
+        return self.test_obj.crawl(self.mconfig, 'test', wait_for_result=True)
+
+    def test_same_result_as_walk(self):
+        self.gen_tree()
+
+        walk_res, _ = self.crawl(indexer.CRAWLER_ENGINE_WALK)
+        scandir_res, ud = self.crawl(indexer.CRAWLER_ENGINE_SCANDIR)
+
+        self.assertEqual(ud, 'test')
+        self.assertEqual(len(scandir_res), 1 + 3 + 9 + 27)
+        self.assertEqual(walk_res, scandir_res)
+
+        for folder in scandir_res.values():
+            self.assertFalse(folder.path.endswith('out'))
+            self.assertEqual(sorted(folder.files), ['file%d.c' % i for i in range(4)])
+
+    def test_network_crawl_mode(self):
+        # enough files per folder to be stat:ed in several batches
+        self.gen_tree(levels=2, files=40)
+        walk_res, _ = self.crawl(indexer.CRAWLER_ENGINE_WALK)
+        walk_stats = self.test_obj.last_stats
+
+        self.mconfig.crawl_mode.return_value = indexer.CRAWL_MODE_NETWORK
+        self.mconfig.network_crawler_threads = 8
+        with patch(_network_mount_to_mock, return_value=True) as mock_is_network:
+            network_res, _ = self.crawl(indexer.CRAWLER_ENGINE_WALK)
+        network_stats = self.test_obj.last_stats
+
+        self.mconfig.crawl_mode.assert_called_with(self.root)
+        mock_is_network.assert_called_with(self.root)
+        self.assertEqual(network_res, walk_res)
+        self.assertEqual(network_stats.rejected_by_name, walk_stats.rejected_by_name)
+        self.assertEqual(network_stats.listdir_calls, walk_stats.listdir_calls)
+
+    def test_network_crawl_mode_on_local_folder(self):
+        self.gen_tree(levels=1)
+        walk_res, _ = self.crawl(indexer.CRAWLER_ENGINE_WALK)
+
+        self.mconfig.crawl_mode.return_value = indexer.CRAWL_MODE_NETWORK
+        self.mconfig.network_crawler_threads = 8
+        with patch(_network_mount_to_mock, return_value=False), \
+             patch.object(self.test_obj._network_crawler, 'crawl') as mock_crawl:
+            res, _ = self.crawl(indexer.CRAWLER_ENGINE_WALK)
+
+        self.assertFalse(mock_crawl.called)
+        self.assertEqual(res, walk_res)
+
+    def test_skipped_files(self):
+        self.gen_tree(levels=1)
+        config = MagicMock(indexer.IndexerConfig)
+        config._file_guard = FileGuard(max_size=3)
+        self.mconfig.file_content_matches.side_effect = partial(
+                                    indexer.IndexerConfig.file_content_matches, config)
+
+        # file<i>.c is i + level bytes, so only file3.c in the root is too large
+        expected = [os.path.join(self.root, 'file3.c')]
+
+        for engine in (indexer.CRAWLER_ENGINE_WALK, indexer.CRAWLER_ENGINE_SCANDIR):
+            res, _ = self.crawl(engine)
+            skipped = self.test_obj.last_stats.skipped_files
+
+            self.assertEqual(sorted(skipped), expected)
+            self.assertNotIn('file3.c', [r for r in res.values() if r.path == self.root][0])
+
+    def test_skipped_files_incremental(self):
+        self.gen_tree(levels=1)
+        config = MagicMock(indexer.IndexerConfig)
+        config._file_guard = FileGuard(max_size=3)
+        self.mconfig.file_content_matches.side_effect = partial(
+                                    indexer.IndexerConfig.file_content_matches, config)
+        self.mconfig.crawler_engine = indexer.CRAWLER_ENGINE_SCANDIR
+        self.mconfig.network_crawler_threads = 8
+
+        for path, _, _ in os.walk(self.root):
+            os.utime(path, (1000000000, 1000000000))
+
+        expected = [os.path.join(self.root, 'file3.c')]
+
+        for crawl_mode in (indexer.CRAWL_MODE_LOCAL, indexer.CRAWL_MODE_NETWORK):
+            self.mconfig.crawl_mode.return_value = crawl_mode
+            with patch(_network_mount_to_mock, return_value=True):
+                self.test_obj.crawl(self.mconfig, None, wait_for_result=True)
+
+                # The root folder is carried forward from the cache
+                with patch(_scandir_to_mock, wraps=os.scandir) as mock_scandir:
+                    self.test_obj.crawl(self.mconfig, None, incremental=True,
+                                        wait_for_result=True)
+
+            self.assertFalse(mock_scandir.called)
+            self.assertEqual(sorted(self.test_obj.last_stats.skipped_files), expected)
+
+    def test_rejected_names_not_stated(self):
+        self.gen_tree(levels=1)
+
+        # 4 folders with 4 .c and 4 .o files each, and 'out'
+        for engine in (indexer.CRAWLER_ENGINE_WALK, indexer.CRAWLER_ENGINE_SCANDIR):
+            self.mconfig.folder_visited.reset_mock()
+            self.crawl(engine)
+            stats = self.test_obj.last_stats
+
+            self.assertEqual(stats.rejected_by_name, 16 + 1)
+            self.assertEqual(stats.listdir_calls, 4)
+            self.assertEqual(stats.stat_calls, 16 + 1 + 3)
+            self.assertEqual(sorted(c[0][0] for c in self.mconfig.folder_visited.call_args_list),
+                             [self.root] + [os.path.join(self.root, 'sub%d' % i)
+                                                for i in range(3)])
+
+    def test_streamed_batches(self):
+        self.gen_tree(levels=2)
+        # The scandir engine prefers the real file over the symlink, even
+        # though the symlink comes first in path order
+        os.symlink(os.path.join(self.root, 'sub2', 'file0.c'),
+                   os.path.join(self.root, 'sub0', 'link.c'))
+        os.link(os.path.join(self.root, 'sub1', 'file1.c'),
+                os.path.join(self.root, 'sub2', 'hard_link.c'))
+
+        for engine in (indexer.CRAWLER_ENGINE_WALK, indexer.CRAWLER_ENGINE_SCANDIR):
+            batches = []
+            self.mconfig.crawler_engine = engine
+            with patch.object(indexer, 'STREAM_BATCH_SIZE', 4):
+                res, _ = self.test_obj.crawl(self.mconfig, None, wait_for_result=True,
+                                             batch_callback=batches.append)
+
+            self.assertGreater(len(batches), 1)
+            streamed = [record for batch in batches for record in batch]
+            self.assertEqual(sorted(r.path for r in streamed),
+                             sorted(r.path for r in res.values()))
+            for record in streamed:
+                self.assertIs(record, [r for r in res.values() if r.path == record.path][0])
+
+            files = [os.path.join(r.path, f) for r in res.values() for f in r.files]
+            self.assertEqual(len([f for f in files if f.endswith('file1.c') or
+                                                      f.endswith('hard_link.c')]), 13)
+            link_files = [f for f in files if f in (os.path.join(self.root, 'sub0', 'link.c'),
+                                                    os.path.join(self.root, 'sub2', 'file0.c'))]
+            self.assertEqual(len(link_files), 1)
+
+        self.assertEqual(link_files, [os.path.join(self.root, 'sub2', 'file0.c')])
+
+    def test_symlinked_folders_crawled_once(self):
+        self.gen_tree(levels=1)
+        os.symlink(os.path.join(self.root, 'sub0'), os.path.join(self.root, 'a_link'))
+        os.symlink(self.root, os.path.join(self.root, 'sub1', 'loop'))
+
+        res, _ = self.crawl(indexer.CRAWLER_ENGINE_SCANDIR)
+
+        paths = sorted(folder.path for folder in res.values())
+        self.assertEqual(paths, [self.root] + [os.path.join(self.root, 'sub%d' % i)
+                                                                    for i in range(3)])
+
+    def test_cancelled_crawl(self):
+        self.gen_tree(levels=2)
+
+        for engine in (indexer.CRAWLER_ENGINE_WALK, indexer.CRAWLER_ENGINE_SCANDIR):
+            token = CancelToken()
+
+            def cancel_on_first_file(dirpath, file_name, base_path, stats=None):
+                token.cancel()
+                return True
+
+            self.mconfig.file_name_matches.side_effect = cancel_on_first_file
+            self.mconfig.crawler_engine = engine
+            self.assertIsNone(self.test_obj.crawl(self.mconfig, 'test', cancel_token=token,
+                                                  wait_for_result=True))
+
+        # A token that is not cancelled doesn't get in the way
+        self.mconfig.file_name_matches.side_effect = self.mock_file_name_matches
+        res, _ = self.test_obj.crawl(self.mconfig, 'test', cancel_token=CancelToken(),
+                                     wait_for_result=True)
+        self.assertEqual(len(res), 1 + 3 + 9)
+
+    def test_partial_crawl(self):
+        self.gen_tree(levels=2)
+        start_paths = [os.path.join(self.root, 'sub1')]
+
+        res, ud = self.test_obj.crawl(self.mconfig, start_paths, start_paths=start_paths,
+                                      wait_for_result=True)
+
+        self.assertEqual(ud, start_paths)
+        self.assertEqual(len(res), 4)
+        for folder in res.values():
+            self.assertTrue(folder.path.startswith(start_paths[0]))
+
+    def test_partial_crawl_disjoint_paths(self):
+        self.gen_tree(levels=2)
+        self.mconfig.crawler_engine = indexer.CRAWLER_ENGINE_SCANDIR
+        start_paths = [os.path.join(self.root, 'sub0', 'sub2'),
+                       os.path.join(self.root, 'sub2')]
+
+        res, _ = self.test_obj.crawl(self.mconfig, start_paths, start_paths=start_paths,
+                                     wait_for_result=True)
+
+        paths = sorted(folder.path for folder in res.values())
+        self.assertEqual(paths, [start_paths[0]] + [start_paths[1]] +
+                                [os.path.join(start_paths[1], 'sub%d' % i) for i in range(3)])
+
+    def test_incremental_crawl(self):
+        self.gen_tree(levels=2)
+        self.mconfig.crawler_engine = indexer.CRAWLER_ENGINE_SCANDIR
+
+        # Make sure the folders are not considered racy by the crawler
+        for path, _, _ in os.walk(self.root):
+            os.utime(path, (1000000000, 1000000000))
+
+        full_res, _ = self.test_obj.crawl(self.mconfig, None, wait_for_result=True)
+
+        # Add a file in one folder and modify a file in place in another one
+        with open(os.path.join(self.root, 'sub1', 'new_file.c'), 'w') as f:
+            f.write('new')
+        with open(os.path.join(self.root, 'sub2', 'file0.c'), 'a') as f:
+            f.write('more data')
+
+        with patch(_scandir_to_mock, wraps=os.scandir) as mock_scandir:
+            res, _ = self.test_obj.crawl(self.mconfig, None, incremental=True,
+                                         wait_for_result=True)
+
+        # Only the modified folder should have been listed
+        mock_scandir.assert_called_once_with(os.path.join(self.root, 'sub1'))
+
+        self.assertEqual(len(res), len(full_res))
+        for key, folder in res.items():
+            if folder.path == os.path.join(self.root, 'sub1'):
+                self.assertIn('new_file.c', folder.files)
+            else:
+                # in place modifications are not picked up by incremental crawls
+                self.assertEqual(folder, full_res[key])
+
+        res, _ = self.test_obj.crawl(self.mconfig, None, wait_for_result=True)
+        self.assertNotEqual(res, full_res)
+
+
+
+    def test_ignore_files(self):
+        self.gen_tree(levels=2)
+        with open(os.path.join(self.root, '.gitignore'), 'w') as f:
+            f.write('/sub1/\nfile3.c\n')
+        with open(os.path.join(self.root, 'sub2', '.ignore'), 'w') as f:
+            f.write('!file3.c\n')
+
+        config = MagicMock(indexer.IndexerConfig)
+        config._file_exts = {'.c'}
+        config._matchers = {self.root: FolderConfigMatcher([], [], [], ['out'])}
+        config._ignore_files = IgnoreFiles()
+        config._nested_folders = set()
+        self.mconfig.file_name_matches.side_effect = partial(
+                                    indexer.IndexerConfig.file_name_matches, config)
+        self.mconfig.folder_name_matches.side_effect = partial(
+                                    indexer.IndexerConfig.folder_name_matches, config)
+        self.mconfig.begin_crawl.side_effect = config._ignore_files.revalidate
+
+        for engine in (indexer.CRAWLER_ENGINE_WALK, indexer.CRAWLER_ENGINE_SCANDIR):
+            res, _ = self.crawl(engine)
+
+            paths = sorted(r.path for r in res.values())
+            self.assertNotIn(os.path.join(self.root, 'sub1'), paths)
+            self.assertEqual(len(paths), 1 + 2 + 6)
+            # sub1 and its sub folders are never listed
+            self.assertEqual(self.test_obj.last_stats.listdir_calls, 9)
+
+            for record in res.values():
+                expected = 4 if record.path.startswith(os.path.join(self.root, 'sub2')) else 3
+                self.assertEqual(len(record.files), expected, record.path)
+
+    def test_nested_project_folders(self):
+        self.gen_tree(levels=2)
+        sub1 = os.path.join(self.root, 'sub1')
+        root_link = os.path.join(sub1, 'sub0', 'root_link.c')
+        os.link(os.path.join(self.root, 'file0.c'), root_link)
+
+        win = IndexerConfigTests.gen_mock_window(1)
+        IndexerConfigTests.add_folder_to_window(win, sub1, file_excludes=['file0.c'])
+        IndexerConfigTests.add_folder_to_window(win, self.root)
+        with patch(_os_to_mock + '.path.exists', return_value=True):
+            config = indexer.IndexerConfig(win)
+
+        for engine in (indexer.CRAWLER_ENGINE_WALK, indexer.CRAWLER_ENGINE_SCANDIR):
+            config._crawler_engine = engine
+            for start_paths in (None, [self.root]):
+                res, _ = self.test_obj.crawl(config, None, start_paths=start_paths,
+                                             wait_for_result=True)
+
+                # Every folder is listed once, including the 'out' folder
+                self.assertEqual(len(res), 1 + 3 + 9 + 1)
+                self.assertEqual(self.test_obj.last_stats.listdir_calls, len(res))
+
+                files = [os.path.join(r.path, f) for r in res.values() for f in r.files]
+                self.assertEqual(len(files), 13 * 4 + 1 - 4)
+                self.assertNotIn(root_link, files)
+                # The patterns of the nested folder apply below it
+                self.assertNotIn(os.path.join(sub1, 'file0.c'), files)
+                self.assertNotIn(os.path.join(sub1, 'sub2', 'file0.c'), files)
+                self.assertIn(os.path.join(self.root, 'sub0', 'file0.c'), files)
+
+
+@unittest.skipIf(os.name == 'nt', "no mount table on Windows")
+class NetworkMountTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.mounts_file = os.path.join(self.tmp_dir.name, 'mounts')
+        with open(self.mounts_file, 'w') as f:
+            f.write('/dev/sda1 / ext4 rw,relatime 0 0\n'
+                    'server:/export /mnt/nfs nfs4 rw 0 0\n'
+                    '/dev/sdb1 /mnt/nfs/local ext4 rw 0 0\n'
+                    '//server/share /mnt/my\\040share cifs rw 0 0\n'
+                    'tmpfs /mnt/over tmpfs rw 0 0\n'
+                    'server:/over /mnt/over nfs rw 0 0\n')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def fs_type(self, path):
+        return indexer.scandir_crawler._mount_fs_type(path, self.mounts_file)
+
+    def test_mount_fs_type(self):
+        self.assertEqual(self.fs_type('/home/me/src'), 'ext4')
+        self.assertEqual(self.fs_type('/mnt/nfs'), 'nfs4')
+        self.assertEqual(self.fs_type('/mnt/nfs/src'), 'nfs4')
+        self.assertEqual(self.fs_type('/mnt/nfs/local/src'), 'ext4')
+        self.assertEqual(self.fs_type('/mnt/nfsx'), 'ext4')
+        self.assertEqual(self.fs_type('/mnt/my share/src'), 'cifs')
+        self.assertEqual(self.fs_type('/mnt/over/src'), 'nfs')
+
+    def test_no_mount_table(self):
+        self.assertIsNone(indexer.scandir_crawler._mount_fs_type(
+                            '/mnt/nfs', os.path.join(self.tmp_dir.name, 'missing')))
+
+
 class IndexerConfigTests(unittest.TestCase):
     def setUp(self):
         pass
@@ -632,6 +1828,38 @@ class IndexerConfigTests(unittest.TestCase):
                                                DUMMY_FOLDER_ST_MODE,
                                                base_path))
 
+    def test_nested_folders(self):
+        win = self.gen_mock_window(1)
+        self.add_folder_to_window(win, '/src/product', follow_links=False)
+        self.add_folder_to_window(win, '/src/product/drivers/', file_excludes=['*_test.c'])
+        self.add_folder_to_window(win, '/src/product2')
+
+        with patch(_os_to_mock + '.path.exists', return_value=True) as mock_os:
+            config = indexer.IndexerConfig(win)
+
+        self.assertEqual(config.find_base_path('/src/product/drivers/usb'),
+                         ('/src/product/drivers', True))
+        self.assertEqual(config.find_base_path('/src/product/drivers'),
+                         ('/src/product/drivers', True))
+        self.assertEqual(config.find_base_path('/src/product/driverless'),
+                         ('/src/product', False))
+        self.assertEqual(config.find_base_path('/src/product2/lib'), ('/src/product2', True))
+        self.assertEqual(config.find_base_path('/src/prod'), (None, None))
+
+        # The nested folder is pruned from the crawl of the outer one
+        self.assertFalse(config.folder_name_matches('/src/product', 'drivers', '/src/product'))
+        self.assertTrue(config.folder_name_matches('/src/product', 'lib', '/src/product'))
+        self.assertTrue(config.folder_name_matches('/src', 'product2', '/src/product2'))
+
+        with patch(_os_to_mock + '.stat') as mock_stat:
+            mock_stat.return_value.st_mode = DUMMY_FILE_ST_MODE
+            self.assertFalse(config.file_matches('/src/product/drivers', 'usb_test.c'))
+            self.assertTrue(config.file_matches('/src/product', 'usb_test.c'))
+
+            mock_stat.return_value.st_mode = DUMMY_FOLDER_ST_MODE
+            self.assertTrue(config.folder_matches('/src/product', 'lib'))
+            mock_stat.assert_called_with('/src/product/lib', follow_symlinks=False)
+
 
 # For some reason, this doesn't work.  The dict doesn't get unpatch
 # after each test.
@@ -0,0 +1,74 @@
+import os
+import fnmatch
+import unittest
+
+from .. import pattern_matcher
+
+
+PATTERNS = ['*.o', '*.log', '*test*', 'out', 'build*', '?ource.c', '[abc]*.h',
+            '[!x]y.c', '*/gen/*', 'prefix*.*', '*.tar.gz', '.*', 'a[', '*BACKUP*',
+            'src/*.c']
+
+NAMES = [('/proj/src', 'main.c'), ('/proj/src', 'main.o'), ('/proj/test/sub', 'x.c'),
+         ('/proj', 'out'), ('/proj/src', 'out'), ('/proj', 'build_x86'),
+         ('/proj', 'source.c'), ('/proj', 'a.h'), ('/proj/b', 'd.h'), ('/proj', 'zy.c'),
+         ('/proj', 'xy.c'), ('/proj/gen', 'parser.c'), ('/proj', 'prefixsrc.c'),
+         ('/proj', 'prefix'), ('/proj', 'x.tar.gz'), ('/proj', '.hidden'),
+         ('/proj', 'a['), ('/proj', 'file.BACKUP.c'), ('/proj/src', 'util.c'),
+         ('/proj/src.o', 'readme'), ('/proj', '.o')]
+
+
+def _fnmatch_any(patterns, dirpath, name):
+    full_path = os.path.join(dirpath, name)
+    return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(full_path, p) for p in patterns)
+
+
+class PatternMatcherTests(unittest.TestCase):
+
+    def test_same_as_fnmatch(self):
+        for pattern in PATTERNS:
+            matcher = pattern_matcher.PatternMatcher([pattern])
+            for dirpath, name in NAMES:
+                self.assertEqual(matcher.matches(dirpath, name),
+                                 _fnmatch_any([pattern], dirpath, name),
+                                 "%s: %s" % (pattern, os.path.join(dirpath, name)))
+
+    def test_combined_patterns(self):
+        matcher = pattern_matcher.PatternMatcher(PATTERNS)
+        for dirpath, name in NAMES:
+            self.assertEqual(matcher.matches(dirpath, name),
+                             _fnmatch_any(PATTERNS, dirpath, name))
+
+    def test_empty(self):
+        matcher = pattern_matcher.PatternMatcher([])
+        self.assertFalse(matcher)
+        self.assertFalse(matcher.matches('/proj', 'main.c'))
+
+    def test_equality(self):
+        self.assertEqual(pattern_matcher.PatternMatcher(['*.o', '*.c']),
+                         pattern_matcher.PatternMatcher(['*.c', '*.o', '*.c']))
+        self.assertNotEqual(pattern_matcher.PatternMatcher(['*.o']),
+                            pattern_matcher.PatternMatcher(['*.c']))
+
+    def test_folder_config_matcher(self):
+        matcher = pattern_matcher.FolderConfigMatcher(['*.c', '*.h'], ['*test*'],
+                                                      [], ['out'], ['*BACKUP*'])
+
+        self.assertTrue(matcher.file_matches('/proj', 'main.c'))
+        self.assertFalse(matcher.file_matches('/proj', 'main.o'))
+        self.assertFalse(matcher.file_matches('/proj', 'main_test.c'))
+        self.assertFalse(matcher.file_matches('/proj', 'main.BACKUP.c'))
+
+        self.assertTrue(matcher.folder_matches('/proj', 'src'))
+        self.assertFalse(matcher.folder_matches('/proj', 'out'))
+        self.assertFalse(matcher.folder_matches('/proj', 'BACKUP'))
+
+        # decisions are memoized
+        self.assertFalse(matcher.folder_matches('/proj', 'out'))
+        self.assertEqual(len(matcher._folder_memo), 3)
+
+    def test_index_blacklist_without_folder_blacklist(self):
+        matcher = pattern_matcher.FolderConfigMatcher([], [], [], [], ['*.p'])
+
+        self.assertFalse(matcher.file_matches('/proj', 'main.p'))
+        self.assertTrue(matcher.file_matches('/proj', 'main.c'))
@@ -0,0 +1,116 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from concurrent import futures
+
+from .. import process_loop
+
+
+def _python(code):
+    return [sys.executable, '-c', code]
+
+
+@unittest.skipUnless(process_loop.HAS_ASYNCIO, "asyncio subprocesses are not supported")
+class ProcessLoopTests(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = process_loop.ProcessLoop('Test loop')
+        self.lines = []
+
+    def tearDown(self):
+        self.loop.shutdown()
+
+    def test_lines(self):
+        code = "import sys; sys.stdout.write('a\\r\\n\\nb\\n'); sys.stderr.write('c'); sys.exit(3)"
+        future = self.loop.run_process(_python(code), self.lines.append)
+
+        self.assertEqual(future.result(10), 3)
+        self.assertEqual(sorted(self.lines), ['a', 'b', 'c'])
+
+    def test_concurrent(self):
+        # Each process waits for the file created by the one started after
+        # it, which only works if they all run at once.
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = [os.path.join(tmp_dir, str(i)) for i in range(5)]
+            open(paths[-1], 'w').close()
+
+            results = [[] for _ in range(4)]
+            code = ("import os, time\n"
+                    "open(%r, 'w').close()\n"
+                    "while not os.path.exists(%r): time.sleep(0.01)\n"
+                    "print(%d)")
+            procs = [self.loop.run_process(_python(code % (paths[i], paths[i + 1], i)),
+                                           results[i].append, timeout=10)
+                     for i in range(4)]
+
+            self.assertEqual([f.result(20) for f in procs], [0] * 4)
+            self.assertEqual(results, [['0'], ['1'], ['2'], ['3']])
+
+    def test_on_line_raises(self):
+        def on_line(line):
+            raise ValueError(line)
+
+        code = "import time\nprint('first', flush=True)\ntime.sleep(30)"
+        future = self.loop.run_process(_python(code), on_line)
+
+        with self.assertRaises(ValueError):
+            future.result(10)
+
+    def test_timeout(self):
+        code = "import time\nprint('first', flush=True)\ntime.sleep(30)"
+        future = self.loop.run_process(_python(code), self.lines.append, timeout=0.5)
+
+        with self.assertRaises(futures.TimeoutError):
+            future.result(10)
+        self.assertEqual(self.lines, ['first'])
+
+    def test_cancel(self):
+        started = futures.Future()
+        code = "import time\nprint('first', flush=True)\ntime.sleep(30)"
+        future = self.loop.run_process(_python(code), started.set_result)
+
+        self.assertEqual(started.result(10), 'first')
+        self.assertTrue(future.cancel())
+
+        with self.assertRaises(futures.CancelledError):
+            future.result()
+
+        self.loop.shutdown()
+        self.assertEqual(self.loop.num_running, 0)
+
+    def test_no_output_after_cancel(self):
+        started = futures.Future()
+
+        def on_line(line):
+            self.lines.append(line)
+            if not started.done():
+                started.set_result(line)
+
+        code = "while True: print('line', flush=True)"
+        future = self.loop.run_process(_python(code), on_line)
+        started.result(10)
+
+        future.cancel()
+        num_lines = len(self.lines)
+        time.sleep(0.2)
+
+        # Only a line that was being handed over while cancelling
+        self.assertLessEqual(len(self.lines), num_lines + 1)
+
+    def test_missing_executable(self):
+        future = self.loop.run_process(['/nonexistent/cscope'], self.lines.append)
+
+        with self.assertRaises(OSError):
+            future.result(10)
+
+    def test_shutdown_kills(self):
+        code = "import time\nprint('first', flush=True)\ntime.sleep(30)"
+        started = futures.Future()
+        future = self.loop.run_process(_python(code), started.set_result)
+        started.result(10)
+
+        self.loop.shutdown()
+        with self.assertRaises(futures.CancelledError):
+            future.result(0)
@@ -0,0 +1,68 @@
+
+import os
+import struct
+import tempfile
+import unittest
+
+from .. import snapshot
+from ..file_index import DirRecord
+
+
+class SnapshotTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_location = self.tmp_dir.name
+
+        self.file_index = {
+            (2049, 123): DirRecord('/proj/src', ['main.c', 'util.c', 'file with spaces.h'],
+                                   [2**64 - 1, 1439288534, 0]),
+            (2049, 456): DirRecord('/proj/src/empty'),
+            (2050, 123): DirRecord('/proj/\udcffbroken', ['åäö.c'], [17]),
+            (2050, 2**64 - 1): DirRecord('/proj/large_ino', ['a.c'], [1])
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        snapshot.write_snapshot(self.db_location, self.file_index, True)
+        file_index, two_tier_mode = snapshot.read_snapshot(self.db_location)
+
+        self.assertTrue(two_tier_mode)
+        self.assertEqual(file_index, self.file_index)
+
+        snapshot.write_snapshot(self.db_location, self.file_index, False)
+        _, two_tier_mode = snapshot.read_snapshot(self.db_location)
+
+        self.assertFalse(two_tier_mode)
+
+    def test_missing_snapshot(self):
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.read_snapshot(self.db_location)
+
+    def test_wrong_version(self):
+        snapshot.write_snapshot(self.db_location, self.file_index, True)
+
+        with open(snapshot.snapshot_path(self.db_location), 'r+b') as f:
+            f.seek(4)
+            f.write(struct.pack('<H', snapshot.SNAPSHOT_VERSION + 1))
+
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.read_snapshot(self.db_location)
+
+    def test_truncated_snapshot(self):
+        snapshot.write_snapshot(self.db_location, self.file_index, True)
+        file_name = snapshot.snapshot_path(self.db_location)
+
+        with open(file_name, 'r+b') as f:
+            f.truncate(os.path.getsize(file_name) - 3)
+
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.read_snapshot(self.db_location)
+
+    def test_remove_snapshot(self):
+        snapshot.write_snapshot(self.db_location, self.file_index, True)
+        snapshot.remove_snapshot(self.db_location)
+
+        self.assertFalse(os.path.exists(snapshot.snapshot_path(self.db_location)))
@@ -0,0 +1,136 @@
+import select
+import threading
+import time
+import traceback
+
+from ..SublimeCscope import DEBUG, PACKAGE_NAME
+
+
+class Watcher:
+    """
+    Base class of the watchers served by a WatchThread. fileno() is the file
+    descriptor the thread waits for, or -1, and read_events() is called when
+    it is readable. tick() is called at least every tick_interval seconds.
+    close() is called by the thread once the watcher has been stopped.
+    """
+
+    tick_interval = 1.0
+
+    def __init__(self, watch_thread=None):
+        self._watch_thread = watch_thread or shared_thread
+        self._running = False
+
+    def start(self):
+        if self._running:
+            return
+
+        self._running = True
+        self._watch_thread.add(self)
+
+    def stop(self):
+        """ Never blocks, the thread may be in the middle of serving the watcher """
+        if not self._running:
+            return
+
+        self._running = False
+        self._watch_thread.remove(self)
+
+    def fileno(self):
+        return -1
+
+    def read_events(self):
+        pass
+
+    def tick(self, now):
+        pass
+
+    def close(self):
+        pass
+
+
+class WatchThread:
+    """
+    Runs the file system and git HEAD watchers of all projects on one thread,
+    so that the number of threads does not grow with the number of open
+    windows. The thread is started by the first watcher and exits once the
+    last one has been stopped.
+    """
+
+    def __init__(self, name='Watcher'):
+        self._name = name
+        self._lock = threading.Lock()
+        self._watchers = []
+        # Stopped, but not closed by the thread yet
+        self._stopped = []
+        self._thread = None
+
+    @property
+    def num_watchers(self):
+        return len(self._watchers)
+
+    def add(self, watcher):
+        with self._lock:
+            self._watchers.append(watcher)
+
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name=self._name)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def remove(self, watcher):
+        with self._lock:
+            if watcher in self._watchers:
+                self._watchers.remove(watcher)
+                self._stopped.append(watcher)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                stopped = self._stopped
+                self._stopped = []
+                watchers = list(self._watchers)
+
+                if not watchers and not stopped:
+                    self._thread = None
+                    break
+
+            for watcher in stopped:
+                self._call(watcher.close)
+
+            if watchers:
+                self._wait(watchers)
+
+        if DEBUG:
+            print("%s: %s thread stopped" % (PACKAGE_NAME, self._name))
+
+    def _wait(self, watchers):
+        timeout = min(watcher.tick_interval for watcher in watchers)
+        fds = {watcher.fileno(): watcher for watcher in watchers if watcher.fileno() >= 0}
+
+        if fds:
+            try:
+                readable, _, _ = select.select(list(fds.keys()), [], [], timeout)
+            except (OSError, ValueError):
+                readable = []
+
+            for fd in readable:
+                self._call(fds[fd].read_events)
+        else:
+            time.sleep(timeout)
+
+        now = time.time()
+        for watcher in watchers:
+            # Stopped watchers are not called back any more
+            if watcher in self._watchers:
+                self._call(watcher.tick, now)
+
+    def _call(self, func, *args):
+        # One broken watcher must not take the others down
+        try:
+            func(*args)
+        except Exception:
+            traceback.print_exc()
+
+
+# Serves the watchers of all projects
+shared_thread = WatchThread()